@@ -0,0 +1,346 @@
+#! /usr/bin/python
+
+# Benchmark suite for the converter: times each stage of the conversion (parse, each of the Converter stages, and writing
+# the JSON), on the sample presets and on a larger synthetic corpus made from them, and checks for regressions against a
+# saved baseline. It also checks that the sample presets still convert to the same filters as the reference (golden) JSON
+# presets, so that a speedup can't silently change the output.
+
+# Usage: python benchConvert.py [directory...] [--scale N] [--repeat N] [--save] [--threshold 0.25] [--update-goldens]
+# (default directory is xmpPresets, with the golden presets in jsonPresets)
+
+# Timings are the best of --repeat passes over each corpus, in microseconds per preset. The baseline (benchBaseline.json by
+# default) is machine specific, so save one on the machine that the comparisons will be run on (--save). A stage counts as
+# a regression if it is slower than the baseline by more than the threshold (as a fraction) and by more than --floor us
+# (very short stages are too noisy to compare on their own)
+
+import os, os.path
+import sys
+import re
+import json
+import random
+import platform
+import argparse
+
+import convertXMP
+
+
+baselineFile = "benchBaseline.json"
+
+# numbers in the golden presets are compared with this tolerance (the JSON round trip, and float formatting, can change
+# the last few digits)
+goldenTolerance = 1e-6
+
+# attributes that are not perturbed in the synthetic corpus (they select the process version etc., not adjustments)
+fixedAttributes = set([ "Version", "ProcessVersion", "Temperature" ])
+
+numberPattern = re.compile(r'(crs:(\w+)=")([+-]?)(\d+)(\.\d+)?(")')
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="*", default=["xmpPresets"], help="XMP files or directories to search for XMP files")
+    parser.add_argument("--goldens", default="jsonPresets", help="directory containing the golden JSON presets (for xmpPresets)")
+    parser.add_argument("--scale", type=int, default=20,
+                        help="size of the synthetic corpus, as a multiple of the number of input files (0 to skip it)")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed passes over each corpus (the best is used)")
+    parser.add_argument("--parser", choices=["auto", "stdlib", "libxmp"], default=convertXMP.defaultParser,
+                        help="XMP parser backend")
+    parser.add_argument("--baseline", default=baselineFile, help="baseline file to compare against (and save to)")
+    parser.add_argument("--save", action="store_true", help="save the timings as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="fraction by which a stage has to be slower than the baseline to count as a regression")
+    parser.add_argument("--floor", type=float, default=5.0,
+                        help="minimum slowdown (us/preset) for a stage to count as a regression")
+    parser.add_argument("--update-goldens", dest="updateGoldens", action="store_true",
+                        help="rewrite the golden presets from the current converter output")
+    args = parser.parse_args()
+
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    fileList = findFiles(args.inputs)
+    if len(fileList) == 0:
+        print("ERROR: no XMP files found")
+        sys.exit(1)
+    samples = []
+    for f in fileList:
+        with open(f, 'r') as inf:
+            samples.append((f, inf.read()))
+
+    failed = False
+
+    # check (or update) the output against the golden presets
+    if args.goldens and os.path.isdir(args.goldens):
+        if args.updateGoldens:
+            updateGoldens(args.inputs, args.goldens, args.parser)
+        elif not checkGoldens(args.inputs, args.goldens, args.parser):
+            failed = True
+        print("")
+
+    corpora = [ ("samples", samples) ]
+    if args.scale > 0:
+        corpora.append(("synthetic", syntheticCorpus(samples, args.scale)))
+
+    results = {}
+    for name, presets in corpora:
+        results[name] = timeCorpus(presets, args.parser, args.repeat)
+        printTimings(name, len(presets), results[name])
+
+    baseline = loadBaseline(args.baseline)
+    if baseline is not None:
+        if not compareBaseline(baseline, results, args.threshold, args.floor):
+            failed = True
+    else:
+        print("No baseline found (" + args.baseline + "), use --save to create one")
+
+    if args.save:
+        saveBaseline(args.baseline, results, args)
+        print("Saved baseline to: " + args.baseline)
+
+    if failed:
+        sys.exit(1)
+
+
+# ----------------------------
+
+
+def findFiles(inputs):
+    fileList = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for f in files:
+                    if f.lower().endswith(".xmp"):
+                        fileList.append(os.path.join(root, f))
+        else:
+            fileList.append(path)
+    fileList.sort()
+    return fileList
+
+
+# makes a larger corpus from the sample presets: scale copies of each one, with the numeric settings perturbed (the same
+# way on every run), so that the converter sees a realistic spread of values rather than the same few presets
+def syntheticCorpus(samples, scale):
+    rng = random.Random(1234)
+    corpus = []
+    for i in range(scale):
+        for f, text in samples:
+            corpus.append((f + "#" + str(i), numberPattern.sub(lambda m: perturb(m, rng), text)))
+    return corpus
+
+
+# returns the perturbed text for one attribute (keeping the format of the original, i.e. sign and integer/decimal)
+def perturb(match, rng):
+    prefix, attribute, sign, whole, fraction, suffix = match.groups()
+    if attribute in fixedAttributes:
+        return match.group(0)
+    value = float(sign + whole + (fraction or ""))
+    value = value * rng.uniform(0.8, 1.2) + rng.uniform(-10.0, 10.0)
+    if fraction:
+        text = "%.*f" % (len(fraction) - 1, abs(value))
+    else:
+        text = "%d" % abs(round(value))
+    if value < 0:
+        text = "-" + text
+    elif sign == "+":
+        text = "+" + text
+    return prefix + text + suffix
+
+
+# ----------------------------
+
+
+# converts every preset in the corpus, repeat times, and returns the best (lowest) total time for each stage,
+# in microseconds per preset
+def timeCorpus(presets, parser, repeat):
+    converter = convertXMP.Converter(parser=parser)
+    best = {}
+    for i in range(repeat):
+        converter.timings = {}
+        for name, text in presets:
+            preset = converter.runStep("convert", converter.convert, text, name)
+            converter.runStep("serialize", convertXMP.presetText, preset)
+        for stage, (seconds, count) in converter.timings.items():
+            micros = 1000000.0 * seconds / len(presets)
+            if (stage not in best) or (micros < best[stage]):
+                best[stage] = micros
+    return best
+
+
+def printTimings(name, count, timings):
+    print("Corpus: %s (%d presets)" % (name, count))
+    print("    %-26s %10.2f us/preset  %10.1f presets/s" % ("total", totalTime(timings), 1000000.0 / totalTime(timings)))
+    for stage in stageOrder(timings):
+        print("    %-26s %10.2f us/preset" % (stage, timings[stage]))
+    print("")
+
+
+# total time to convert and serialise a preset ("convert" includes all of the stages)
+def totalTime(timings):
+    return timings.get("convert", 0.0) + timings.get("serialize", 0.0)
+
+
+# the stages in the order they are run
+def stageOrder(timings):
+    order = [ "convert", "parse" ] + convertXMP.Converter.stages + [ "optimizeFilters", "bakeLookups", "serialize" ]
+    return [ stage for stage in order if stage in timings ] + sorted(set(timings.keys()) - set(order))
+
+
+# ----------------------------
+
+
+def loadBaseline(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def saveBaseline(path, results, args):
+    baseline = { "machine": { "platform": platform.platform(),
+                              "processor": platform.processor() or platform.machine(),
+                              "python": platform.python_version() },
+                 "parser": convertXMP.resolveParser(args.parser),
+                 "scale": args.scale,
+                 "repeat": args.repeat,
+                 "corpora": results }
+    with open(path, 'w') as f:
+        f.write(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+
+
+# compares the timings with the baseline, and prints any regressions. Returns False if there were any
+def compareBaseline(baseline, results, threshold, floor):
+    if baseline.get("machine", {}).get("platform") != platform.platform():
+        print("WARNING: baseline was saved on a different machine (" + str(baseline.get("machine", {}).get("platform")) + ")")
+    regressions = 0
+    for name in sorted(results.keys()):
+        old = baseline.get("corpora", {}).get(name)
+        if old is None:
+            print("Baseline has no timings for corpus: " + name)
+            continue
+        for stage in stageOrder(results[name]):
+            if stage not in old:
+                continue
+            slower = results[name][stage] - old[stage]
+            if (slower > threshold * old[stage]) and (slower > floor):
+                regressions = regressions + 1
+                print("REGRESSION: %s/%s %.2f us/preset (baseline %.2f, %+.0f%%)"
+                      % (name, stage, results[name][stage], old[stage], 100.0 * slower / old[stage]))
+    print("Regressions: " + str(regressions))
+    return regressions == 0
+
+
+# ----------------------------
+
+
+# returns the XMP files that have a golden preset, as (source, golden path) pairs. Only the input directories are checked
+def goldenPresets(inputs, goldens):
+    fileList = []
+    for path in inputs:
+        if os.path.isdir(path):
+            fileList.extend(convertXMP.findPresets(path, goldens))
+    return fileList
+
+
+# converts the inputs and compares them with the golden presets. Returns False if any of them differ
+def checkGoldens(inputs, goldens, parser):
+    converter = convertXMP.Converter(parser=parser)
+    checked = 0
+    missing = 0
+    mismatches = 0
+    for src, golden in goldenPresets(inputs, goldens):
+        if not os.path.isfile(golden):
+            missing = missing + 1
+            print("No golden preset for: " + src)
+            continue
+        with open(golden, 'r') as f:
+            expected = json.load(f)
+        with open(src, 'rb') as f:
+            actual = json.loads(convertXMP.presetText(converter.convert(f.read(), golden)))
+        checked = checked + 1
+        diffs = comparePresets(expected, actual)
+        if len(diffs) > 0:
+            mismatches = mismatches + 1
+            print("MISMATCH: " + src + " (" + golden + ")")
+            for d in diffs[:10]:
+                print("    " + d)
+            if len(diffs) > 10:
+                print("    ... " + str(len(diffs) - 10) + " more")
+    print("Goldens: %d checked, %d mismatches, %d missing" % (checked, mismatches, missing))
+    return mismatches == 0
+
+
+def updateGoldens(inputs, goldens, parser):
+    converter = convertXMP.Converter(parser=parser)
+    count = 0
+    for src, golden in goldenPresets(inputs, goldens):
+        with open(src, 'rb') as f:
+            preset = converter.convert(f.read(), golden)
+        if convertXMP.writePreset(golden, convertXMP.presetText(preset).encode("utf-8")):
+            count = count + 1
+    print("Goldens: " + str(count) + " updated")
+
+
+# returns a list of the differences between two presets. The "key" entry is ignored (it depends on where the preset
+# was converted from), as is the order of entries in a map, but the order of the filters matters
+def comparePresets(expected, actual):
+    expected = dict(expected)
+    actual = dict(actual)
+    expected.pop("key", None)
+    actual.pop("key", None)
+    diffs = []
+    compareValues("", expected, actual, diffs)
+    return diffs
+
+
+def compareValues(path, expected, actual, diffs):
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(set(expected.keys()) | set(actual.keys())):
+            if key not in actual:
+                diffs.append("missing: " + path + "/" + key)
+            elif key not in expected:
+                diffs.append("extra: " + path + "/" + key)
+            else:
+                compareValues(path + "/" + key, expected[key], actual[key], diffs)
+    elif isinstance(expected, list) and isinstance(actual, list):
+        if len(expected) != len(actual):
+            diffs.append(path + ": " + str(len(expected)) + " entries != " + str(len(actual)) + " " + describeList(expected, actual))
+            return
+        for i, (e, a) in enumerate(zip(expected, actual)):
+            compareValues(path + "[" + str(i) + "]" + itemName(e), e, a, diffs)
+    elif isNumber(expected) and isNumber(actual):
+        if abs(expected - actual) > goldenTolerance * max(1.0, abs(expected)):
+            diffs.append(path + ": " + repr(expected) + " != " + repr(actual))
+    elif expected != actual:
+        diffs.append(path + ": " + repr(expected) + " != " + repr(actual))
+
+
+def isNumber(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+# returns the filter (or parameter) key of a list item, to make the paths in the differences readable
+def itemName(item):
+    if isinstance(item, dict) and "key" in item:
+        return "(" + str(item["key"]) + ")"
+    return ""
+
+
+# lists the filter keys, if the lists hold filters
+def describeList(expected, actual):
+    if all(isinstance(item, dict) and "key" in item for item in expected + actual):
+        return "(" + ", ".join(item["key"] for item in expected) + " != " + ", ".join(item["key"] for item in actual) + ")"
+    return ""
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#! /usr/bin/python
+
+# Script to compare the NumPy curve interpolation (curves.py) with the scipy UnivariateSpline version it replaced:
+#   - import (startup) time of each
+#   - cost of fitting and sampling a master curve plus R/G/B curves, as done for each preset
+#   - largest difference between the two
+
+# Usage: python benchCurves.py [--curves N]
+
+import sys
+import time
+import subprocess
+import argparse
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--curves", type=int, default=2000, help="number of (random) presets to interpolate")
+    args = parser.parse_args()
+
+    # startup: time a fresh interpreter that just does the import
+    base = importTime("pass")
+    print("Import time (excluding interpreter startup):")
+    print("    numpy + curves.py:  %7.1f ms" % (1000.0 * (importTime("import curves") - base)))
+    print("    scipy.interpolate:  %7.1f ms" % (1000.0 * (importTime("from scipy.interpolate import UnivariateSpline") - base)))
+
+    import numpy as np
+    import curves
+
+    # random curves with 2..8 points, similar to those found in presets (0..255 scale converted to 0..1)
+    rng = np.random.RandomState(1)
+    presets = []
+    for i in range(args.curves):
+        presets.append([ randomCurve(rng) for c in range(4) ])
+    grid = [ 0.0, 0.25, 0.5, 0.75, 1.0 ]
+
+    # NumPy version: the master curve and the three colour curves in one call (as in convertXMP.py)
+    start = time.time()
+    numpyResults = []
+    for preset in presets:
+        numpyResults.append(curves.sampleCurves(preset, grid))
+    numpyTime = time.time() - start
+
+    scipyTime = None
+    try:
+        from scipy.interpolate import UnivariateSpline
+        start = time.time()
+        scipyResults = []
+        for preset in presets:
+            rows = []
+            for x, y in preset:
+                spline = UnivariateSpline(x, y, s=0, k=curves.splineDegree(len(x)))
+                rows.append([ float(spline(g)) for g in grid ])
+            scipyResults.append(rows)
+        scipyTime = time.time() - start
+    except ImportError:
+        print("scipy not installed, skipping comparison")
+
+    count = 4 * len(presets)
+    print("Per curve (fit + sample %d points):" % len(grid))
+    print("    numpy:  %7.1f us" % (1.0e6 * numpyTime / count))
+    if scipyTime is not None:
+        print("    scipy:  %7.1f us" % (1.0e6 * scipyTime / count))
+        diff = max(np.max(np.abs(np.array(a) - np.array(b))) for a, b in zip(numpyResults, scipyResults))
+        print("Max difference: %g" % diff)
+
+
+# ----------------------------
+
+
+def importTime(statement, repeat=5):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        subprocess.check_call([ sys.executable, "-c", statement ])
+        elapsed = time.time() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return best
+
+
+def randomCurve(rng):
+    count = rng.randint(2, 9)
+    x = [ 0.0 ] + sorted(rng.choice(range(1, 255), count-2, replace=False)) + [ 255.0 ]
+    y = [ min(255.0, max(0.0, v + rng.uniform(-40.0, 40.0))) for v in x ]
+    return ([ float(v) / 255 for v in x ], [ float(v) / 255 for v in y ])
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#! /usr/bin/python
+
+# Script to check that the memory used to parse a sidecar doesn't grow with the parts of the file that the converter doesn't
+# read. The sample sidecar is padded out to each of the given sizes with the kind of data found in real sidecars (an
+# xmp:Thumbnails preview, photoshop:History, xmpMM:History and crs: local correction brush strokes), and for each file this
+# shows the peak memory (tracemalloc) and time of:
+#   - xmpParser.parseProperties, reading the file as it parses (as in single file mode)
+#   - iterparse, clearing each property once it has been read (the way the parser used to work)
+#   - the complete conversion of the file (convertXMP.openInput + Converter.convert)
+# and checks that the properties are the same as for the original sample.
+
+# Usage: python benchMemory.py [--sizes 1,4,16] [--keep]      (sizes in MB)
+
+import os, os.path
+import sys
+import time
+import shutil
+import tempfile
+import tracemalloc
+import argparse
+import xml.etree.ElementTree as ET
+
+import xmpParser
+
+
+sampleFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_sidecar.xmp")
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1,4,16", help="comma separated list of file sizes to test, in MB")
+    parser.add_argument("--keep", action="store_true", help="keep the generated files (the directory is printed)")
+    args = parser.parse_args()
+
+    with open(sampleFile, 'r') as f:
+        sample = f.read()
+    expected = xmpParser.parseProperties(sample)
+
+    import convertXMP
+    converter = convertXMP.Converter(log=open(os.devnull, 'w'))
+
+    def convert(path):
+        source = convertXMP.openInput(path)
+        try:
+            return converter.convert(source, path)
+        finally:
+            source.close()
+
+    tests = [ ("stream", streamProperties),
+              ("iterparse", iterparseProperties),
+              ("convert", convert) ]
+
+    tmpdir = tempfile.mkdtemp(prefix="benchMemory")
+    failed = False
+    try:
+        original = os.path.join(tmpdir, "original.xmp")
+        with open(original, 'w') as f:
+            f.write(sample)
+        files = [ ("sample", original) ]
+        for size in [ float(s) for s in args.sizes.split(",") ]:
+            path = os.path.join(tmpdir, "bloated%g.xmp" % size)
+            with open(path, 'w') as f:
+                f.write(bloatSidecar(sample, int(size * 1024 * 1024)))
+            files.append(("%g MB" % size, path))
+
+        print("%-8s %10s   %s" % ("file", "size", "   ".join("%-24s" % name for name, test in tests)))
+        print("%-8s %10s   %s" % ("", "", "   ".join("%-24s" % "peak memory / time" for name, test in tests)))
+        for label, path in files:
+            columns = []
+            for name, test in tests:
+                convert(original) # warm up (imports etc.), so that only the file being tested is measured
+                start = time.time()
+                test(path)
+                elapsed = time.time() - start
+                tracemalloc.start()
+                test(path)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                columns.append("%-24s" % ("%8.1f KB %8.1f ms" % (peak / 1024.0, 1000.0 * elapsed)))
+            print("%-8s %8.1f KB   %s" % (label, os.path.getsize(path) / 1024.0, "   ".join(columns)))
+
+            props = streamProperties(path)
+            if props != expected:
+                failed = True
+                print("MISMATCH: the properties of " + path + " are not the same as the sample")
+    finally:
+        if args.keep:
+            print("Files are in " + tmpdir)
+        else:
+            shutil.rmtree(tmpdir)
+
+    if failed:
+        sys.exit(1)
+
+
+# ----------------------------
+
+
+def streamProperties(path):
+    with open(path, 'rb') as f:
+        return xmpParser.parseProperties(f)
+
+
+# the properties, as they were read before xmpParser.PropertyTarget: iterparse builds every element, and each property
+# (direct child of a description) is cleared after it has been read
+def iterparseProperties(path):
+    depth = 0
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            depth = depth + 1
+        else:
+            depth = depth - 1
+            if depth == 3:
+                elem.clear()
+
+
+# ----------------------------
+
+
+# returns the sample sidecar with non-preset data added to the description, to make it (at least) size bytes:
+# a quarter each of thumbnail, Photoshop history, xmpMM history and local corrections
+def bloatSidecar(sample, size):
+    part = max(0, size - len(sample)) // 4
+    padding = [ thumbnail(part), photoshopHistory(part), mmHistory(part), corrections(part) ]
+    end = sample.rindex("</rdf:Description>")
+    return sample[:end] + "".join(padding) + sample[end:]
+
+
+def thumbnail(size):
+    line = "/9j/4AAQSkZJRgABAgEASABIAAD/7QAsUGhvdG9zaG9wIDMuMAA4QklNA+0AAAAAABAASAAAAAEA&#xA;"
+    return ('   <xmp:Thumbnails xmlns:xmp="http://ns.adobe.com/xap/1.0/" xmlns:xmpGImg="http://ns.adobe.com/xap/1.0/g/img/">\n'
+            '    <rdf:Alt>\n     <rdf:li rdf:parseType="Resource">\n'
+            '      <xmpGImg:format>JPEG</xmpGImg:format>\n      <xmpGImg:image>' + line * (size // len(line)) +
+            '</xmpGImg:image>\n     </rdf:li>\n    </rdf:Alt>\n   </xmp:Thumbnails>\n')
+
+
+def photoshopHistory(size):
+    line = "2017-05-06T01:08:21+01:00&#x9;File IMG_0001.CR2 opened&#xA;Adjust Exposure, Contrast and Clarity&#xA;"
+    return ('   <photoshop:History xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/">' + line * (size // len(line)) +
+            '</photoshop:History>\n')
+
+
+def mmHistory(size):
+    item = ('     <rdf:li stEvt:action="saved" stEvt:instanceID="xmp.iid:4d1f6c1c-0a4e-4c4c-9d5e-2f0e3c6a7b8d"'
+            ' stEvt:when="2017-05-06T01:08:21+01:00" stEvt:softwareAgent="Adobe Photoshop Lightroom Classic 7.3"'
+            ' stEvt:changed="/metadata"/>\n')
+    return ('   <xmpMM:History xmlns:xmpMM="http://ns.adobe.com/xap/1.0/mm/"'
+            ' xmlns:stEvt="http://ns.adobe.com/xap/1.0/sType/ResourceEvent#">\n    <rdf:Seq>\n' +
+            item * (size // len(item)) + '    </rdf:Seq>\n   </xmpMM:History>\n')
+
+
+def corrections(size):
+    dab = '        <rdf:li>d 0.412345 0.387654</rdf:li>\n'
+    count = max(1, size // (len(dab) * 50))
+    stroke = ('     <rdf:li crs:What="Correction" crs:CorrectionAmount="1.000000" crs:CorrectionActive="true"'
+              ' crs:LocalExposure2012="0.250000">\n      <crs:CorrectionMasks>\n       <rdf:Seq>\n'
+              '        <rdf:li crs:What="Mask/Paint" crs:Radius="0.045" crs:Flow="1.000000" crs:CenterWeight="0.000000">\n'
+              '         <crs:Dabs>\n          <rdf:Seq>\n' + dab * 50 +
+              '          </rdf:Seq>\n         </crs:Dabs>\n        </rdf:li>\n       </rdf:Seq>\n      </crs:CorrectionMasks>\n'
+              '     </rdf:li>\n')
+    return '   <crs:PaintBasedCorrections>\n    <rdf:Seq>\n' + stroke * count + '    </rdf:Seq>\n   </crs:PaintBasedCorrections>\n'
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#! /usr/bin/python
+
+# Script to check that the standard library XMP parser (xmpParser.py) produces the same properties as python-xmp-toolkit (libxmp),
+# and to compare how long each one takes to parse the presets.
+
+# Usage: python benchParsers.py [directory...] [--repeat N]
+# (default directory is xmpPresets, plus the sample sidecar file)
+
+import os, os.path
+import sys
+import time
+import argparse
+
+import xmpParser
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="*", default=["xmpPresets", "sample_sidecar.xmp"],
+                        help="XMP files or directories to search for XMP files")
+    parser.add_argument("--repeat", type=int, default=10, help="number of times to parse each file")
+    args = parser.parse_args()
+
+    fileList = findFiles(args.inputs)
+    buffers = []
+    for f in fileList:
+        with open(f, 'r') as inf:
+            buffers.append(inf.read())
+    print("Files: " + str(len(fileList)))
+
+    haveLibxmp = libxmpAvailable()
+
+    # check that the backends agree
+    if haveLibxmp:
+        mismatches = 0
+        for f, strbuffer in zip(fileList, buffers):
+            diffs = compareProperties(comparable(parseLibxmp(strbuffer)), comparable(xmpParser.parseProperties(strbuffer)))
+            if len(diffs) > 0:
+                mismatches = mismatches + 1
+                print("MISMATCH: " + f)
+                for d in diffs:
+                    print("    " + d)
+        print("Mismatches: " + str(mismatches))
+    else:
+        print("libxmp (or exempi) not available, skipping comparison")
+
+    # timings
+    print("")
+    timeParser("stdlib", xmpParser.parseProperties, buffers, args.repeat)
+    if haveLibxmp:
+        timeParser("libxmp", parseLibxmp, buffers, args.repeat)
+
+    if haveLibxmp and (mismatches > 0):
+        sys.exit(1)
+
+
+# ----------------------------
+
+
+def findFiles(inputs):
+    fileList = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for f in files:
+                    if f.lower().endswith(".xmp"):
+                        fileList.append(os.path.join(root, f))
+        else:
+            fileList.append(path)
+    fileList.sort()
+    return fileList
+
+
+def libxmpAvailable():
+    try:
+        from libxmp import exempi
+        exempi.EXEMPI.xmp_get_error # forces the exempi library to be loaded
+        return True
+    except Exception:
+        return False
+
+
+def parseLibxmp(strbuffer):
+    from libxmp import XMPMeta
+    xmp = XMPMeta()
+    xmp.parse_from_str(strbuffer)
+    return xmpParser.libxmpProperties(xmp)
+
+
+# ----------------------------
+
+
+# removes the values that are not used by the converter and that the backends represent differently (structs, arrays of structs)
+def comparable(props):
+    result = {}
+    for key, value in props.items():
+        if isinstance(value, dict):
+            continue
+        if isinstance(value, list) and any(not isinstance(item, str) for item in value):
+            continue
+        result[key] = value
+    return result
+
+
+def compareProperties(expected, actual):
+    diffs = []
+    for key in sorted(set(expected.keys()) | set(actual.keys())):
+        if key not in actual:
+            diffs.append("missing: " + key)
+        elif key not in expected:
+            diffs.append("extra: " + key)
+        elif expected[key] != actual[key]:
+            diffs.append(key + ": " + repr(expected[key]) + " != " + repr(actual[key]))
+    return diffs
+
+
+def timeParser(name, parse, buffers, repeat):
+    start = time.time()
+    for i in range(repeat):
+        for strbuffer in buffers:
+            parse(strbuffer)
+    elapsed = time.time() - start
+    count = repeat * len(buffers)
+    print("%-8s %8.3f ms/file  %8.1f files/s" % (name, 1000.0 * elapsed / count, count / elapsed))
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+#! /usr/bin/python
+
+# Load test for the conversion server (convertServer.py). Starts a server (or uses a running one, --address), then:
+#   - checks that every input converts to the same preset through the server as it does in this process
+#   - sends --requests /convert requests from each number of concurrent clients in --clients (each client keeps its own
+#     connection open and sends the inputs one after the other), and prints the throughput and latency percentiles
+#   - times /batch requests containing all of the inputs
+#   - times --cold runs of convertXMP.py on one file, i.e. what each conversion costs without the server
+# and prints the server's own metrics at the end.
+
+# Usage: python benchServer.py [directory...] [--address unix:PATH | HOST:PORT] [--jobs N] [--clients 1,4,16] [--requests N]
+# (default directory is xmpPresets. Without --address a server is started on a Unix socket, with --jobs worker processes)
+
+import os, os.path
+import sys
+import time
+import json
+import shutil
+import tempfile
+import threading
+import subprocess
+import argparse
+
+import convertXMP
+import convertServer
+
+
+scriptDir = os.path.dirname(os.path.abspath(__file__))
+
+# time (s) to wait for a server that was started to be ready
+startTimeout = 30.0
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="*", default=["xmpPresets"], help="XMP files or directories to search for XMP files")
+    parser.add_argument("--address", default=None, help="address of a running server (unix:PATH or HOST:PORT)")
+    parser.add_argument("--jobs", type=int, default=1, help="number of worker processes for the server that is started")
+    parser.add_argument("--max-requests", dest="maxRequests", type=int, default=None,
+                        help="number of concurrent conversions for the server that is started (default: the number of jobs)")
+    parser.add_argument("--clients", default="1,4,16", help="comma separated list of numbers of concurrent clients to test")
+    parser.add_argument("--requests", type=int, default=1000, help="number of /convert requests for each number of clients")
+    parser.add_argument("--repeat", type=int, default=5, help="number of timed /batch requests (the best is used)")
+    parser.add_argument("--cold", type=int, default=5, help="number of cold start runs of convertXMP.py to time (0 to skip)")
+    parser.add_argument("--parser", choices=["auto", "stdlib", "libxmp"], default=convertXMP.defaultParser,
+                        help="XMP parser backend (for the server that is started, and for the check)")
+    args = parser.parse_args()
+
+    fileList = findFiles(args.inputs)
+    if len(fileList) == 0:
+        print("ERROR: no XMP files found")
+        sys.exit(1)
+    samples = []
+    for f in fileList:
+        with open(f, 'rb') as inf:
+            samples.append((os.path.splitext(os.path.basename(f))[0], inf.read()))
+
+    tmpdir = tempfile.mkdtemp(prefix="benchServer")
+    server = None
+    failed = False
+    try:
+        address = args.address
+        if address is None:
+            address = "unix:" + os.path.join(tmpdir, "server.sock")
+            server = startServer(address, args.jobs, args.maxRequests, args.parser)
+        waitForServer(address, server)
+        client = convertServer.Client(address)
+        health = client.health()
+        print("Server: %s (%d jobs, %d concurrent requests), %d input files" % (address, health["jobs"], health["maxRequests"],
+                                                                              len(samples)))
+
+        mismatches = checkPresets(client, samples, args.parser)
+        if mismatches > 0:
+            failed = True
+        print("Check: %d presets, %d different from the local conversion" % (len(samples), mismatches))
+
+        print("")
+        print("%8s %10s %10s %9s %9s %9s %9s %8s" % ("clients", "requests", "req/s", "p50 ms", "p90 ms", "p99 ms", "max ms",
+                                                   "errors"))
+        for clients in [ int(c) for c in args.clients.split(",") ]:
+            result = loadTest(address, samples, clients, args.requests)
+            latencies = sorted(result["latencies"])
+            print("%8d %10d %10.1f %9.2f %9.2f %9.2f %9.2f %8d" % (clients, len(latencies), len(latencies) / result["elapsed"],
+                                                                   percentile(latencies, 50), percentile(latencies, 90),
+                                                                   percentile(latencies, 99), 1000.0 * latencies[-1],
+                                                                   result["errors"]))
+
+        body = b"\0".join(data for key, data in samples)
+        best = None
+        for i in range(max(1, args.repeat)):
+            start = time.time()
+            status, response = client.request("POST", "/batch", body)
+            elapsed = time.time() - start
+            if status != 200:
+                print("ERROR: /batch request failed (" + str(status) + ")")
+                failed = True
+                break
+            best = elapsed if best is None else min(best, elapsed)
+        if best is not None:
+            print("")
+            print("Batch: %d presets in %.1f ms (%.3f ms/preset, %.0f presets/s)"
+                  % (len(samples), 1000.0 * best, 1000.0 * best / len(samples), len(samples) / best))
+
+        if args.cold > 0:
+            cold = coldStart(fileList[0], os.path.join(tmpdir, "cold.json"), args.cold, args.parser)
+            print("Cold start: %.1f ms per conversion (python convertXMP.py, mean of %d runs)" % (1000.0 * cold, args.cold))
+
+        print("")
+        print("Server metrics:")
+        print(json.dumps(client.metrics()["endpoints"], indent=2))
+        client.close()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        shutil.rmtree(tmpdir)
+
+    if failed:
+        sys.exit(1)
+
+
+# ----------------------------
+
+
+def findFiles(inputs):
+    fileList = []
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                fileList.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(".xmp"))
+        elif os.path.isfile(path):
+            fileList.append(path)
+    return fileList
+
+
+def startServer(address, jobs, maxRequests, parserName):
+    command = [ sys.executable, os.path.join(scriptDir, "convertServer.py"), "--socket", address[len("unix:"):],
+                "--jobs", str(jobs), "--parser", parserName ]
+    if maxRequests is not None:
+        command.extend([ "--max-requests", str(maxRequests) ])
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+
+def waitForServer(address, server):
+    start = time.time()
+    while True:
+        try:
+            client = convertServer.Client(address, timeout=1.0)
+            status = client.health()["status"]
+            client.close()
+            if status == "ok":
+                return
+        except (OSError, ValueError):
+            pass
+        if (server is not None) and (server.poll() is not None):
+            raise RuntimeError("the server exited (status " + str(server.returncode) + ")")
+        if time.time() - start > startTimeout:
+            raise RuntimeError("the server at " + address + " isn't responding")
+        time.sleep(0.05)
+
+
+# returns the number of presets that are not the same when converted by the server and in this process
+def checkPresets(client, samples, parserName):
+    converter = convertXMP.Converter(parserName)
+    mismatches = 0
+    for key, data in samples:
+        try:
+            expected = convertXMP.annotatePreset(converter.convert(data, key))
+        except Exception as e:
+            expected = { "error": str(e) }
+        try:
+            preset = client.convert(data, key)
+        except ValueError as e:
+            preset = { "error": str(e) }
+        # (compared after a JSON round trip, which is what the server's response has been through)
+        if json.loads(json.dumps(expected)) != preset:
+            print("MISMATCH: " + key)
+            mismatches = mismatches + 1
+    return mismatches
+
+
+# sends count /convert requests from the given number of client threads. Returns the latency of each request (s), the
+# number of failed requests and the total time
+def loadTest(address, samples, clients, count):
+    lock = threading.Lock()
+    result = { "latencies": [], "errors": 0, "next": 0 }
+
+    def run():
+        client = convertServer.Client(address)
+        latencies = []
+        errors = 0
+        while True:
+            with lock:
+                i = result["next"]
+                result["next"] = i + 1
+            if i >= count:
+                break
+            key, data = samples[i % len(samples)]
+            start = time.time()
+            try:
+                status, body = client.request("POST", "/convert", data)
+            except (OSError, ValueError):
+                status = 0
+                client.close()
+                client = convertServer.Client(address)
+            latencies.append(time.time() - start)
+            if status != 200:
+                errors = errors + 1
+        client.close()
+        with lock:
+            result["latencies"].extend(latencies)
+            result["errors"] += errors
+
+    threads = [ threading.Thread(target=run) for i in range(clients) ]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    result["elapsed"] = time.time() - start
+    return result
+
+
+# (ms)
+def percentile(latencies, p):
+    return 1000.0 * latencies[min(len(latencies) - 1, len(latencies) * p // 100)]
+
+
+# returns the mean time (s) of converting one file by running convertXMP.py
+def coldStart(path, output, runs, parserName):
+    command = [ sys.executable, os.path.join(scriptDir, "convertXMP.py"), path, output, "--parser", parserName,
+                "--log-level", "none" ]
+    start = time.time()
+    for i in range(runs):
+        subprocess.check_call(command, stdout=subprocess.DEVNULL)
+    return (time.time() - start) / runs
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
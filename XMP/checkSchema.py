@@ -0,0 +1,196 @@
+#! /usr/bin/python
+
+# Checks that the converter never produces a preset that presetSchema.py rejects for a valid input (batch, watch and server
+# modes drop presets that don't validate, so a schema range narrower than what the converter emits loses presets).
+# Synthetic XMP presets are generated with a random selection of the crs: settings that the converter reads, each with a
+# value in the range that Lightroom/Camera Raw allows for it (a quarter of them at one end of the range, since that is
+# where clamps are missed), plus random point curves. Each preset is converted with the default options, --optimize and
+# --curve-table (in turn) and the result is validated. The first few failures are printed with the settings that caused
+# them, and --save writes the XMP of every failing preset to a directory so it can be converted again.
+
+# Usage: python checkSchema.py [--count N] [--seed N] [--save DIR]
+
+import os, os.path
+import sys
+import random
+import argparse
+from xml.sax.saxutils import escape
+
+import convertXMP
+import presetSchema
+
+
+defaultCount = 2000
+
+# number of failures printed in full
+maxReported = 10
+
+colourNames = [ "Red", "Orange", "Yellow", "Green", "Aqua", "Blue", "Purple", "Magenta" ]
+
+# numeric crs: settings and the range of each in Lightroom/Camera Raw. Settings that have a process 2012 name as well as
+# an older one are listed under both (a preset uses one or the other)
+settingRanges = [
+    ("Exposure2012", -5.0, 5.0), ("Exposure", -4.0, 4.0),
+    ("Contrast2012", -100.0, 100.0), ("Contrast", -50.0, 100.0),
+    ("Highlights2012", -100.0, 100.0), ("Highlights", 0.0, 100.0),
+    ("Shadows2012", -100.0, 100.0), ("Shadows", 0.0, 100.0),
+    ("Whites2012", -100.0, 100.0), ("Blacks2012", -100.0, 100.0),
+    ("Clarity2012", -100.0, 100.0), ("Clarity", -100.0, 100.0),
+    ("Vibrance", -100.0, 100.0), ("Saturation", -100.0, 100.0),
+    ("Sharpness", 0.0, 150.0), ("SharpenRadius", 0.5, 3.0), ("SharpenDetail", 0.0, 100.0), ("SharpenEdgeMasking", 0.0, 100.0),
+    ("LuminanceSmoothing", 0.0, 100.0), ("ColorNoiseReduction", 0.0, 100.0),
+    ("ColorNoiseReductionDetail", 0.0, 100.0), ("ColorNoiseReductionSmoothness", 0.0, 100.0),
+    ("GrainAmount", 0.0, 100.0), ("GrainSize", 0.0, 100.0), ("GrainFrequency", 0.0, 100.0),
+    ("ParametricShadows", -100.0, 100.0), ("ParametricDarks", -100.0, 100.0),
+    ("ParametricLights", -100.0, 100.0), ("ParametricHighlights", -100.0, 100.0),
+    ("SplitToningHighlightHue", 0.0, 360.0), ("SplitToningHighlightSaturation", 0.0, 100.0),
+    ("SplitToningShadowHue", 0.0, 360.0), ("SplitToningShadowSaturation", 0.0, 100.0), ("SplitToningBalance", -100.0, 100.0),
+    ("PostCropVignetteAmount", -100.0, 100.0), ("PostCropVignetteMidpoint", 0.0, 100.0),
+    ("PostCropVignetteFeather", 0.0, 100.0), ("PostCropVignetteRoundness", -100.0, 100.0),
+    ("VignetteAmount", -100.0, 100.0), ("VignetteMidpoint", 0.0, 100.0),
+    ("ShadowTint", -100.0, 100.0) ]
+for colour in colourNames:
+    settingRanges.extend([ ("HueAdjustment" + colour, -100.0, 100.0), ("SaturationAdjustment" + colour, -100.0, 100.0),
+                           ("LuminanceAdjustment" + colour, -100.0, 100.0), ("GrayMixer" + colour, -100.0, 100.0) ])
+for colour in [ "Red", "Green", "Blue" ]:
+    settingRanges.extend([ (colour + "Hue", -100.0, 100.0), (colour + "Saturation", -100.0, 100.0) ])
+
+# the parametric curve splits have to stay in order (shadow < midtone < highlight)
+splitRanges = [ ("ParametricShadowSplit", 10.0, 30.0), ("ParametricMidtoneSplit", 40.0, 60.0),
+                ("ParametricHighlightSplit", 70.0, 90.0) ]
+
+whiteBalances = [ "As Shot", "Auto", "Custom", "Daylight", "Cloudy", "Shade", "Tungsten", "Fluorescent", "Flash" ]
+
+# Temperature and Tint are in Kelvin and -150..+150 for raw files, and relative (-100..+100) for JPEG/TIFF files
+rawWhiteBalance = [ ("Temperature", 2000.0, 50000.0), ("Tint", -150.0, 150.0) ]
+relativeWhiteBalance = [ ("Temperature", -100.0, 100.0), ("Tint", -100.0, 100.0) ]
+
+curveNames = [ "Linear", "Medium Contrast", "Strong Contrast", "Custom" ]
+
+autoSettings = [ "AutoBrightness", "AutoContrast", "AutoExposure", "AutoShadows" ]
+
+# converter options to check, as (label, Converter arguments)
+optionSets = [ ("default", {}),
+               ("--optimize", { "optimize": convertXMP.defaultTolerance }),
+               ("--curve-table 256", { "curveTable": 256 }) ]
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=defaultCount, help="number of presets to generate")
+    parser.add_argument("--seed", type=int, default=1, help="random seed (the same seed gives the same presets)")
+    parser.add_argument("--save", default=None, help="write the XMP of each failing preset to this directory")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    validator = presetSchema.defaultValidator()
+    converters = [ (label, convertXMP.Converter("stdlib", **options)) for label, options in optionSets ]
+
+    failed = 0
+    for i in range(args.count):
+        settings, curves = randomSettings(rng)
+        xmp = presetXMP("Check %d" % i, settings, curves)
+        errors = []
+        for label, converter in converters:
+            try:
+                preset = converter.convert(xmp, "check%d" % i)
+            except Exception as e:
+                errors.append(label + ": could not convert: " + str(e))
+                continue
+            errors.extend(label + ": " + error for error in validator.validate(preset))
+        if len(errors) == 0:
+            continue
+
+        failed = failed + 1
+        if failed <= maxReported:
+            print("Preset %d:" % i)
+            for error in errors:
+                print("    " + error)
+            print("    settings: " + ", ".join("%s=%s" % (k, v) for k, v in sorted(settings.items())))
+        if args.save is not None:
+            convertXMP.mkdir_p(args.save)
+            with open(os.path.join(args.save, "check%d.xmp" % i), 'w') as f:
+                f.write(xmp)
+
+    print("Checked %d presets (%s), %d failed validation (schema %s)"
+          % (args.count, ", ".join(label for label, options in optionSets), failed, validator.stamp))
+    if failed > 0:
+        sys.exit(1)
+
+
+# ----------------------------
+
+
+# returns a value in the range, at one end of it a quarter of the time
+def randomValue(rng, low, high):
+    r = rng.random()
+    if r < 0.125:
+        return low
+    if r < 0.25:
+        return high
+    return round(rng.uniform(low, high), 2)
+
+
+# returns a random point curve (0..255 on both axes, x increasing), as a list of "x, y" strings
+def randomCurve(rng):
+    count = rng.randint(2, 16)
+    x = sorted(set([ 0, 255 ] + [ rng.randint(1, 254) for i in range(count - 2) ]))
+    return [ "%d, %d" % (xi, rng.choice([ 0, 255, rng.randint(0, 255) ])) for xi in x ]
+
+
+# returns (settings, curves) for a random preset: a map of crs: setting -> value (as text), and a map of curve name ->
+# list of points
+def randomSettings(rng):
+    settings = {}
+    for key, low, high in settingRanges:
+        if rng.random() < 0.5:
+            settings[key] = "%+g" % randomValue(rng, low, high)
+    if rng.random() < 0.5:
+        for key, low, high in splitRanges:
+            settings[key] = "%g" % randomValue(rng, low, high)
+
+    if rng.random() < 0.7:
+        settings["WhiteBalance"] = rng.choice(whiteBalances)
+        for key, low, high in rng.choice([ rawWhiteBalance, relativeWhiteBalance ]):
+            if rng.random() < 0.8:
+                settings[key] = "%+g" % randomValue(rng, low, high)
+    if rng.random() < 0.1:
+        settings[rng.choice(autoSettings)] = "True"
+    if rng.random() < 0.2:
+        settings["ConvertToGrayscale"] = rng.choice([ "True", "False" ])
+
+    curves = {}
+    if rng.random() < 0.6:
+        settings["ToneCurveName2012"] = rng.choice(curveNames)
+        curves["ToneCurvePV2012"] = randomCurve(rng)
+    for colour in [ "Red", "Green", "Blue" ]:
+        if rng.random() < 0.3:
+            curves["ToneCurvePV2012" + colour] = randomCurve(rng)
+    return (settings, curves)
+
+
+def presetXMP(name, settings, curves):
+    lines = [ '<x:xmpmeta xmlns:x="adobe:ns:meta/">',
+              ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">',
+              '  <rdf:Description rdf:about="" xmlns:crs="http://ns.adobe.com/camera-raw-settings/1.0/"' ]
+    for key, value in sorted(settings.items()):
+        lines.append('   crs:%s="%s"' % (key, escape(value)))
+    lines[-1] = lines[-1] + '>'
+    lines.append('   <crs:Name><rdf:Alt><rdf:li xml:lang="x-default">%s</rdf:li></rdf:Alt></crs:Name>' % escape(name))
+    lines.append('   <crs:Group><rdf:Alt><rdf:li xml:lang="x-default">checkSchema</rdf:li></rdf:Alt></crs:Group>')
+    for key, points in sorted(curves.items()):
+        lines.append('   <crs:%s><rdf:Seq>%s</rdf:Seq></crs:%s>' % (key, "".join("<rdf:li>" + p + "</rdf:li>" for p in points), key))
+    lines.extend([ '  </rdf:Description>', ' </rdf:RDF>', '</x:xmpmeta>', '' ])
+    return "\n".join(lines)
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
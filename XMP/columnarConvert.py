@@ -0,0 +1,578 @@
+#! /usr/bin/python
+
+# Columnar conversion engine (see convertXMP.py --batch --columnar). Instead of running each stage of the conversion one
+# preset at a time, a batch of presets is parsed and then the crs: values of all of them are loaded into numpy arrays (one
+# column per key, plus a mask of the presets that contain the key). The stages that are only scalar mappings (exposure,
+# contrast, vibrance, white balance, the tone curve points changed by Blacks/Whites etc.) are then run once for the whole
+# batch as array operations, and the filters are added to each preset's list from the arrays.
+
+# The stages that aren't implemented here (HSV, the curves, split toning etc.) are run by a Converter for each preset, in the
+# usual order, with the tone curve handed over from (and back to) the arrays. A preset that contains a value that isn't a
+# number, for a key used by the columnar stages, is converted entirely by the Converter instead (so that it fails, or not, in
+# exactly the same way as it would normally).
+
+# The output is exactly the same as the scalar (Converter) path: every array operation does the same float operations in
+# the same order as the scalar code, and min/max/clamp follow the Python rules (e.g. for NaN and -0.0). No progress messages
+# are written for the individual presets.
+
+# Usage: python columnarConvert.py [directory...] [--scale N] [--repeat N]
+#        (times both engines on the presets, and a synthetic corpus made from them, and checks that the output is identical)
+
+import sys
+import time
+import argparse
+
+import numpy as np
+
+import convertXMP
+import xmpParser
+
+
+# number of presets converted together (limits the memory used for the parsed settings and the arrays)
+defaultChunkSize = 4096
+
+
+# ----------------------------
+
+
+def main():
+
+    import benchConvert
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="*", default=["xmpPresets"], help="XMP files or directories to search for XMP files")
+    parser.add_argument("--scale", type=int, default=50,
+                        help="number of perturbed copies of each preset in the synthetic corpus (0 to skip it)")
+    parser.add_argument("--repeat", type=int, default=3, help="number of timed passes over each corpus (the best is used)")
+    parser.add_argument("--parser", choices=["auto", "stdlib", "libxmp"], default=convertXMP.defaultParser,
+                        help="XMP parser backend")
+    args = parser.parse_args()
+
+    samples = []
+    for f in benchConvert.findFiles(args.inputs):
+        with open(f, 'rb') as inf:
+            samples.append((f, inf.read().decode("utf-8")))
+    if len(samples) == 0:
+        print("ERROR: no XMP files found")
+        sys.exit(1)
+
+    corpora = [ ("presets", samples) ]
+    if args.scale > 0:
+        corpora.append(("synthetic", benchConvert.syntheticCorpus(samples, args.scale)))
+
+    parserName = convertXMP.resolveParser(args.parser)
+    mismatches = 0
+    for name, corpus in corpora:
+        mismatches = mismatches + compareEngines(name, corpus, parserName, args.repeat)
+    if mismatches > 0:
+        sys.exit(1)
+
+
+# converts the corpus with both engines, printing the times and any presets that differ. Returns the number that differ
+def compareEngines(name, corpus, parser, repeat):
+    items = [ (text, key) for key, text in corpus ]
+
+    scalar = None
+    columnar = None
+    scalarTime = None
+    columnarTime = None
+    for i in range(max(1, repeat)):
+        start = time.perf_counter()
+        scalar = scalarConvert(items, parser)
+        elapsed = time.perf_counter() - start
+        if (scalarTime is None) or (elapsed < scalarTime):
+            scalarTime = elapsed
+
+        start = time.perf_counter()
+        columnar = ColumnarConverter(parser).convertBatch(items)
+        elapsed = time.perf_counter() - start
+        if (columnarTime is None) or (elapsed < columnarTime):
+            columnarTime = elapsed
+
+    mismatches = 0
+    for (text, key), expected, actual in zip(items, scalar, columnar):
+        if resultText(expected) != resultText(actual[:2]):
+            mismatches = mismatches + 1
+            print("MISMATCH: " + key)
+
+    count = len(items)
+    print("%-10s %6d presets  scalar: %8.1f us/preset  columnar: %8.1f us/preset  (x%.2f)  mismatches: %d"
+          % (name, count, 1000000.0 * scalarTime / count, 1000000.0 * columnarTime / count, scalarTime / columnarTime, mismatches))
+    return mismatches
+
+
+# the reference: converts each preset with a Converter. Returns a list of (preset, error) in the same order as the items
+def scalarConvert(items, parser):
+    converter = convertXMP.Converter(parser)
+    results = []
+    for source, key in items:
+        try:
+            results.append((convertXMP.presetText(converter.convert(source, key)), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+def resultText(result):
+    preset, error = result
+    if preset is None:
+        return "ERROR: " + error
+    if isinstance(preset, str):
+        return preset
+    return convertXMP.presetText(preset)
+
+
+# ----------------------------
+
+
+# batch mode (see convertXMP.convertTree): converts the tasks produced by convertXMP.readPresets, a chunk at a time, and
+# yields the same results as convertXMP.convertTask (with an empty log), in the same order
+def convertTasks(tasks, parser=convertXMP.defaultParser, compact=False, optimize=None, lut=False, curveTable=None,
+                 chunkSize=defaultChunkSize):
+    converter = ColumnarConverter(parser, optimize, lut, curveTable)
+    chunk = []
+    for task in tasks:
+        chunk.append(task)
+        if len(chunk) >= chunkSize:
+            for result in convertChunk(converter, chunk, compact):
+                yield result
+            chunk = []
+    for result in convertChunk(converter, chunk, compact):
+        yield result
+
+
+def convertChunk(converter, chunk, compact):
+    readable = [ task for task in chunk if task[2] is not None ]
+    converted = iter(converter.convertBatch([ (strbuffer, dst) for src, dst, strbuffer, digest in readable ]))
+    results = []
+    for src, dst, strbuffer, digest in chunk:
+        if strbuffer is None:
+            error = "could not read file"
+            if convertXMP.embeddedXMP.isImage(src):
+                error = "could not read file, or it contains no XMP"
+            results.append((src, dst, digest, None, "", error, (0, 0), [], []))
+            continue
+        preset, error, removed, lookups = next(converted)
+        text = None
+        if error is None:
+            try:
+                text = convertXMP.presetText(convertXMP.annotatePreset(preset), compact)
+            except ValueError as e:
+                error = str(e)
+                lookups = []
+        results.append((src, dst, digest, text, "", error, removed, lookups, []))
+    return results
+
+
+# ----------------------------
+
+
+# Holds the numpy columns for a batch of presets (see xmpParser.PresetSettings). Columns are loaded when first used
+class PresetColumns(object):
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.count = len(settings)
+        self.values = {}  # key -> float values (0.0 where the key isn't present, or isn't a number)
+        self.present = {} # key -> mask of the presets containing the key
+        self.numeric = {} # key -> mask of the presets where the value is a number
+
+    def load(self, key):
+        if key not in self.values:
+            n = self.count
+            self.present[key] = np.fromiter((key in s.props for s in self.settings), dtype=bool, count=n)
+            self.numeric[key] = np.fromiter((key in s.numbers for s in self.settings), dtype=bool, count=n)
+            self.values[key] = np.fromiter((s.numbers.get(key, 0.0) for s in self.settings), dtype=np.float64, count=n)
+
+    def has(self, key):
+        self.load(key)
+        return self.present[key]
+
+    def getFloat(self, key):
+        self.load(key)
+        return self.values[key]
+
+    # the presets that contain the key, but not as a number (i.e. where getFloat would fail)
+    def invalid(self, key):
+        self.load(key)
+        return self.present[key] & ~self.numeric[key]
+
+    # text values (as an object array, "" where the key isn't present)
+    def getText(self, key):
+        return np.array([ s.getText(key) for s in self.settings ], dtype=object)
+
+    # the column version of PresetSettings.resolve: returns the index of the key used by each preset in the list of aliases
+    # for the name (-1 if none of them are present), and the values of those keys
+    def resolve(self, name):
+        which = np.full(self.count, -1, dtype=np.int64)
+        value = np.zeros(self.count, dtype=np.float64)
+        for i, key in enumerate(xmpParser.settingsAliases[name]):
+            found = self.has(key) & (which < 0)
+            which[found] = i
+            value = np.where(found, self.getFloat(key), value)
+        return which, value
+
+
+# ----------------------------
+
+
+# Converts batches of presets. Each columnar stage has the same name as the Converter stage it replaces
+class ColumnarConverter(object):
+
+    def __init__(self, parser=convertXMP.defaultParser, optimize=None, lut=False, curveTable=None):
+        self.parser = convertXMP.resolveParser(parser)
+        self.optimize = optimize
+        self.lut = lut
+        self.curveTable = curveTable
+
+
+    # items is a list of (source, key) as for Converter.convert. Returns a list of (preset, error, (filters removed, total),
+    # [(lookup table name, PNG data)]) in the same order, where preset is None (and error is the message) if it failed
+    def convertBatch(self, items):
+        n = len(items)
+        if n == 0:
+            return []
+        self.converters = [ convertXMP.Converter(self.parser, optimize=self.optimize, lut=self.lut, curveTable=self.curveTable)
+                            for i in range(n) ]
+        self.errors = [ None ] * n
+        self.active = np.ones(n, dtype=bool) # presets still being converted by the columnar stages
+
+        for i, (source, key) in enumerate(items):
+            converter = self.converters[i]
+            converter.reset()
+            try:
+                converter.parse(source)
+            except Exception as e:
+                self.errors[i] = str(e)
+                self.active[i] = False
+                continue
+            converter.initPreset(key)
+
+        self.columns = PresetColumns([ c.settings for c in self.converters ])
+        self.filters = [ c.filterMap.get("filters") for c in self.converters ]
+        self.toneCurve = np.tile(np.array(self.converters[0].toneCurve, dtype=np.float64), (n, 1, 1))
+        self.toneCurveChanged = np.zeros(n, dtype=bool)
+
+        # run the stages, with each run of stages that aren't implemented here done preset by preset
+        scalarStages = []
+        with np.errstate(all="ignore"):
+            for stage in convertXMP.Converter.stages:
+                if hasattr(self, stage):
+                    self.runScalar(scalarStages)
+                    scalarStages = []
+                    getattr(self, stage)()
+                else:
+                    scalarStages.append(stage)
+            self.runScalar(scalarStages)
+
+        results = []
+        for i, converter in enumerate(self.converters):
+            if self.errors[i] is not None:
+                results.append((None, self.errors[i], (0, 0), []))
+                continue
+            try:
+                if self.optimize is not None:
+                    converter.optimizeFilters()
+                if self.lut:
+                    converter.bakeLookups()
+            except Exception as e:
+                results.append((None, str(e), (0, 0), []))
+                continue
+            results.append((converter.filterMap, None, converter.removed, converter.lookups))
+        self.converters = []
+        return results
+
+
+    # runs Converter stages for each active preset, handing over the tone curve state
+    def runScalar(self, stages):
+        if len(stages) == 0:
+            return
+        for i in np.flatnonzero(self.active).tolist():
+            converter = self.converters[i]
+            converter.toneCurve = self.toneCurve[i].tolist()
+            converter.toneCurveChanged = bool(self.toneCurveChanged[i])
+            try:
+                for stage in stages:
+                    getattr(converter, stage)()
+            except Exception as e:
+                self.errors[i] = str(e)
+                self.active[i] = False
+                continue
+            self.toneCurve[i] = converter.toneCurve
+            self.toneCurveChanged[i] = converter.toneCurveChanged
+
+
+    # returns the values for the keys, first handing any preset where one of them isn't a number over to the Converter
+    def getFloats(self, *keys):
+        invalid = np.zeros(self.columns.count, dtype=bool)
+        for key in keys:
+            invalid = invalid | self.columns.invalid(key)
+        for i in np.flatnonzero(invalid & self.active).tolist():
+            self.convertScalar(i)
+        return [ self.columns.getFloat(key) for key in keys ]
+
+
+    def resolve(self, name):
+        which, value = self.columns.resolve(name)
+        self.getFloats(*xmpParser.settingsAliases[name])
+        return which, value
+
+
+    # converts a preset with its Converter, from the start (the preset is then left out of the columnar stages)
+    def convertScalar(self, i):
+        converter = self.converters[i]
+        self.active[i] = False
+        key = converter.filterMap["key"]
+        settings = converter.settings
+        converter.reset()
+        converter.settings = settings
+        converter.initPreset(key)
+        try:
+            for stage in convertXMP.Converter.stages:
+                getattr(converter, stage)()
+        except Exception as e:
+            self.errors[i] = str(e)
+
+
+    # adds a filter to each (active) preset in the mask. params is a list of (parameter name, values), where the values are
+    # an array with one value per preset, or a single value used for all of them
+    def addFilters(self, mask, key, params):
+        values = [ (name, np.broadcast_to(np.asarray(value, dtype=np.float64), (self.columns.count,)).tolist())
+                   for name, value in params ]
+        for i in np.flatnonzero(mask & self.active).tolist():
+            self.filters[i].append( { 'key':key, "parameters":[ { 'key':name, 'val':value[i], 'type': "CIAttributeTypeScalar"}
+                                                                for name, value in values ] } )
+
+
+    # ----------------------------
+
+
+    def processInfo(self):
+        for i in np.flatnonzero(self.active).tolist():
+            settings = self.columns.settings[i]
+            info = self.converters[i].filterMap["info"]
+            if settings.has("Name"):
+                info["name"] = settings.getText("Name")
+            if settings.has("Group"):
+                info["group"] = settings.getText("Group")
+
+
+    def processAuto(self):
+        auto = self.columns.has("AutoBrightness") | self.columns.has("AutoContrast") | \
+               self.columns.has("AutoExposure") | self.columns.has("AutoShadows")
+        self.addFilters(auto, "AutoAdjustFilter", [])
+
+
+    def processWhiteBalance(self):
+        found = self.columns.has("WhiteBalance")
+        preset = self.columns.getText("WhiteBalance")
+
+        wbPresets = { "Daylight":    { 'temp': 5500.0, 'tint': 10.0 },
+                      "Cloudy":      { 'temp': 6500.0, 'tint': 10.0 },
+                      "Shade":       { 'temp': 7500.0, 'tint': 10.0 },
+                      "Tungsten":    { 'temp': 2850.0, 'tint': 0.0 },
+                      "Fluorescent": { 'temp': 3800.0, 'tint': 21.0 },
+                      "Flash":       { 'temp': 5500.0, 'tint': 0.0 } }
+        for name, wb in wbPresets.items():
+            temp = min(wb['temp'], 10000.0)
+            tint = max(min(wb['tint'], 100.0), -100.0)
+            self.addFilters(found & (preset == name), "WhiteBalanceFilter", [ ("inputTemperature", temp), ("inputTint", tint) ])
+
+        self.addFilters(found & (preset == "Auto"), "AutoAdjustFilter", [])
+
+        custom = found & (preset == "Custom")
+        if custom.any():
+            temperature, tint = self.getFloats("Temperature", "Tint")
+            temperature = np.where(np.abs(temperature) <= 100.0, relativeTemperature(temperature), temperature)
+            temp = np.where(self.columns.has("Temperature"), clamp(temperature, 2000.0, 10000.0), 5500.0)
+            tint = np.where(self.columns.has("Tint"), clamp(tint, -100.0, 100.0), 0.0)
+            self.addFilters(custom, "WhiteBalanceFilter", [ ("inputTemperature", temp), ("inputTint", tint) ])
+
+
+    def processExposure(self):
+        which, value = self.resolve("Exposure")
+        self.addFilters((which >= 0) & (np.abs(value) > 0.01), "CIExposureAdjust", [ ("inputEV", value) ])
+
+
+    def processContrast(self):
+        which, value = self.resolve("Contrast")
+        found = which >= 0
+        value = value / 2.0
+        apply = found & (np.abs(value) > 0.001)
+
+        positive = apply & (value >= 0.0)
+        self.addFilters(positive, "ContrastFilter", [ ("inputContrast", clamp(1.0 + value / 100.0, 1.0, 4.0)) ])
+
+        # -ve contrast adjusts the tone curve instead
+        negative = apply & ~(value >= 0.0) & self.active
+        curve = self.toneCurve
+        b = calculateCurveChangeConstrained(curve[:,1,1], -value, curve[:,2,1]-10.0, curve[:,0,1]+10.0)
+        curve[:,1,1] = np.where(negative, b, curve[:,1,1])
+        self.toneCurveChanged = self.toneCurveChanged | negative
+
+
+    def processClarity(self):
+        which, value = self.resolve("Clarity")
+        value = value / 100.0
+        self.addFilters((which >= 0) & (np.abs(value) > 0.0), "ClarityFilter", [ ("inputClarity", value) ])
+
+
+    def processVibrance(self):
+        value, = self.getFloats("Vibrance")
+        value = value / 100.0
+        self.addFilters(self.columns.has("Vibrance") & (np.abs(value) > 0.01), "CIVibrance", [ ("inputAmount", value) ])
+
+
+    def processSaturation(self):
+        value, = self.getFloats("Saturation")
+        found = self.columns.has("Saturation") & (np.abs(value) > 0.01)
+        value = clamp((value / 100.0) + 1.0, 0.0, 2.0)
+        self.addFilters(found, "SaturationFilter", [ ("inputSaturation", value) ])
+
+
+    def processSharpening(self):
+        sharpness, detail, radius, threshold = self.getFloats("Sharpness", "SharpenDetail", "SharpenRadius", "SharpenThreshold")
+        has = self.columns.has
+
+        value = clamp(sharpness / 50.0, 0.0, 2.0)
+        self.addFilters(has("Sharpness") & (np.abs(value) > 0.01), "CISharpenLuminance", [ ("inputSharpness", value) ])
+
+        # unsharp mask
+        found = has("SharpenDetail") | has("SharpenRadius") | has("SharpenThreshold")
+        amount = np.where(has("SharpenDetail"), detail / 100.0, 0.85)
+        radius = np.where(has("SharpenRadius"), radius, 1.0)
+        threshold = np.where(has("SharpenThreshold"), threshold, 0.4)
+        self.addFilters(found & approxEqual(amount, 0.0), "UnsharpMaskFilter",
+                        [ ("inputAmount", amount), ("inputRadius", radius), ("inputThreshold", threshold) ])
+
+
+    def processNoiseReduction(self):
+        amount, detail = self.getFloats("ColorNoiseReduction", "ColorNoiseReductionDetail")
+        found = self.columns.has("ColorNoiseReduction")
+        detail = np.where(self.columns.has("ColorNoiseReductionDetail"), detail, 0.0)
+
+        apply = found & (np.abs(amount) > 0.01)
+        amount = clamp(amount / 1000.0, 0.0, 0.1)
+        detail = clamp(detail / 500.0, 0.0, 0.2)
+        self.addFilters(apply, "CINoiseReduction", [ ("inputNoiseLevel", amount), ("inputSharpness", detail) ])
+
+
+    def processGrain(self):
+        amount, size = self.getFloats("GrainAmount", "GrainSize")
+        found = self.columns.has("GrainAmount") | self.columns.has("GrainSize")
+        amount = np.where(self.columns.has("GrainAmount"), amount / 100.0, 0.0)
+        size = np.where(self.columns.has("GrainSize"), size / 100.0, 0.0)
+        self.addFilters(found & ~approxEqual(amount, 0.0), "FilmGrainFilter", [ ("inputAmount", amount), ("inputSize", size) ])
+
+
+    def processShadowsHighlights(self):
+        curve = self.toneCurve
+
+        # Blacks and Whites move the input values of the end points of the tone curve
+        which, blacks = self.resolve("Blacks")
+        hasBlacks = which >= 0
+        apply = hasBlacks & (np.abs(blacks) > 0.01) & self.active
+        b = calculateCurveChangeConstrained(curve[:,0,0], -blacks, curve[:,1,0]-10.0, 0.0)
+        curve[:,0,0] = np.where(apply, b, curve[:,0,0])
+        found = apply
+
+        which, whites = self.resolve("Whites")
+        hasWhites = which >= 0
+        apply = hasWhites & (np.abs(whites) > 0.01) & self.active
+        w = calculateCurveChangeConstrained(curve[:,4,0], -whites, 100.0, curve[:,3,0]+10.0)
+        curve[:,4,0] = np.where(apply, w, curve[:,4,0])
+        found = found | apply
+
+        self.toneCurveChanged = self.toneCurveChanged | found
+
+        # (the last Blacks/Whites value, which is used in the sum for the 2012 keys, see Converter.processShadowsHighlights)
+        value = np.where(hasWhites, whites, np.where(hasBlacks, blacks, 0.0))
+
+        total = np.zeros(self.columns.count, dtype=np.float64)
+        which, s = self.resolve("Shadows")
+        total = np.where(which == 0, total + np.abs(s), np.where(which > 0, total + np.abs(value), total))
+        found2 = (which >= 0) & (np.abs(s) > 0.01)
+
+        which, h = self.resolve("Highlights")
+        total = np.where(which == 0, total + np.abs(h), np.where(which > 0, total + np.abs(value), total))
+        found2 = found2 | ((which >= 0) & (np.abs(h) > 0.01))
+
+        self.updateShadowsHighlights(found2 & (np.abs(total) > 0.01), s, h)
+
+
+    # (see Converter.updateShadowsHighlights. The presets in the mask always have a shadow or highlight value above 0.01)
+    def updateShadowsHighlights(self, mask, s, h):
+        s2 = clamp(s / 100.0, -1.0, 1.0)
+        h2 = np.where(h < 0.0, 1.0 + h / 100.0, 1.0)
+        h2 = clamp(h2, 0.3, 1.0)
+        self.addFilters(mask, "CIHighlightShadowAdjust", [ ("inputShadowAmount", s2), ("inputHighlightAmount", h2) ])
+
+
+    def processVignette(self):
+        has = self.columns.has
+        amount, midpoint, feather, oldAmount, oldRadius = self.getFloats("PostCropVignetteAmount", "PostCropVignetteMidpoint",
+                                                                         "PostCropVignetteFeather", "VignetteAmount", "Radius")
+
+        # newest form. Amount must be non-zero to proceed
+        intensity = np.where(has("PostCropVignetteAmount"), -amount / 100.0, 0.5) # flip polarity
+        found1 = has("PostCropVignetteAmount") & ~(np.abs(intensity) < 0.01)
+        radius = np.where(found1 & has("PostCropVignetteMidpoint"), midpoint / 100.0, 0.5)
+        falloff = np.where(found1 & has("PostCropVignetteFeather"), feather / 100.0, 0.5)
+
+        # older form
+        older = ~found1 & has("VignetteAmount")
+        intensity = np.where(older, -oldAmount / 100.0, intensity)
+        found2 = older & ~(np.abs(intensity) < 0.01)
+        radius = np.where(found2 & has("Radius"), oldRadius / 100.0, radius)
+
+        mask = (found1 | found2) & self.active
+        for i in np.flatnonzero(mask).tolist():
+            self.filters[i].append({'key': "CenteredVignetteFilter", "parameters": [{'key': "inputRadius", "val": float(radius[i]), "type": "CIAttributeTypeScalar"},
+                                                                                   {'key': "inputIntensity", "val": float(intensity[i]), "type": "CIAttributeTypeScalar"},
+                                                                                   {'key': "inputFalloff", "val": float(falloff[i]), "type": "CIAttributeTypeScalar"}]
+                                                                  } )
+
+
+# ----------------------------
+
+# Array versions of the scalar utility functions in convertXMP.py. min() and max() are written out (rather than using
+# np.minimum/np.maximum) so that NaN and -0.0 are handled in the same way as the Python built-ins
+
+
+def pyMin(a, b):
+    return np.where(b < a, b, a)
+
+
+def pyMax(a, b):
+    return np.where(b > a, b, a)
+
+
+def clamp(value, minv, maxv):
+    return pyMax(pyMin(value, maxv), minv)
+
+
+# (see convertXMP.relativeTemperature)
+def relativeTemperature(value):
+    return np.where(value > 0.0, 6500.0 + value * 35.0, 6500.0 + value * 45.0)
+
+
+def calculateCurveChange(currval, change, scale):
+    value = np.where(change > 0.0, currval + (scale - currval) * change / 100.0, currval + (scale * change / 100.0))
+    return clamp(value, 0.0, scale)
+
+
+def calculateCurveChangeConstrained(currval, change, upper, lower):
+    value = np.where(change > 0.0, currval + (upper - currval) * change / 100.0, currval + (currval - lower) * change / 100.0)
+    return clamp(value, lower, upper)
+
+
+def approxEqual(var, value):
+    return np.abs(var - value) < 0.001
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
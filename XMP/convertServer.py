@@ -0,0 +1,532 @@
+#! /usr/bin/python
+
+# Conversion server: keeps the converter loaded (the XMP parser, numpy and the curve code, the schema and the other tables are
+# all loaded and warmed up when the server starts) and converts XMP presets sent to it over HTTP, on localhost or on a Unix
+# socket, so that tools which convert presets many times don't pay for starting Python and loading everything on each call.
+#
+# Requests:
+#   POST /convert[?key=NAME]   the body is one XMP document. The response is the JSON preset, the same as the file written
+#                              in batch mode (including the cost and validation annotations), or {"error": ...} with a
+#                              400 (the XMP couldn't be converted) or 422 (the preset isn't valid) status
+#   POST /batch                the body is any number of XMP documents, concatenated or NUL-separated (the same as --stream).
+#                              The response is one line of JSON per document, in the same order, with the position of the
+#                              document as the key, or {"key": ..., "error": ...} if it couldn't be converted
+#   GET /health                {"status": "ok", ...} once the server is ready
+#   GET /metrics               request counts, errors and timings (mean, percentiles, max) for each endpoint
+#
+# At most --max-requests conversions run at the same time. Other requests wait for up to --queue-timeout seconds, and then
+# get a 503 (with Retry-After) so that a client can back off rather than pile up requests. Conversions run in the request
+# threads (with one Converter per thread), or in --jobs worker processes (each with its own warm Converter), which lets
+# several presets be converted at once.
+#
+# convertServer.Client is a small client for the server (used by benchServer.py), e.g.
+#     client = convertServer.Client("unix:/tmp/convertXMP.sock")
+#     preset = client.convert(xmpBytes, "Amber")
+
+# Usage: python convertServer.py [--port N | --socket PATH] [--jobs N] [--max-requests N] [--optimize] [--curve-table N] ...
+
+import os, os.path
+import sys
+import time
+import json
+import errno
+import signal
+import socket
+import threading
+import collections
+import argparse
+import http.client
+import http.server
+import socketserver
+from urllib.parse import urlsplit, parse_qs, quote
+
+import convertXMP
+import xmpParser
+
+
+defaultHost = "127.0.0.1"
+defaultPort = 8765
+
+# largest request body accepted (bytes)
+defaultMaxBody = 64 * 1024 * 1024
+
+# time (s) that a request waits for one of the --max-requests slots before it is rejected
+defaultQueueTimeout = 10.0
+
+# idle connections are closed after this time (s)
+connectionTimeout = 60.0
+
+# connections that can wait to be accepted (the default of 5 is easily exceeded by a burst of new clients)
+listenBacklog = 128
+
+# number of recent requests kept (for each endpoint) to calculate the percentiles
+sampleSize = 1024
+
+percentiles = [ 50, 90, 99 ]
+
+sampleFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sample_sidecar.xmp")
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default=defaultHost, help="address to listen on (default: " + defaultHost + ")")
+    parser.add_argument("--port", type=int, default=defaultPort, help="port to listen on (default: " + str(defaultPort) + ")")
+    parser.add_argument("--socket", default=None, help="listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes to convert in (1 converts in the server process, 0 means one per CPU)")
+    parser.add_argument("--max-requests", dest="maxRequests", type=int, default=None,
+                        help="number of conversions to run at the same time (default: the number of jobs)")
+    parser.add_argument("--queue-timeout", dest="queueTimeout", type=float, default=defaultQueueTimeout,
+                        help="time (s) a request can wait for a conversion slot before it is rejected (503)")
+    parser.add_argument("--max-body", dest="maxBody", type=int, default=defaultMaxBody, help="largest request accepted (bytes)")
+    parser.add_argument("--parser", choices=["auto", "libxmp", "stdlib"], default=convertXMP.defaultParser,
+                        help="XMP parser to use (default: libxmp if it is installed, otherwise the standard library parser)")
+    parser.add_argument("--optimize", action="store_true", help="optimise the filter chains (see optimizeChain.py)")
+    parser.add_argument("--tolerance", type=float, default=None, help="max colour difference (0..1) allowed by --optimize")
+    parser.add_argument("--curve-table", dest="curveTable", type=int, choices=convertXMP.curveTableSizes, default=None,
+                        help="give each tone curve filter the full curve as a table with this many entries")
+    parser.add_argument("--verbose", action="store_true", help="print a line for each request")
+    args = parser.parse_args()
+
+    optimize = None
+    if args.optimize:
+        optimize = args.tolerance
+        if optimize is None:
+            optimize = convertXMP.defaultTolerance
+    elif args.tolerance is not None:
+        parser.error("--tolerance is only used with --optimize")
+    if (args.maxRequests is not None) and (args.maxRequests < 1):
+        parser.error("--max-requests must be at least 1")
+
+    options = ConverterOptions(convertXMP.resolveParser(args.parser), optimize, args.curveTable)
+    try:
+        server = ConvertServer(options, args.host, args.port, args.socket, args.jobs, args.maxRequests, args.queueTimeout,
+                               args.maxBody, args.verbose)
+    except (OSError, ValueError) as e:
+        print("ERROR: could not start the server: " + str(e))
+        sys.exit(1)
+
+    # stop cleanly (removing the socket) when the service manager stops the server
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve()
+    except KeyboardInterrupt:
+        print("")
+    finally:
+        server.close()
+
+
+# ----------------------------
+
+# Conversions. A converter is created (and warmed up) once per thread, or once per worker process, and re-used for every
+# preset converted there
+
+
+ConverterOptions = collections.namedtuple("ConverterOptions", [ "parser", "optimize", "curveTable" ])
+
+# converter for the current thread, or for the worker process
+converters = threading.local()
+
+
+def getConverter(options):
+    converter = getattr(converters, "converter", None)
+    if (converter is None) or (converters.options != options):
+        converter = convertXMP.Converter(options.parser, optimize=options.optimize, curveTable=options.curveTable)
+        converters.converter = converter
+        converters.options = options
+    return converter
+
+
+# converts the sample sidecar, so that everything used by a conversion (numpy, the curve code, the schema etc.) is loaded
+def warmUp(options):
+    with open(sampleFile, 'rb') as f:
+        convertDocument((options, f.read(), "", False))
+
+
+# converts one XMP document (a task is (options, data, key, compact)), returning (status, text). The status is 200 with
+# the preset, 400 if it couldn't be converted or 422 if the result isn't valid, with {"error": ...} as the text
+def convertDocument(task):
+    options, data, key, compact = task
+    converter = getConverter(options)
+    try:
+        preset = converter.convert(data, key)
+    except Exception as e:
+        return (400, errorText(str(e), key, compact))
+    try:
+        preset = convertXMP.annotatePreset(preset)
+    except ValueError as e:
+        return (422, errorText(str(e), key, compact))
+    return (200, convertXMP.presetText(preset, compact))
+
+
+def errorText(error, key, compact):
+    if compact:
+        return json.dumps({ "key": key, "error": error }, separators=(",", ":"))
+    return json.dumps({ "error": error })
+
+
+def initWorker(options):
+    warmUp(options)
+
+
+# runs the conversions, either in the calling thread or in a pool of worker processes
+class Workers(object):
+
+    def __init__(self, options, jobs):
+        import multiprocessing
+        self.options = options
+        self.jobs = jobs
+        if self.jobs <= 0:
+            self.jobs = multiprocessing.cpu_count()
+        self.pool = None
+        warmUp(options)
+        if self.jobs > 1:
+            self.pool = multiprocessing.Pool(self.jobs, initWorker, (options,))
+
+    # converts a list of (data, key) documents, returning a list of (status, text)
+    def convert(self, documents, compact):
+        tasks = [ (self.options, data, key, compact) for data, key in documents ]
+        if self.pool is None:
+            return [ convertDocument(task) for task in tasks ]
+        return self.pool.map(convertDocument, tasks, chunksize=max(1, len(tasks) // (4 * self.jobs)))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+
+
+# ----------------------------
+
+
+# request counts and timings, for each endpoint
+class Metrics(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.endpoints = collections.OrderedDict()
+
+    # elapsed is the time taken to handle the request (s), presets the number of presets converted
+    def record(self, endpoint, status, elapsed, presets=0):
+        with self.lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = { "requests": 0, "errors": 0, "rejected": 0, "presets": 0, "time": 0.0, "max": 0.0,
+                          "recent": collections.deque(maxlen=sampleSize) }
+                self.endpoints[endpoint] = stats
+            stats["requests"] += 1
+            if status == 503:
+                stats["rejected"] += 1
+            elif status >= 400:
+                stats["errors"] += 1
+            stats["presets"] += presets
+            stats["time"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+            stats["recent"].append(elapsed)
+
+    # the metrics as a map (times in ms)
+    def report(self):
+        with self.lock:
+            endpoints = collections.OrderedDict()
+            for endpoint, stats in self.endpoints.items():
+                recent = sorted(stats["recent"])
+                times = collections.OrderedDict()
+                times["mean"] = round(1000.0 * stats["time"] / stats["requests"], 3)
+                for p in percentiles:
+                    times["p" + str(p)] = round(1000.0 * recent[min(len(recent) - 1, len(recent) * p // 100)], 3)
+                times["max"] = round(1000.0 * stats["max"], 3)
+                endpoints[endpoint] = collections.OrderedDict([
+                    ("requests", stats["requests"]), ("errors", stats["errors"]), ("rejected", stats["rejected"]),
+                    ("presets", stats["presets"]), ("ms", times) ])
+            return collections.OrderedDict([ ("uptime", round(time.time() - self.started, 3)), ("endpoints", endpoints) ])
+
+
+# ----------------------------
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = listenBacklog
+
+
+class ThreadingTCPServer(http.server.ThreadingHTTPServer):
+    request_queue_size = listenBacklog
+
+
+class ConvertServer(object):
+
+    # address is either host and port, or the path of a Unix socket. maxRequests is the number of conversions allowed at
+    # the same time (default: the number of jobs), queueTimeout the time (s) a request waits for one
+    def __init__(self, options, host=defaultHost, port=defaultPort, socketPath=None, jobs=1, maxRequests=None,
+                 queueTimeout=defaultQueueTimeout, maxBody=defaultMaxBody, verbose=False):
+        start = time.time()
+        self.options = options
+        self.queueTimeout = queueTimeout
+        self.maxBody = maxBody
+        self.verbose = verbose
+        self.metrics = Metrics()
+        self.active = 0
+        self.activeLock = threading.Lock()
+        self.socketPath = socketPath
+
+        self.workers = Workers(options, jobs)
+        if maxRequests is None:
+            maxRequests = self.workers.jobs
+        self.maxRequests = maxRequests
+        self.slots = threading.BoundedSemaphore(maxRequests)
+        self.version = convertXMP.converterVersion({ "optimize": options.optimize, "curveTable": options.curveTable })
+
+        # (over TCP, the headers and the body are written separately, and the body shouldn't wait for the client to
+        # acknowledge the headers. Unix sockets don't have the option)
+        handler = type("Handler", (RequestHandler,), { "service": self, "disable_nagle_algorithm": socketPath is None })
+        try:
+            if socketPath is not None:
+                removeSocket(socketPath)
+                self.httpd = ThreadingUnixServer(socketPath, handler)
+                self.address = "unix:" + socketPath
+            else:
+                self.httpd = ThreadingTCPServer((host, port), handler)
+                self.address = "%s:%d" % self.httpd.server_address[:2]
+        except Exception:
+            self.workers.close()
+            raise
+        self.ready = time.time() - start
+
+    def serve(self):
+        print("Listening on %s (%d jobs, %d concurrent requests, ready in %.1f ms). Press Ctrl-C to stop"
+              % (self.address, self.workers.jobs, self.maxRequests, 1000.0 * self.ready))
+        sys.stdout.flush()
+        self.httpd.serve_forever()
+
+    def close(self):
+        self.httpd.server_close()
+        self.workers.close()
+        if self.socketPath is not None:
+            removeSocket(self.socketPath)
+
+    # converts the documents in one of the conversion slots. Returns None if no slot became free within the queue timeout
+    def convert(self, documents, compact):
+        if not self.slots.acquire(timeout=self.queueTimeout):
+            return None
+        try:
+            with self.activeLock:
+                self.active += 1
+            return self.workers.convert(documents, compact)
+        finally:
+            with self.activeLock:
+                self.active -= 1
+            self.slots.release()
+
+    def health(self):
+        return collections.OrderedDict([ ("status", "ok"), ("version", self.version), ("parser", self.options.parser),
+                                         ("jobs", self.workers.jobs), ("maxRequests", self.maxRequests),
+                                         ("active", self.active), ("uptime", round(time.time() - self.metrics.started, 3)) ])
+
+
+def removeSocket(path):
+    try:
+        os.remove(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+# ----------------------------
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    # set on the subclass created for each server
+    service = None
+
+    protocol_version = "HTTP/1.1"  # keep-alive, so that a client can send any number of requests on one connection
+    timeout = connectionTimeout
+
+    # status of the response, for the metrics
+    statusCode = 0
+
+    def do_GET(self):
+        start = time.time()
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self.sendJSON(200, json.dumps(self.service.health()))
+        elif path == "/metrics":
+            report = self.service.metrics.report()
+            report["active"] = self.service.active
+            self.sendJSON(200, json.dumps(report, indent=2))
+        else:
+            self.sendError(404, "not found: " + path)
+            path = "other"
+        self.service.metrics.record(path, self.statusCode, time.time() - start)
+
+    def do_POST(self):
+        start = time.time()
+        url = urlsplit(self.path)
+        path = url.path
+        presets = 0
+        if path not in [ "/convert", "/batch" ]:
+            self.sendError(404, "not found: " + path)
+            self.close_connection = True # the body hasn't been read
+            path = "other"
+        else:
+            data = self.readBody()
+            if data is not None:
+                try:
+                    presets = self.handleConvert(path, data, parse_qs(url.query))
+                except Exception as e:
+                    self.sendError(500, "internal error: " + str(e))
+        self.service.metrics.record(path, self.statusCode, time.time() - start, presets)
+
+    # returns the number of presets converted
+    def handleConvert(self, path, data, query):
+        if path == "/convert":
+            documents = [ (data, query.get("key", [ "" ])[0]) ]
+        else:
+            documents = [ (doc, str(i)) for i, doc in enumerate(xmpParser.splitDocuments(BytesReader(data))) ]
+
+        results = self.service.convert(documents, path == "/batch")
+        if results is None:
+            self.sendError(503, "too many requests, try again later", { "Retry-After": "1" })
+            return 0
+
+        if path == "/convert":
+            status, text = results[0]
+            self.sendJSON(status, text)
+        else:
+            self.sendJSON(200, "".join(text + "\n" for status, text in results), "application/x-ndjson")
+        return sum(1 for status, text in results if status == 200)
+
+    # reads the request body, or sends an error and returns None
+    def readBody(self):
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.sendError(411, "Content-Length is required")
+            self.close_connection = True
+            return None
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if (length < 0) or (length > self.service.maxBody):
+            self.sendError(413, "request too large (the limit is %d bytes)" % self.service.maxBody)
+            self.close_connection = True
+            return None
+        return self.rfile.read(length)
+
+    def sendJSON(self, status, text, contentType="application/json", headers=None):
+        data = text.encode("utf-8")
+        self.statusCode = status
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def sendError(self, status, error, headers=None):
+        self.sendJSON(status, json.dumps({ "error": error }), headers=headers)
+
+    # (client_address is empty for a Unix socket)
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        if self.service.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+# splitDocuments reads from a stream, so the body of a /batch request is wrapped in one
+class BytesReader(object):
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def read(self, size=-1):
+        if (size is None) or (size < 0):
+            size = len(self.data) - self.pos
+        chunk = self.data[self.pos:self.pos+size].tobytes()
+        self.pos += len(chunk)
+        return chunk
+
+
+# ----------------------------
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=connectionTimeout):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+# Client for the server, keeping one connection open. address is "unix:PATH", "HOST:PORT" or "PORT".
+# A client must not be used by more than one thread at a time
+class Client(object):
+
+    def __init__(self, address, timeout=connectionTimeout):
+        if address.startswith("unix:"):
+            self.connection = UnixHTTPConnection(address[len("unix:"):], timeout)
+        else:
+            host, sep, port = address.rpartition(":")
+            self.connection = http.client.HTTPConnection(host or defaultHost, int(port), timeout=timeout)
+
+    # sends a request, returning (status, response body)
+    def request(self, method, path, body=None):
+        headers = {}
+        if body is not None:
+            headers["Content-Type"] = "application/octet-stream"
+        self.connection.request(method, path, body, headers)
+        response = self.connection.getresponse()
+        return (response.status, response.read())
+
+    # returns the preset for one XMP document (bytes). Raises ValueError if it can't be converted
+    def convert(self, data, key=""):
+        path = "/convert"
+        if len(key) > 0:
+            path = path + "?key=" + quote(key)
+        status, body = self.request("POST", path, data)
+        result = json.loads(body)
+        if status != 200:
+            raise ValueError(result.get("error", "HTTP status " + str(status)))
+        return result
+
+    # returns a list of presets (or {"key": ..., "error": ...}) for a list of XMP documents, or for several documents in one
+    # buffer
+    def batch(self, data):
+        if not isinstance(data, (bytes, bytearray)):
+            data = b"\0".join(data)
+        status, body = self.request("POST", "/batch", data)
+        if status != 200:
+            raise ValueError(json.loads(body).get("error", "HTTP status " + str(status)))
+        return [ json.loads(line) for line in body.splitlines() if len(line) > 0 ]
+
+    def health(self):
+        return json.loads(self.request("GET", "/health")[1])
+
+    def metrics(self):
+        return json.loads(self.request("GET", "/metrics")[1])
+
+    def close(self):
+        self.connection.close()
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
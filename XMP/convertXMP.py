@@ -9,39 +9,56 @@
 # Many preset XMP files include settings with zero values, so we generally check for that and don't apply the corresponding filter if no changes are made
 # - this is because creating and running a filter takes a lot of memory and sometimes they have an effect even with 'zero' parameters
 
+
+# The converter can also be used as a library:
+#
+#     import convertXMP
+#     preset = convertXMP.convert_xmp(xmpText)     # returns the preset as a map (the same data as the JSON file)
+#
+# All of the state used while converting a preset is held in a Converter object, so there is nothing shared between calls
+# (a Converter can be re-used for any number of presets, and separate Converters can be used from separate threads).
+# Only the standard library is loaded on import; numpy (for curve interpolation) and libxmp are loaded when first needed
+
 import os, os.path
 import errno
-
-from libxmp import XMPMeta, XMPIterator, utils
-from scipy.interpolate import UnivariateSpline
-import numpy as np
+import functools
+import hashlib
+import re
+import sys
+import time
 import json
 import argparse
+from io import StringIO
 
-
-XMP_NS_CAMERA_RAW = "http://ns.adobe.com/camera-raw-settings/1.0/"
-
-# TEMP: default hardcoded files for testing
-infile = 'sample_sidecar.xmp'
-outfile = 'sample_preset.json'
+import embeddedXMP
+import presetCost
+import presetPack
+import presetSchema
+import xmpParser
 
 
-# XMP Metadata
-xmp = XMPMeta()
-
+XMP_NS_CAMERA_RAW = "http://ns.adobe.com/camera-raw-settings/1.0/"
 
-# map holding the various filter parameters
-filterMap = {}
+# default XMP parser backend: "libxmp" (python-xmp-toolkit, needs exempi), "stdlib" (xmpParser.py) or "auto" (libxmp if available)
+defaultParser = "auto"
 
-# there are several ways to change the tone curve, so make it global and have each method build on any previous changes
-# default is a linear tone curve:
-toneCurve = [ [0.0, 0.0], [25.0, 25.0], [50.0, 50.0], [75.0, 75.0], [100.0, 100.0]]
+# default tolerance for --optimize: half of an 8-bit level (same as optimizeChain.defaultTolerance, which isn't imported here
+# so that numpy is only loaded when needed)
+defaultTolerance = 0.5 / 255.0
 
-# flag to indicate that ToneCurve should be added (modified by several different processes)
-toneCurveChanged = False
+# log levels for the progress messages (see --log-level). Each level includes the ones before it, e.g. "info" shows
+# errors, warnings and the stage banners ("...Exposure" etc.) but not the values used by each stage
+logLevels = [ "none", "error", "warning", "info", "debug" ]
+LOG_NONE = 0
+LOG_ERROR = 1
+LOG_WARNING = 2
+LOG_INFO = 3
+LOG_DEBUG = 4
+defaultLogLevel = "debug"
 
-# flag to indicate that conversion to B&W requested
-convertToMono = False
+# sizes allowed for the full resolution tone curve tables (same as curveTables.tableSizes, which isn't imported here so that
+# numpy is only loaded when needed)
+curveTableSizes = [ 256, 1024 ]
 
 
 '''
@@ -68,13 +85,8 @@ colourVectors = {"red": [0.0, 0.7, 0.886806], "orange": [0.0, 0.7, 0.901961], "y
     "aqua": [0.0, 0.7, 0.901961], "blue": [0.0, 0.7, 0.901961], "purple": [0.0, 0.7, 0.901961], "magenta": [0.0, 0.7, 0.901961] }
 '''
 
-# 'no-op' values - 0 degree hue shift and 1x multipliers for saturation and value
-colourVectors = {"red": [0.0,1.0,1.0], "orange": [0.0,1.0,1.0], "yellow": [0.0,1.0,1.0], "green": [0.0,1.0,1.0],
-                 "aqua": [0.0,1.0,1.0], "blue": [0.0,1.0,1.0], "purple": [0.0,1.0,1.0], "magenta": [0.0,1.0,1.0] }
-
-
-# flag indicating that colour vectors have been modified
-coloursChanged = False
+# the colour bands used for the HSV adjustments (the 'no-op' values for each are set up in Converter.reset())
+colourBands = [ "red", "orange", "yellow", "green", "aqua", "blue", "purple", "magenta" ]
 
 # width of a colour band (used for calculating hue changes)
 hueWidth = (360.0 / 8.0) / 100.0
@@ -97,106 +109,759 @@ hueWidth = (360.0 / 8.0) / 100.0
     Also note that we use an array (rather than a dictionary) for the list of filters so that we can maintain the order of the filters
 '''
 
+
 # ----------------------------
 
 
 def main():
 
-    global infile
-    global outfile
-    
     # parse the command line args
     parser = argparse.ArgumentParser()
-    parser.add_argument("input", help="the name of the input XML file")
-    parser.add_argument("output", help="the name of the output JSON file")
+    parser.add_argument("input", nargs="?", help="the name of the input XML file (or source directory tree if --batch is used)")
+    parser.add_argument("output", nargs="?", help="the name of the output JSON file (or destination directory tree if --batch is used)")
+    parser.add_argument("--batch", action="store_true",
+                        help="convert every XMP file found under the input directory, writing to the output directory")
+    parser.add_argument("--stream", action="store_true",
+                        help="read XMP documents from stdin and write one JSON preset per line to stdout")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of worker processes to use in batch mode (0 means one per CPU)")
+    parser.add_argument("--manifest", default=None,
+                        help="manifest file used to skip unchanged presets in batch mode (default: <input>/" + manifestName + ")")
+    parser.add_argument("--force", action="store_true",
+                        help="ignore the manifest and reconvert everything")
+    parser.add_argument("--pack", choices=["group", "tree"], default=None,
+                        help="in batch mode, write pack files (one per group, or one for the whole tree) instead of JSON files")
+    parser.add_argument("--compress", action="store_true",
+                        help="compress the presets in pack files")
+    parser.add_argument("--parser", choices=["auto", "libxmp", "stdlib"], default=defaultParser,
+                        help="XMP parser to use (default: libxmp if it is installed, otherwise the standard library parser)")
+    parser.add_argument("--optimize", action="store_true",
+                        help="combine or remove filters where that doesn't change the result (beyond --tolerance), see optimizeChain.py")
+    parser.add_argument("--tolerance", type=float, default=None,
+                        help="max colour difference (0..1) allowed by --optimize (default: half of an 8-bit level)")
+    parser.add_argument("--lut", action="store_true",
+                        help="replace runs of colour filters with a lookup table image, written next to the JSON file (see lookupTable.py)")
+    parser.add_argument("--curve-table", dest="curveTable", type=int, choices=curveTableSizes, default=None,
+                        help="also give each tone curve filter the full curve as a table with this many entries (see curveTables.py)")
+    parser.add_argument("--log-level", dest="logLevel", choices=logLevels, default=defaultLogLevel,
+                        help="how much progress information to print for each preset (default: " + defaultLogLevel + ", i.e. everything)")
+    parser.add_argument("--images", action="store_true",
+                        help="in batch mode, also convert the XMP embedded in image files (JPEG, TIFF, DNG), see embeddedXMP.py")
+    parser.add_argument("--columnar", action="store_true",
+                        help="in batch mode, convert the presets in batches, with the scalar stages done as numpy array operations (see columnarConvert.py)")
+    parser.add_argument("--dedup", action="store_true",
+                        help="in batch mode, move filters that are used by more than one preset to a shared table (see dedupFilters.py)")
+    parser.add_argument("--index", action="store_true",
+                        help="in batch mode, save a similarity index of the converted presets to the output directory (see presetIndex.py)")
+    parser.add_argument("--config", default=None,
+                        help="in batch mode, write the preset entries for defaultConfig.json to this file, with expensive presets marked as slow (see presetCost.py)")
+    parser.add_argument("--watch", action="store_true",
+                        help="in batch mode, keep running and reconvert presets as they change (see watchPresets.py)")
+    parser.add_argument("--poll", action="store_true",
+                        help="with --watch, check for changes by polling rather than using inotify")
+    parser.add_argument("--debounce", type=float, default=None,
+                        help="with --watch, time (s) to wait for a burst of changes to finish before reconverting")
+    parser.add_argument("--profile", default=None,
+                        help="write a profile of each file and stage to this (JSON) file, plus a Chrome trace (see profileConvert.py)")
     args = parser.parse_args()
-    
-    # print args
-    infile = args.input
-    outfile = args.output
-    
-    parseInput(infile)
 
-    # set up an empty preset
-    initPreset(outfile)
+    parserName = resolveParser(args.parser)
+
+    # the optimiser tolerance (None means don't optimise)
+    optimize = None
+    if args.optimize:
+        optimize = args.tolerance
+        if optimize is None:
+            optimize = defaultTolerance
+    elif args.tolerance is not None:
+        parser.error("--tolerance is only used with --optimize")
+
+    if args.dedup and not args.batch:
+        parser.error("--dedup is only used with --batch")
+    if args.images and ((not args.batch) or args.watch):
+        parser.error("--images is only used with --batch (image files are always accepted as a single input), and not with --watch")
+    if args.watch and ((not args.batch) or (args.pack is not None) or args.dedup or (args.profile is not None)):
+        parser.error("--watch is only used with --batch, and not with --pack, --dedup or --profile")
+    if args.columnar and ((not args.batch) or args.watch or (args.jobs != 1) or (args.profile is not None)):
+        parser.error("--columnar is only used with --batch, and not with --watch, --jobs or --profile")
+    if (args.index or (args.config is not None)) and ((not args.batch) or args.watch or (args.pack is not None)):
+        parser.error("--index and --config are only used with --batch, and not with --watch or --pack")
+    if (args.poll or (args.debounce is not None)) and not args.watch:
+        parser.error("--poll and --debounce are only used with --watch")
+
+    if args.stream:
+        if args.lut:
+            parser.error("--lut can't be used with --stream (the lookup tables are separate image files)")
+        if convertStream(sys.stdin.buffer, sys.stdout, parserName, optimize, args.profile, args.curveTable) > 0:
+            sys.exit(1)
+        return
+
+    if (args.input is None) or (args.output is None):
+        parser.error("input and output are required (unless --stream is used)")
+    if (not args.batch) and isArchive(args.input):
+        parser.error("use --batch to convert the presets in a zip archive (or give the path of one file in it, e.g. pack.zip/preset.xmp)")
+    if args.watch and isArchive(args.input):
+        parser.error("--watch can't be used with a zip archive")
+
+    if args.batch:
+        manifest = args.manifest
+        if manifest is None:
+            manifest = os.path.join(args.input, manifestName)
+            if isArchive(args.input):
+                manifest = os.path.splitext(args.input)[0] + manifestName
+        if args.watch:
+            import watchPresets
+            debounce = args.debounce
+            if debounce is None:
+                debounce = watchPresets.defaultDebounce
+            watchPresets.watchTree(args.input, args.output, parserName, optimize, args.lut, args.logLevel, manifest, debounce,
+                                   args.poll, args.curveTable)
+            return
+        convertTree(args.input, args.output, args.jobs, manifest, args.force, parserName, args.pack, args.compress, optimize,
+                    args.lut, args.logLevel, args.profile, args.dedup, args.images, args.columnar, args.curveTable, args.index,
+                    args.config)
+    else:
+        convertFile(args.input, args.output, parserName, optimize, args.lut, args.logLevel, args.profile, args.curveTable)
 
-    # process the input based on the filters we support in the app
-    # Note: order is based on Photoshop/Lightroom since those are the main sources of presets
-    processInfo()
-    processAuto()
-    processWhiteBalance()
-    processExposure()
-    processContrast()
-    processClarity()
-    processVibrance()
-    processSaturation()
-    processSharpening()
-    processNoiseReduction()
-
-    processGrain()
-    processShadowsHighlights()
-
-    processHSV()
-    processCalibration()
-    processGrayMixer()
-    processRGBToneCurves()
-    
-    processToneCurve()
-    processParametricCurve()
-    
-    addHSV()
-    addToneCurve()
 
-    # process these last
-    processGrayscale()
-    processSplitToning()
-    processVignette()
+# ----------------------------
+
+
+# converts an XMP preset (XML as a string, bytes or a binary file object) and returns the preset map.
+# key is the value used for the "key" entry of the preset (normally the name of the JSON file).
+# optimize is the tolerance for the filter chain optimiser (see optimizeChain.py), None to leave the filters as converted
+def convert_xmp(source, key="", parser=defaultParser, optimize=None):
+    return Converter(parser, optimize=optimize).convert(source, key)
 
 
-    # print the final preset
-    # printPreset()
+# src can be an XMP file or an image containing XMP (see readInput).
+# If lut is set then the lookup table images (if any) are written to the same directory as the preset.
+# If profile is set then the profile report is written to that file (see profileConvert.py).
+# curveTable is the size of the tone curve tables to add (see curveTables.py), None for none
+def convertFile(src, dst, parser=defaultParser, optimize=None, lut=False, logLevel=defaultLogLevel, profile=None, curveTable=None):
+
+    source = openInput(src)
+
+    converter = Converter(parser, log=sys.stdout, optimize=optimize, lut=lut, logLevel=logLevel, curveTable=curveTable)
+    if profile is not None:
+        import profileConvert
+        converter.profiler = profileConvert.Profiler()
+    try:
+        preset = converter.convert(source, dst, src)
+    finally:
+        if hasattr(source, "close"):
+            source.close()
+    if profile is not None:
+        saveProfile(profile, converter.profiler.events)
 
     # and save it...
-    savePreset(outfile)
+    savePreset(dst, preset)
+    for name, data in converter.lookups:
+        writePreset(os.path.join(os.path.dirname(dst), name), data)
+        print("Saved to: " + os.path.join(os.path.dirname(dst), name) + "\n")
 
 
 # ----------------------------
 
+# Streaming mode: XMP documents are read from an input stream (concatenated or NUL-separated, see xmpParser.splitDocuments) and each
+# preset is written as a single line of JSON (JSON Lines), in the same order. The key of each preset is its position in the
+# stream (0, 1, 2...). If a preset can't be converted then the line is {"key": ..., "error": ...} instead, so that there is still
+# exactly one line per input document. Returns the number of presets that could not be converted
+
+
+def convertStream(inf, outf, parser=defaultParser, optimize=None, profile=None, curveTable=None):
+
+    start = time.time()
+    converter = Converter(parser, optimize=optimize, curveTable=curveTable)
+    if profile is not None:
+        import profileConvert
+        converter.profiler = profileConvert.Profiler()
+    count = 0
+    failed = 0
+    for doc in xmpParser.splitDocuments(inf):
+        key = str(count)
+        try:
+            line = json.dumps(converter.convert(doc, key), separators=(",", ":"))
+        except Exception as e:
+            failed = failed + 1
+            line = json.dumps({ "key": key, "error": str(e) }, separators=(",", ":"))
+        outf.write(line + "\n")
+        outf.flush()
+        count = count + 1
+
+    sys.stderr.write("Converted: " + str(count - failed) + " presets, Failed: " + str(failed) + "\n")
+    if profile is not None:
+        saveProfile(profile, converter.profiler.events, time.time() - start, sys.stderr)
+    return failed
 
-def parseInput(f):
-    # open the XMP file and parse
-    with open(f, 'r') as inf:
-        strbuffer = inf.read()
-    xmp.parse_from_str(strbuffer)
-    print("--------------------------------")
-    print("\nProcessing: " + infile + "...")
+
+# ----------------------------
+
+# Batch mode: convert a whole tree of XMP files in a single process, so that we only pay for the imports
+# (and the exempi initialisation) once. Output names are cleaned up in the same way as genconvert.sh
+
+
+# list of tokens to remove from filenames (same as genconvert.sh)
+remList = [ "_", "Sleeklens-", "SleeklensStarter-", "Base-", "AllInOne-", "Tone-", "Polish-", "Exposure-", "Tint-",
+            "Vintage-", "Black&White-", "ColorCorrect-", "Toners-", "AllinOne-" ]
+
+
+# If pack is "group" or "tree" then the presets are written to pack files (see presetPack.py) rather than separate JSON files.
+# If dedup is set then filters that are used by more than one preset are moved to a shared table (see dedupFilters.py).
+# Packs and shared tables are always rebuilt from scratch, so the manifest isn't used.
+# If images is set then the XMP embedded in image files is converted too (see findPresets).
+# If columnar is set then the presets are converted in batches by columnarConvert.py (in this process, jobs is ignored),
+# which gives the same presets but doesn't log the stages of each one.
+# If index is set then a similarity index of all of the presets in dstdir is saved there (see presetIndex.py).
+# If config is set then the preset entries for defaultConfig.json are written to that file, with the presets that are
+# expensive to render marked as slow (see presetCost.py)
+def convertTree(srcdir, dstdir, jobs=1, manifestFile=None, force=False, parser=defaultParser, pack=None, compress=False,
+                optimize=None, lut=False, logLevel=defaultLogLevel, profile=None, dedup=False, images=False, columnar=False,
+                curveTable=None, index=False, config=None):
+
+    import multiprocessing
+    from concurrent.futures import ThreadPoolExecutor
+
+    start = time.time()
+
+    fileList = findPresets(srcdir, dstdir, images)
+
+    # drop anything that hasn't changed since the last run
+    version = converterVersion({ "optimize": optimize, "lut": lut, "curveTable": curveTable })
+    oldManifest = {}
+    if (pack is not None) or dedup:
+        manifestFile = None
+    if (manifestFile is not None) and (not force):
+        oldManifest = loadManifest(manifestFile)
+    manifest = {}
+    todo = []
+    for src, dst in fileList:
+        key = os.path.relpath(src, srcdir)
+        entry = oldManifest.get(key)
+        if isUnchanged(entry, src, dst, version):
+            manifest[key] = entry
+        else:
+            todo.append((src, dst))
+    skipped = len(fileList) - len(todo)
+
+    # Files are read by a background thread (readPresets is consumed by the pool's task handler), converted by the workers
+    # and written by a separate writer thread, so the workers don't have to wait for the disk.
+    # Results come back in the same order as the (sorted) file list, so the output is the same whatever the number of jobs
+    task = functools.partial(convertTask, parser=resolveParser(parser), compact=(pack is not None), optimize=optimize,
+                             lut=lut, logLevel=logLevel, profile=(profile is not None), curveTable=curveTable)
+    verbose = logLevels.index(logLevel) >= LOG_INFO
+    pool = None
+    if jobs <= 0:
+        jobs = multiprocessing.cpu_count()
+    if columnar:
+        import columnarConvert
+        results = columnarConvert.convertTasks(readPresets(todo), resolveParser(parser), pack is not None, optimize, lut,
+                                               curveTable)
+    elif jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(task, readPresets(todo), chunksize=4)
+    else:
+        results = map(task, readPresets(todo))
+
+    writer = ThreadPoolExecutor(max_workers=1)
+    pending = []
+    pendingLookups = []
+    packed = []
+    failed = []
+    removed = [ 0, 0 ] # filters removed by the optimiser, out of the total
+    events = [] # profile events
+    deduping = [] # presets held back until everything is converted (for dedup)
+
+    # writes a converted preset (or adds it to the pack)
+    def output(src, dst, digest, text, lookupHashes):
+        if pack is not None:
+            key = os.path.splitext(os.path.relpath(dst, dstdir))[0].replace(os.sep, "/")
+            packed.append((key, text.encode("utf-8")))
+            if verbose:
+                print("\nAdded to pack: " + key + "\n")
+        else:
+            data = text.encode("utf-8")
+            pending.append((src, writer.submit(writePreset, dst, data)))
+            manifest[os.path.relpath(src, srcdir)] = { "input": digest, "version": version, "output": hashBytes(data),
+                                                       "dst": dst, "lookups": lookupHashes }
+            if verbose:
+                print("\nSaved to: " + dst + "\n")
+
+    try:
+        for src, dst, digest, text, log, error, counts, lookups, profileEvents in results:
+            sys.stdout.write(log)
+            removed = [ removed[0] + counts[0], removed[1] + counts[1] ]
+            events.extend(profileEvents)
+
+            # lookup tables are written next to the preset (or the pack)
+            lookupHashes = {}
+            for name, data in lookups:
+                path = os.path.join(os.path.dirname(dst), name)
+                pendingLookups.append((src, writer.submit(writePreset, path, data)))
+                lookupHashes[path] = hashBytes(data)
+                if verbose:
+                    print("\nSaved to: " + path)
+
+            if error is not None:
+                print("ERROR: could not convert " + src + ": " + error)
+                failed.append(src)
+            elif dedup:
+                deduping.append((src, dst, digest, text, lookupHashes))
+            else:
+                output(src, dst, digest, text, lookupHashes)
+
+        if dedup:
+            import dedupFilters
+            presets = [ (dst, json.loads(text)) for src, dst, digest, text, lookupHashes in deduping ]
+            table, deduped, dedupStats = dedupFilters.dedupPresets(presets)
+            for (src, dst, digest, text, lookupHashes), (name, preset) in zip(deduping, deduped):
+                output(src, dst, digest, presetText(preset, pack is not None), lookupHashes)
+            sharedFile = os.path.join(dstdir, dedupFilters.sharedName)
+            writePreset(sharedFile, presetText(table).encode("utf-8"))
+            print("Saved to: " + sharedFile + " (" + str(len(table["stages"])) + " shared filters)")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        writer.shutdown(wait=True)
+
+    count = 0
+    unchanged = 0
+    for src, future in pending:
+        try:
+            if not future.result():
+                unchanged = unchanged + 1
+            count = count + 1
+        except (IOError, OSError) as e:
+            print("ERROR: could not write " + src + ": " + str(e))
+            failed.append(src)
+            del manifest[os.path.relpath(src, srcdir)]
+    for src, future in pendingLookups:
+        try:
+            future.result()
+        except (IOError, OSError) as e:
+            print("ERROR: could not write lookup table for " + src + ": " + str(e))
+            if src not in failed:
+                failed.append(src)
+            manifest.pop(os.path.relpath(src, srcdir), None)
+
+    if pack is not None:
+        count = len(packed)
+        packPath = dstdir
+        if pack == "tree":
+            packPath = os.path.join(dstdir, "presets" + presetPack.packExtension)
+        for packFile, presets in presetPack.groupPresets(packed, packPath, pack == "group"):
+            presetPack.writePack(packFile, presets, compress)
+            print("Saved to: " + packFile + " (" + str(len(presets)) + " presets)")
+
+    if manifestFile is not None:
+        saveManifest(manifestFile, manifest)
+
+    if index:
+        # built from the whole output tree, so it includes the presets that were skipped as unchanged
+        import presetIndex
+        indexFile = os.path.join(dstdir, presetIndex.indexName)
+        presets = presetIndex.buildIndex([ dstdir ])
+        presets.save(indexFile)
+        print("Saved to: " + indexFile + " (" + str(len(presets)) + " presets)")
+
+    if config is not None:
+        # also built from the whole output tree
+        import dedupFilters
+        presets = list(dedupFilters.readPresets([ dstdir ]))
+        presetCost.saveConfig(config, presets)
+        slow = sum(1 for entry in presetCost.configEntries(presets) if entry["slow"])
+        print("Saved to: " + config + " (" + str(len(presets)) + " presets, " + str(slow) + " slow)")
+
+    elapsed = time.time() - start
+    printSummary(count, failed, elapsed, skipped, unchanged)
+    if optimize is not None:
+        print("Optimised: removed " + str(removed[0]) + " of " + str(removed[1]) + " filters")
+    if lut:
+        print("Lookup tables: " + str(len(pendingLookups)) + " written")
+    if dedup:
+        dedupFilters.printStats(dedupStats, table, 0)
+    if profile is not None:
+        saveProfile(profile, events, elapsed)
+
+
+# generator that reads the input files, yielding a conversion task (including the hash of the contents) for each one
+def readPresets(fileList):
+    for src, dst in fileList:
+        try:
+            data = readInput(src)
+            digest = inputDigest(data)
+            strbuffer = data
+            if isinstance(data, bytes):
+                strbuffer = data.decode("utf-8")
+        except (IOError, OSError, UnicodeDecodeError, ValueError):
+            digest = None
+            strbuffer = None
+        yield (src, dst, strbuffer, digest)
+
+
+# opens an input file for conversion. A plain XMP file is returned as an open (binary) file, which the parser reads a block
+# at a time (so a large sidecar is never held in memory as a whole), anything else is read with readInput
+def openInput(path):
+    if (splitArchivePath(path) is None) and not embeddedXMP.isImage(path):
+        return open(path, 'rb')
+    return readInput(path)
+
+
+# reads an input file: either an XMP file, or an image with embedded XMP (see embeddedXMP.py, only the XMP is read from an
+# image). Returns the XMP as bytes, or a list of documents if it is split (extended XMP in a JPEG).
+# Raises ValueError if an image doesn't contain any XMP
+# The path can also be a member of a zip archive (see splitArchivePath), which is read straight from the archive
+def readInput(path):
+    archive = splitArchivePath(path)
+    if archive is not None:
+        data = openArchive(archive[0]).read(archive[1])
+        if embeddedXMP.isImage(path):
+            return imagePackets(embeddedXMP.dataPackets(data), path)
+        return data
+    if embeddedXMP.isImage(path):
+        return imagePackets(embeddedXMP.extractPackets(path), path)
+    with open(path, 'rb') as inf:
+        return inf.read()
+
+
+def imagePackets(packets, path):
+    if len(packets) == 0:
+        raise ValueError("no XMP found in " + path)
+    if len(packets) == 1:
+        return packets[0]
+    return packets
+
+
+# the hash of an input (as returned by readInput) that is recorded in the manifest
+def inputDigest(data):
+    if isinstance(data, list):
+        data = b"\0".join(data)
+    return hashBytes(data)
+
+
+# converts a single file (runs in a worker process if jobs > 1). The log output is captured and returned with the
+# result so that it can be printed in order, as are the profile events if profile is set.
+# Returns (src, dst, input hash, json text, log, error, (filters removed, total), [(lookup table name, PNG data)], [profile events])
+def convertTask(task, parser=defaultParser, compact=False, optimize=None, lut=False, logLevel=defaultLogLevel, profile=False,
+                curveTable=None):
+    src, dst, strbuffer, digest = task
+    text = None
+    error = None
+    log = StringIO()
+    converter = Converter(parser, log, optimize, lut, logLevel, curveTable)
+    if profile:
+        import profileConvert
+        converter.profiler = profileConvert.Profiler()
+    try:
+        if strbuffer is None:
+            error = "could not read file"
+            if embeddedXMP.isImage(src):
+                error = "could not read file, or it contains no XMP"
+        else:
+            preset = converter.convert(strbuffer, dst, src)
+            text = presetText(annotatePreset(preset), compact)
+    except Exception as e:
+        error = str(e)
+    if error is not None:
+        converter.lookups = []
+    events = []
+    if converter.profiler is not None:
+        events = converter.profiler.events
+    return (src, dst, digest, text, log.getvalue(), error, converter.removed, converter.lookups, events)
 
 
 # ----------------------------
 
+# Incremental rebuilds: the manifest records, for each preset, the hash of the input XMP, the version of the converter
+# and the hash of the JSON that was written. If none of those have changed then the preset is skipped
 
-def initPreset(f):
-    filterMap["key"] = f
-    filterMap["info"] ={}
-    filterMap["filters"] = []
+
+manifestName = ".convertManifest.json"
+
+# the files whose contents define the converter 'version' (i.e. changing any of them can change the output)
+# (curves.py is found by name rather than imported, so that numpy isn't loaded just to check the manifest)
+scriptDir = os.path.dirname(os.path.abspath(__file__))
+versionFiles = [ os.path.abspath(__file__), os.path.join(scriptDir, "xmpParser.py"), os.path.join(scriptDir, "curves.py"),
+                 os.path.join(scriptDir, "optimizeChain.py"), os.path.join(scriptDir, "lookupTable.py"),
+                 os.path.join(scriptDir, "columnarConvert.py"), os.path.join(scriptDir, "curveTables.py"),
+                 os.path.join(scriptDir, "presetSchema.py"), os.path.join(scriptDir, "presetSchema.json"),
+                 os.path.join(scriptDir, "presetCost.py") ]
+
+
+def hashBytes(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def hashFile(path):
+    with open(path, 'rb') as f:
+        return hashBytes(f.read())
+
+
+# options is a map of the conversion options that change the output (e.g. --optimize), default values are ignored
+def converterVersion(options=None):
+    h = hashlib.sha1()
+    for path in versionFiles:
+        with open(path, 'rb') as f:
+            h.update(f.read())
+    if options is not None:
+        options = dict([ (k, v) for k, v in options.items() if v not in (None, False) ])
+        if len(options) > 0:
+            h.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+
+def loadManifest(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def saveManifest(path, manifest):
+    # write to a temp file and rename, so an interrupted run can't leave a corrupt manifest
+    tmp = path + ".tmp"
+    with safe_open_w(tmp) as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+# checks whether a preset can be skipped, i.e. the input, converter and output all match the manifest entry
+def isUnchanged(entry, src, dst, version):
+    if entry is None:
+        return False
+    if (entry.get("version") != version) or (entry.get("dst") != dst):
+        return False
+    try:
+        for path, digest in entry.get("lookups", {}).items():
+            if hashFile(path) != digest:
+                return False
+        return (inputDigest(readInput(src)) == entry.get("input")) and (hashFile(dst) == entry.get("output"))
+    except (IOError, OSError, ValueError):
+        return False
+
+
+# builds the (sorted) list of input files and their associated output files. If images is set then image files containing
+# XMP are included too, unless there is an XMP (sidecar) file with the same name, which takes precedence.
+# Zip archives are treated as if they had been unzipped where they are (srcdir can also be a zip archive)
+def findPresets(srcdir, dstdir, images=False):
+    srcList = []
+    for root, files in walkInputs(srcdir):
+        sidecars = set(os.path.splitext(f)[0].lower() for f in files if f.lower().endswith(".xmp"))
+        for f in files:
+            if f.lower().endswith(".xmp"):
+                srcList.append(os.path.join(root, f))
+            elif images and embeddedXMP.isImage(f) and (os.path.splitext(f)[0].lower() not in sidecars):
+                srcList.append(os.path.join(root, f))
+    srcList.sort()
+
+    fileList = []
+    outputs = {} # output file -> input file (for images)
+    for path in srcList:
+        dst = presetOutput(srcdir, dstdir, path)
+        if dst is None:
+            print("# Ignoring: " + cleanupFilename(os.path.splitext(os.path.basename(path))[0]))
+            continue
+        if images:
+            if dst in outputs:
+                print("# Ignoring: " + path + " (same output file as " + outputs[dst] + ")")
+                continue
+            outputs[dst] = path
+        fileList.append((path, dst))
+
+    return fileList
+
+
+# returns the output file for an input file (path, somewhere under srcdir), or None if the file is to be ignored
+def presetOutput(srcdir, dstdir, path):
+    # extract the filename without directories or extension
+    filename = cleanupFilename(os.path.splitext(os.path.basename(path))[0])
+
+    # ignore if name contains "--"
+    if "--" in filename:
+        return None
+
+    # create output directory path (leaving out the name of the archive, for a file in a zip archive)
+    subdir = os.path.relpath(os.path.dirname(path), srcdir)
+    archive = splitArchivePath(path)
+    if (archive is not None) and (archive[0] != srcdir):
+        subdir = os.path.join(os.path.relpath(os.path.dirname(archive[0]), srcdir), os.path.dirname(archive[1]))
+    return os.path.normpath(os.path.join(dstdir, subdir, filename + ".json"))
+
+
+# ----------------------------
+
+# Zip archives: vendor packs usually come as zip files, which can be converted without unzipping them. A file in an archive
+# is identified by the path of the archive followed by the name of the file in it, e.g. xmpPresets/Vendor.zip/Pack/Preset.xmp,
+# and it is read straight from the archive (nothing is extracted to the disk)
+
+
+archiveExtension = ".zip"
+
+
+# generator for (directory, [file names]) for all of the directories under srcdir, including the directories in any zip
+# archives (as if they had been unzipped)
+def walkInputs(srcdir):
+    if isArchive(srcdir):
+        for entry in archiveDirectories(srcdir):
+            yield entry
+        return
+    for root, dirs, files in os.walk(srcdir):
+        yield (root, [ f for f in files if not isArchive(f) ])
+        for f in files:
+            if isArchive(f):
+                for entry in archiveDirectories(os.path.join(root, f)):
+                    yield entry
+
+
+def isArchive(path):
+    return path.lower().endswith(archiveExtension)
+
+
+# returns a list of (directory, [file names]) for the members of an archive. Members with unsafe names (absolute paths or
+# ".." components) are ignored, since the output file names are based on them
+def archiveDirectories(path):
+    import zipfile
+    directories = {}
+    try:
+        names = openArchive(path).namelist()
+    except (IOError, OSError, zipfile.BadZipFile) as e:
+        print("ERROR: could not read archive " + path + ": " + str(e))
+        return []
+    for name in names:
+        parts = name.split("/")
+        if name.endswith("/") or name.startswith("/") or (".." in parts) or ("\\" in name):
+            continue
+        if (parts[0] == "__MACOSX") or parts[-1].startswith("._"): # (resource forks added by the macOS archiver)
+            continue
+        directories.setdefault(os.path.join(path, *parts[:-1]), []).append(parts[-1])
+    return sorted(directories.items())
+
+
+# returns (archive path, member name) if a path refers to a file in a zip archive, otherwise None
+def splitArchivePath(path):
+    parts = path.split(os.sep)
+    for i in range(len(parts) - 1):
+        if isArchive(parts[i]):
+            archive = os.sep.join(parts[:i+1])
+            if os.path.isfile(archive):
+                return (archive, "/".join(parts[i+1:]))
+    return None
+
+
+# the archives are kept open (the directory of an archive is only read once, however many files are read from it)
+@functools.lru_cache(maxsize=16)
+def openArchive(path):
+    import zipfile
+    return zipfile.ZipFile(path, 'r')
 
 
 # ----------------------------
 
 
-def printPreset():
-    #print ("Raw map: " + str(filterMap))
-    print ("\n\n")
-    print ("JSON: " + json.dumps(filterMap, indent=2))
+# removes unwanted text from a preset filename. Must match cleanupFilename() in genconvert.sh
+def cleanupFilename(filename):
+
+    # remove spaces
+    filename = re.sub(r"\s", "", filename)
+
+    filename = filename.replace("Exposure-1", "ExposureMinus1")
+
+    # replace unwanted strings
+    for token in remList:
+        filename = filename.replace(token, "")
+
+    # get rid of N- prefixes
+    if re.match(r"^[0-9]-.*", filename):
+        filename = filename[2:]
+
+    # get rid of N.NN- prefixes
+    if re.match(r"^[0-9].[0-9][0-9]-.*", filename):
+        filename = filename[5:]
+
+    return filename
+
+
+def printSummary(count, failed, elapsed, skipped=0, unchanged=0):
+    rate = 0.0
+    if elapsed > 0.0:
+        rate = count / elapsed
+    print("--------------------------------")
+    print("Converted: " + str(count) + " files (" + str(unchanged) + " identical, not rewritten), Skipped: " + str(skipped) +
+          " unchanged, Failed: " + str(len(failed)))
+    for f in failed:
+        print("    " + f)
+    print("Total time: %.3f s (%.1f files/s)" % (elapsed, rate))
+
+
+# writes the profile report and trace (see profileConvert.py), and prints a summary of it
+def saveProfile(path, events, elapsed=None, out=sys.stdout):
+    import profileConvert
+    tracePath = profileConvert.writeProfile(path, events, elapsed)
+    with open(path, 'r') as f:
+        profileConvert.printReport(json.load(f), 5, out)
+    out.write("Profile saved to: " + path + " (trace: " + tracePath + ")\n")
 
 
 # ----------------------------
 
 
-def savePreset(f):
-    with safe_open_w(f) as outf:
-        json.dump(filterMap, outf, indent=2)
-        print("\nSaved to: " + f + "\n")
+# returns the XMP parser backend to use. For "auto", libxmp is used if it (and the exempi library) can be loaded
+def resolveParser(name):
+    if name == "auto":
+        if libxmpAvailable():
+            return "libxmp"
+        return "stdlib"
+    return name
+
+
+# (only checked once per process)
+@functools.lru_cache(maxsize=None)
+def libxmpAvailable():
+    try:
+        from libxmp import exempi
+        exempi.EXEMPI.xmp_get_error # forces the exempi library to be loaded
+        return True
+    except Exception:
+        return False
+
+
+# ----------------------------
+
+
+# adds the batch mode annotations to a converted preset: the estimated cost (see presetCost.py), and the validation stamp
+# (see presetSchema.py). Raises ValueError if the preset isn't valid
+def annotatePreset(preset):
+    preset["cost"] = presetCost.presetCost(preset)
+    return presetSchema.defaultValidator().stampPreset(preset)
+
+
+# returns the JSON for a preset. compact is the form used in pack files (see presetPack.compactJSON)
+def presetText(preset, compact=False):
+    if compact:
+        return json.dumps(preset, separators=(",", ":"))
+    return json.dumps(preset, indent=2)
+
+
+def savePreset(f, preset):
+    writePreset(f, presetText(preset).encode("utf-8"))
+    print("\nSaved to: " + f + "\n")
+
+
+# writes the (encoded) preset, unless the file already contains exactly the same bytes. Returns True if the file was written
+def writePreset(f, data):
+    try:
+        with open(f, 'rb') as inf:
+            if inf.read() == data:
+                return False
+    except (IOError, OSError):
+        pass
+    if len(os.path.dirname(f)) > 0:
+        mkdir_p(os.path.dirname(f))
+    with open(f, 'wb') as outf:
+        outf.write(data)
+    return True
 
 
 def mkdir_p(path):
@@ -218,1084 +883,1322 @@ def safe_open_w(path):
 
 # ----------------------------
 
+# The conversion itself. A Converter holds everything that is built up while converting a preset (the settings snapshot,
+# the filter list, the tone curve and colour vectors that several stages contribute to), and all of it is reset at the
+# start of each convert() call. A single Converter must not be used by more than one thread at a time
 
-def processInfo():
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Name"):
-        name = xmp.get_localized_text(XMP_NS_CAMERA_RAW, "Name", "", "us-en")
-        # print ("Name: " + str(name))
-        filterMap["info"]["name"] = name
 
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Group"):
-        group = xmp.get_localized_text(XMP_NS_CAMERA_RAW, "Group", "", "us-en")
-        # print ("Name: " + str(name))
-        filterMap["info"]["group"] = group
+class Converter(object):
 
+    # the conversion stages, in the order in which they are run
+    # Note: order is based on Photoshop/Lightroom since those are the main sources of presets
+    stages = [ "processInfo",
+               "processAuto",
+               "processWhiteBalance",
+               "processExposure",
+               "processContrast",
+               "processClarity",
+               "processVibrance",
+               "processSaturation",
+               "processSharpening",
+               "processNoiseReduction",
 
-# ----------------------------
+               "processGrain",
+               "processShadowsHighlights",
 
+               "processHSV",
+               "processCalibration",
+               "processGrayMixer",
+               "sampleToneCurves",
+               "processRGBToneCurves",
 
-def processAuto():
-    # if any "Auto" function is specified, then run the auto adjust filter (which adjusts everything)
-    auto = False
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "AutoBrightness"):
-        auto = True
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "AutoContrast"):
-        auto = True
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "AutoExposure"):
-        auto = True
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "AutoShadows"):
-        auto = True
-    if auto:
-        filterMap["filters"].append( { 'key':"AutoAdjustFilter", "parameters":[] } )
-        print ("...Auto Adjust")
+               "processToneCurve",
+               "processParametricCurve",
 
+               "addHSV",
+               "addToneCurve",
+               "addCurveTables",
 
-# ----------------------------
+               # process these last
+               "processGrayscale",
+               "processSplitToning",
+               "processVignette" ]
 
 
-def processWhiteBalance():
-    temp = 0.0
-    tint = 0.0
-    
-    # keys: either WhiteBalance (preset) and/or Temperature and Tint
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "WhiteBalance"):
-        # preset is one of: As Shot, Auto, Daylight, Cloudy, Shade, Tungsten, Fluorescent, Flash, Custom
-        # Just ignore As Shot, Auto and Custom
-        wbPresets = { "Daylight":    { 'temp': 5500.0, 'tint': 10.0 },
-                      "Cloudy":      { 'temp': 6500.0, 'tint': 10.0 },
-                      "Shade":       { 'temp': 7500.0, 'tint': 10.0 },
-                      "Tungsten":    { 'temp': 2850.0, 'tint': 0.0 },
-                      "Fluorescent": { 'temp': 3800.0, 'tint': 21.0 },
-                      "Flash":       { 'temp': 5500.0, 'tint': 0.0 } }
-                      
-        preset = xmp.get_property(XMP_NS_CAMERA_RAW, "WhiteBalance")
-        if preset in wbPresets:
-            temp = min(wbPresets[preset]['temp'], 10000.0)
-            tint = max(min(wbPresets[preset]['tint'], 100.0), -100.0)
-            filterMap["filters"].append( { 'key':"WhiteBalanceFilter", "parameters":[ { 'key':"inputTemperature", 'val':temp, 'type':"CIAttributeTypeScalar"},
-                                                                                      {'key':"inputTint", 'val': tint, 'type': "CIAttributeTypeScalar"} ]
-                                                                 } )
-            print ("...Preset White Balance")
-        elif preset == "Auto": # for Auto, just run auto correct
-            filterMap["filters"].append( { 'key':"AutoAdjustFilter", "parameters":[] } )
-
-        elif preset == "Custom":
-            temp = 5500.0
-            tint = 0.0
-            if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Temperature"):
-                temp = min(xmp.get_property_float(XMP_NS_CAMERA_RAW, "Temperature"), 10000.0)
-
-            if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Tint"):
-                tint = clamp(xmp.get_property_float(XMP_NS_CAMERA_RAW, "Tint"), -100.0, 100.0)
-
-            filterMap["filters"].append( { 'key':"WhiteBalanceFilter", "parameters":[ { 'key':"inputTemperature", 'val':temp, 'type':"CIAttributeTypeScalar"},
-                                                                                 {'key':"inputTint", 'val': tint, 'type': "CIAttributeTypeScalar"} ]
-                                    } )
-            print("Temp: " + str(temp) + " Tint: " + str(tint))
-            print ("...Custom White Balance")
+    # parser is the XMP parser backend (see resolveParser), log is a file object for the progress messages (None to discard them),
+    # optimize is the tolerance for the filter chain optimiser (None to leave the filters as converted), lut selects whether
+    # runs of colour filters are replaced by lookup tables (the images are left in self.lookups), logLevel is the most
+    # detailed level of message to write to the log (see logLevels), curveTable is the size of the full resolution tables
+    # added to the tone curve filters (None for none, see curveTables.py)
+    def __init__(self, parser=defaultParser, log=None, optimize=None, lut=False, logLevel=defaultLogLevel, curveTable=None):
+        self.parser = resolveParser(parser)
+        self.logFile = log
+        self.logLevel = logLevels.index(logLevel)
+        if log is None:
+            self.logLevel = LOG_NONE
+        self.optimize = optimize
+        self.lut = lut
+        self.curveTable = curveTable
 
+        # time taken by each step of the conversion (parse, each stage etc.), as a map of name -> [seconds, count].
+        # Not recorded unless this is set to a map (e.g. by the benchmarks), and not cleared by reset()
+        self.timings = None
 
-# ----------------------------
+        # profiler (see profileConvert.Profiler) that records each file and step, if set
+        self.profiler = None
 
+        self.reset()
 
-def processExposure():
-    value = 0.0
-    # keys: Exposure or Exposure2012. Range -5.0 .. +5.0 -> -10.0 ... +10.0 (but same scale)
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Exposure"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Exposure")
-        if abs(value)>0.01:
-            filterMap["filters"].append( { 'key':"CIExposureAdjust", "parameters":[{ 'key':"inputEV", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
-            print("Exposure: " + str(value))
-            print ("...Exposure")
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Exposure2012"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Exposure2012")
-        if abs(value)>0.01:
-            filterMap["filters"].append( { 'key':"CIExposureAdjust", "parameters":[{ 'key':"inputEV", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
-            print("Exposure: " + str(value))
-            print ("...Exposure2012")
 
+    def reset(self):
 
-# ----------------------------
+        # snapshot of the camera raw settings of the current preset (see xmpParser.PresetSettings)
+        self.settings = xmpParser.PresetSettings()
 
+        # map holding the various filter parameters
+        self.filterMap = {}
 
-def processContrast():
-    
-    global toneCurve
-    global toneCurveChanged
+        # there are several ways to change the tone curve, so have each method build on any previous changes
+        # default is a linear tone curve:
+        self.toneCurve = [ [0.0, 0.0], [25.0, 25.0], [50.0, 50.0], [75.0, 75.0], [100.0, 100.0]]
 
-    minContrast = 1.0
-    found = False
-    value = 0.0
-    
-    # keys: Contrast or Contrast2012. Range -50..+100 -> 0.25..4.0 (1.0 is neutral)
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Contrast"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Contrast")
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Contrast2012"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Contrast2012")
-
-    value = value / 2.0 # built in filter is much stronger than Photoshop/Lightroom
-
-    if found and abs(value)>0.001:
-        # if the value is +ve we can use the built in Contrast Filter
-        if value>=0.0:
-            #value = 1.0 + value * 3.0 / 100.0 # 0..100 -> 1..4
-            value = 1.0 + value / 100.0 # 0..100 -> 1..2
-
-            value = clamp(value, minContrast, 4.0)
-            filterMap["filters"].append( { 'key':"ContrastFilter", "parameters":[{ 'key':"inputContrast", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
-            print("Contrast: " + str(value))
-        else:
-            print("Negative Contrast not really supported")
-            # -ve contrast, the built in filter sucks with this, so adjust the tone curve instead
-            b = calculateCurveChangeConstrained(toneCurve[1][1], -value, toneCurve[2][1]-10.0, toneCurve[0][1]+10.0)
-            toneCurve[1][1] = b
-            toneCurveChanged = True
-            print("Updated Curve: " + str(toneCurve))
-            '''
-            value = 1.0 + value / 100.0 # 0..100 -> 1..2
-            value = clamp(value, 0.25, 1.0)
-            filterMap["filters"].append( { 'key':"ContrastFilter", "parameters":[{ 'key':"inputContrast", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
-            print("Contrast: " + str(value))
-            '''
+        # flag to indicate that ToneCurve should be added (modified by several different processes)
+        self.toneCurveChanged = False
 
-        print ("...Contrast")
+        # the point curve that the tone curve was sampled from, if any: (x, y, samples), see processToneCurve()
+        self.pointCurve = None
 
-# ----------------------------
+        # the point curves that have to be resampled ("master", "red", "green", "blue"), as a map of name -> (x, y), and the
+        # samples of each (see sampleToneCurves)
+        self.pointCurves = {}
+        self.curveSamples = {}
 
+        # the curve filters that get full resolution tables (see addCurveTables): "master" -> the CIToneCurve filter, and
+        # "channels" -> (the RGBChannelToneCurve filter, the (x, y) of each channel, map of name -> (x, y) of resampled curves)
+        self.curveFilters = {}
 
-def processShadowsHighlights():
-    # Highlights, Shadows, Whites, Blacks or: Highlights2012, Shadows2012, Whites2012, Blacks2012
-    # maybe not the right way to do it, but we will just modify the input values of the tone curve
-    # [0]=Blacks [1]=Shadows [2]=??? [3]=Highlights [4]=Whites
-    
-    global toneCurve
-    global toneCurveChanged
+        # flag to indicate that conversion to B&W requested
+        self.convertToMono = False
 
-    found = False
-    
-    # look for specific settings of each point and apply them on top of the current curve
-    # if the value is (approx) 0 then just ignore it
-    
-    # not quite sure how this works, e.g what does +100 mean?
-    
-    b = 0.0
-    w = 0.0
-    s = 0.0
-    h = 0.0
-    value = 0.0
-
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Blacks"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Blacks")
-        if abs(value)>0.01:
-            found = True
-            b = calculateCurveChangeConstrained(toneCurve[0][0], -value, toneCurve[1][0]-10.0, 0.0)
-            toneCurve[0][0] = b
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Blacks2012"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Blacks2012")
-        if abs(value)>0.01:
-            found = True
-            b = calculateCurveChangeConstrained(toneCurve[0][0], -value, toneCurve[1][0]-10.0, 0.0)
-            toneCurve[0][0] = b
+        # the HSV colour vectors, starting with the 'no-op' values - 0 degree hue shift and 1x multipliers for saturation and value
+        self.colourVectors = {}
+        for colour in colourBands:
+            self.colourVectors[colour] = [0.0, 1.0, 1.0]
 
+        # flag indicating that colour vectors have been modified
+        self.coloursChanged = False
 
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Whites"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Whites")
-        if abs(value)>0.01:
-            found = True
-            w = calculateCurveChangeConstrained(toneCurve[4][0], -value, 100.0, toneCurve[3][0]+10.0)
-            toneCurve[4][0] = w
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Whites2012"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Whites2012")
-        if abs(value)>0.01:
-            found = True
-            w = calculateCurveChangeConstrained(toneCurve[4][0], -value, 100.0, toneCurve[3][0]+10.0)
-            toneCurve[4][0] = w
+        # number of filters removed by the optimiser, and the number there were to start with
+        self.removed = (0, 0)
 
-    '''
+        # lookup table images for the preset, as a list of (file name, PNG data)
+        self.lookups = []
 
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Shadows"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Shadows")
-        if abs(value)>0.01:
-            found = True
-            s = calculateCurveChange(toneCurve[1][1], value, 100.0)
-            toneCurve[1][1] = s
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Shadows2012"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Shadows2012")
-        if abs(value)>0.01:
-            found = True
-            s = calculateCurveChange(toneCurve[1][1], value, 100.0)
-            toneCurve[1][1] = s
 
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Highlights"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Highlights")
-        if abs(value)>0.01:
-            found = True
-            h = calculateCurveChange(toneCurve[3][1], value, 100.0)
-            toneCurve[3][1] = h
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Highlights2012"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Highlights2012")
-        if abs(value)>0.01:
-            found = True
-            h = calculateCurveChange(toneCurve[3][1], value, 100.0)
-            toneCurve[3][1] = h
-    '''
-
-    if found:
-        toneCurveChanged = True
-        #addToneCurve()
-        print("Blacks: " + str(b) + " Whites:" + str(w))
-        print ("...Blacks/Whites")
-
-
-    # try the HighlightShadows filter instead of adjusting the tone curve
-    found2 = False
-    h = 0.0
-    s = 0.0
-    sum = 0.0
-
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Shadows"):
-        s = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Shadows")
-        sum = sum + abs(s)
-        if abs(s)>0.01:
-            found2 = True
-            print("Shadows: " + str(s))
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Shadows2012"):
-        s = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Shadows2012")
-        sum = sum + abs(value)
-        if abs(s)>0.01:
-            found2 = True
-            print("Shadows: " + str(s))
+    # converts an XMP preset (XML as a string, bytes or a binary file object) and returns the preset map.
+    # key is used for the "key" entry of the preset, name identifies the preset in the log (default is the key)
+    def convert(self, source, key="", name=None):
 
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Highlights"):
-        h = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Highlights")
-        sum = sum + abs(h)
-        if abs(h)>0.01:
-            found2 = True
-            print("Highlights: " + str(h))
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Highlights2012"):
-        h = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Highlights2012")
-        sum = sum + abs(value)
-        if abs(h)>0.01:
-            found2 = True
-            print("Highlights: " + str(h))
+        if name is None:
+            name = key
 
-    if found2 and abs(sum)>0.01:
-        updateShadowsHighlights(s, h)
-        print ("...Shadows/Highlights")
+        if self.profiler is not None:
+            self.profiler.beginFile(name)
+            try:
+                return self.convertPreset(source, key, name)
+            finally:
+                self.profiler.endFile()
+        return self.convertPreset(source, key, name)
 
-# ----------------------------
 
+    def convertPreset(self, source, key, name):
 
-def processParametricCurve():
-    # this is the Lightroom version of a Tone Curve.
-    # keys: ParametricDarks, ParametricLights, ParametricShadows, ParametricHighlights, ParametricShadowSplit, ParametricMidtoneSplit, ParametricHighlightSplit
-    # the 'Split' keys affect the tone curve input values, others affect the output values
-    # values for output levels are are -100..+100 and represent the change relative to the current tone curve
-    # values for 'Split' variables represent the input value for that transition point (Shadows, Dark etc.). Range 0..100
-    # Note: each value is a percentage, i.e. 0..100 (-100..+100 for output adjustments), not an absolute value
-    # note that I constrained the changes so that they cannot go higher than the next point or lower than the previous point. This is
-    # artificial and precludes any 'inversion' type changes (via Parametric values)
-    
-    global toneCurve
-    global toneCurveChanged
-    
-    found = False
-    sum = 0.0
-    value = 0.0
-    
-    
-    # look for specific settings of each point and apply them on top of the current curve
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricDarks"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricDarks")
-        #toneCurve[0][1] = clamp ((toneCurve[0][1] + value), 0.0, 100.0)
-        print("Darks: " + str(value))
-        toneCurve[0][1] = calculateCurveChangeConstrained(toneCurve[0][1], value, toneCurve[1][1]-10.0, 0.0)
-    
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricShadowSplit"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricShadowSplit")
-        toneCurve[1][0] = value
-        sum = sum + abs(value)
-    
-    '''
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricShadows"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricShadows")
-        print("Shadows: " + str(value))
-        #toneCurve[1][1] = calculateCurveChange(toneCurve[1][1], value, 100.0)
-        toneCurve[1][1] = calculateCurveChangeConstrained(toneCurve[1][1], value, toneCurve[2][1]-10.0, toneCurve[0][1]+10.0)
-        sum = sum + abs(value)
-    '''
-    
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricMidtoneSplit"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricMidtoneSplit")
-        toneCurve[2][0] = value
-        sum = sum + abs(value)
-    
-    
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricHighlightSplit"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricHighlightSplit")
-        toneCurve[3][0] = value
-        sum = sum + abs(value)
-    
-    '''
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricHighlights"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricHighlights")
-        print("Highlights: " + str(value))
-        #toneCurve[3][1] = calculateCurveChange(toneCurve[3][1], value, 100.0)
-        toneCurve[3][1] = calculateCurveChangeConstrained(toneCurve[3][1], value, toneCurve[4][1]-10.0, toneCurve[2][1]+10.0)
-        sum = sum + abs(value)
-    '''
-    
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricLights"):
-        found = True
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricLights")
-        print("Lights: " + str(value))
-        #toneCurve[4][1] = calculateCurveChange(toneCurve[4][1], value, 100.0)
-        toneCurve[4][1] = calculateCurveChangeConstrained(toneCurve[4][1], value, 100.0, toneCurve[3][1]+10.0)
-        sum = sum + abs(value)
-    
-    
-    if found and abs(sum)>0.01:
-        toneCurveChanged = True
-        #addToneCurve()
-        print("Updated Curve: " + str(toneCurve))
-        print ("...Parametric Curve")
-
-    # process Shadows and Highlights using built in filter rather than adjusting Tone Curve
-    found2 = False
-    s = 0.0
-    h = 0.0
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricShadows"):
-        s = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricShadows")
-        if abs(s)>0.01:
-            found2 = True
-            print("Shadows: " + str(s))
+        # clear out anything left over from a previous preset
+        self.reset()
 
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ParametricHighlights"):
-        h = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ParametricHighlights")
-        if abs(h)>0.01:
-            found2 = True
-            print("Highlights: " + str(h))
+        self.runStep("parse", self.parse, source)
+        self.info("--------------------------------")
+        self.info("\nProcessing: %s...", name)
 
-    if found2:
-            updateShadowsHighlights(s, h)
+        # set up an empty preset
+        self.initPreset(key)
 
+        # process the input based on the filters we support in the app
+        for stage in self.stages:
+            self.runStep(stage, getattr(self, stage))
 
-# ----------------------------
+        if self.optimize is not None:
+            self.runStep("optimizeFilters", self.optimizeFilters)
+
+        if self.lut:
+            self.runStep("bakeLookups", self.bakeLookups)
+
+        # print the final preset
+        # self.printPreset()
 
-# takes XMP-based shadow/highlight values and creates filter definition for those (used in multiple places)
+        return self.filterMap
 
 
-def updateShadowsHighlights(s, h):
-    if abs(s)>0.01 or abs(h)>0.01:
-        s2 = clamp (s/100.0, -1.0, 1.0)
-        # highlights are strange. -100..+100 -> [], 1.0..0.3, there is no support for +ve values (i.e. increase highlights)
-        if h<0.0:
-            h2 = 1.0 + h/100.0
+    # runs one step of the conversion, adding the time taken to self.timings (if set), and profiling it (if there is a profiler)
+    def runStep(self, name, function, *args):
+        if (self.timings is None) and (self.profiler is None):
+            return function(*args)
+        start = time.perf_counter()
+        if self.profiler is not None:
+            result = self.profiler.run(name, self, function, args)
         else:
-            h2 = 1.0
-        h2 = clamp (h2, 0.3, 1.0)
-        
-        print("Shadows: " + str(s) + " -> " + str(s2) + " Highlights: " + str(h) + " -> " + str(h2))
-        filterMap["filters"].append( { 'key':"CIHighlightShadowAdjust", "parameters":[{ 'key':"inputShadowAmount", 'val': s2, 'type': "CIAttributeTypeScalar"},
-                                                                                      { 'key':"inputHighlightAmount", 'val': h2, 'type': "CIAttributeTypeScalar"}
-                                                                                      ] } )
-    else:
-        print("WARNING - Ignoring Shadows/Highlights. s:" + str(s) + " h:" + str(h))
+            result = function(*args)
+        if self.timings is None:
+            return result
+        entry = self.timings.setdefault(name, [ 0.0, 0 ])
+        entry[0] = entry[0] + (time.perf_counter() - start)
+        entry[1] = entry[1] + 1
+        return result
+
+
+    # runs the filter chain optimiser (loaded here so that numpy is only needed if it's used)
+    def optimizeFilters(self):
+        import optimizeChain
+        filters = self.filterMap["filters"]
+        optimized, notes = optimizeChain.optimizeChain(filters, self.optimize)
+        for note in notes:
+            self.info("Optimiser: %s", note)
+        self.removed = (len(filters) - len(optimized), len(filters))
+        if self.removed[0] > 0:
+            self.info("Optimiser: %s filters reduced to %s", len(filters), len(optimized))
+        self.filterMap["filters"] = optimized
+
+
+    # replaces runs of colour filters with lookup tables. The images are named after the preset (i.e. the key)
+    def bakeLookups(self):
+        import lookupTable
+        name = os.path.splitext(os.path.basename(self.filterMap["key"]))[0]
+        if len(name) == 0:
+            name = "preset"
+        filters, self.lookups, notes = lookupTable.bakeFilters(self.filterMap["filters"], name)
+        for note in notes:
+            self.info("Lookup: %s", note)
+        self.filterMap["filters"] = filters
+
+
+    # parses the XMP using the selected backend, and takes a snapshot of all of the camera raw settings in one pass.
+    # source can also be a list of documents (e.g. the main and extended XMP from a JPEG), whose settings are combined
+    def parse(self, source):
+        if isinstance(source, list):
+            props = {}
+            for doc in source:
+                props.update(self.parseProperties(doc))
+        else:
+            props = self.parseProperties(source)
+        self.settings = xmpParser.PresetSettings(props)
 
-# ----------------------------
 
+    # returns the camera raw properties of one XMP document
+    def parseProperties(self, source):
+        if self.parser == "libxmp":
+            from libxmp import XMPMeta
+            if hasattr(source, "read"):
+                source = source.read()
+            if isinstance(source, bytes):
+                source = source.decode("utf-8")
+            xmp = XMPMeta()
+            xmp.parse_from_str(source)
+            return xmpParser.libxmpProperties(xmp)
+        return xmpParser.parseProperties(source)
 
-def processClarity():
-    value = 0.0
-    # keys: Clarity or Clarity2012. Range -100.0 .. +100.0 -> 0.0 ... +1.0 Negative values not supported
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Clarity"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Clarity") / 100.0
-        if abs(value)>0.0:
-            filterMap["filters"].append( { 'key':"ClarityFilter", "parameters":[{ 'key':"inputClarity", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
-            print ("...Clarity")
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Clarity2012"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Clarity2012") / 100.0
-        if abs(value)>0.0:
-            filterMap["filters"].append( { 'key':"ClarityFilter", "parameters":[{ 'key':"inputClarity", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
-            print ("...Clarity2012")
 
-    if abs(value)>0.0:
-        print("Clarity: " + str(value))
+    # writes a message to the log if level is enabled. Any args are formatted into the text (with %), but only if the
+    # message is actually written, so that messages that are filtered out cost (almost) nothing
+    def log(self, level, text, *args):
+        if level <= self.logLevel:
+            if len(args) > 0:
+                text = text % args
+            self.logFile.write(str(text) + "\n")
 
+    def error(self, text, *args):
+        self.log(LOG_ERROR, text, *args)
 
-# ----------------------------
+    def warning(self, text, *args):
+        self.log(LOG_WARNING, text, *args)
 
+    def info(self, text, *args):
+        self.log(LOG_INFO, text, *args)
 
-def processVibrance():
-    value = 0.0
-    # key: Vibrance. Range -100..+100 -> -1.0..+1.0
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Vibrance"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Vibrance") / 100.0
-        if abs(value)>0.01:
-            filterMap["filters"].append( { 'key':"CIVibrance", "parameters":[{ 'key':"inputAmount", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
-            print ("...Vibrance")
+    def debug(self, text, *args):
+        self.log(LOG_DEBUG, text, *args)
 
-    if abs(value)>0.01:
-        print("Vibrance: " + str(value))
 
+    # ----------------------------
 
-# ----------------------------
 
+    def initPreset(self, f):
+        self.filterMap["key"] = f
+        self.filterMap["info"] ={}
+        self.filterMap["filters"] = []
 
-def processSaturation():
-    value = 0.0
-    # key: Saturation. Range -100..+100 -> 0.0..+2.0 (1.0 is neutral)
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Saturation"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Saturation")
-        if abs(value)>0.01:
-            value = (value / 100.0) + 1.0
-            value = clamp(value, 0.0, 2.0)
-            filterMap["filters"].append( { 'key':"SaturationFilter", "parameters":[{ 'key':"inputSaturation", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
-            print ("...Saturation")
 
-    if abs(value)>0.01:
-        print("Saturation: " + str(value))
+    # ----------------------------
 
 
-# ----------------------------
+    def printPreset(self):
+        #self.debug("Raw map: %s", self.filterMap)
+        self.debug("\n\n")
+        self.debug("JSON: %s", json.dumps(self.filterMap, indent=2))
 
 
-def processNoiseReduction():
-    amount = 0.0
-    detail = 0.0
-    smoothness = 0.0
-    found = False
-    # key: Saturation. Range -100..+100 -> 0.0..+2.0 (1.0 is neutral)
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ColorNoiseReduction"):
-        found = True
-        amount = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ColorNoiseReduction")
-        
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ColorNoiseReductionDetail"):
-            detail = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ColorNoiseReductionDetail")
-    
-        #if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ColorNoiseReductionSmoothness"):
-        #    smoothness = xmp.get_property_float(XMP_NS_CAMERA_RAW, "ColorNoiseReductionSmoothness")
-
-    if found and abs(amount)>0.01:
-        amount = (amount / 1000.0) # 0..100 -> 0.0..0.1
-        amount = clamp(amount, 0.0, 0.1)
-        detail = detail / 500.0 # 0..100 -> 0.0..2.0
-        detail = clamp(detail, 0.0, 0.2)
-        filterMap["filters"].append( { 'key':"CINoiseReduction", "parameters":[{ 'key':"inputNoiseLevel", 'val': amount, 'type': "CIAttributeTypeScalar"},
-                                                                               { 'key':"inputSharpness", 'val': detail, 'type': "CIAttributeTypeScalar"},
-                                                                            ] })
-        print("Noise Reduction: amount: " + str(amount) + " detail: " + str(detail))
-        print ("...Noise Reduction")
+    # ----------------------------
 
-# ----------------------------
 
+    def processInfo(self):
+        if self.settings.has("Name"):
+            name = self.settings.getText("Name")
+            # self.debug("Name: %s", name)
+            self.filterMap["info"]["name"] = name
 
-def processToneCurve():
-    # this is the Photoshop version of a Tone Curve. Note, will overwrite any previous Tone Curve or Parametric curve
+        if self.settings.has("Group"):
+            group = self.settings.getText("Group")
+            # self.debug("Name: %s", name)
+            self.filterMap["info"]["group"] = group
 
-    global toneCurve, curveName
-    global toneCurveChanged
-    found = False
 
-    # first, look for a named preset
-    name = ""
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurveName"):
-        name = xmp.get_property(XMP_NS_CAMERA_RAW, "ToneCurveName")
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurveName2012"):
-        name = xmp.get_property(XMP_NS_CAMERA_RAW, "ToneCurveName2012")
-    
-    if len(name) > 0:
-        found = True
-        if name == "Medium Contrast":
-            toneCurve = [ [0.0, 0.0], [25.0, 20.0], [50.0, 50.0], [75.0, 80.0], [100.0, 100.0]]
-        elif name == "Strong Contrast":
-            toneCurve = [ [0.0, 0.0], [25.0, 15.0], [50.0, 50.0], [75.0, 85.0], [100.0, 100.0]]
-
-    # look for tone curve values
-    curvename = ""
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurve"):
-        curveName = "ToneCurve"
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurvePV2012"):
-        curveName = "ToneCurvePV2012"
-
-    if len(name) > 0:
-        found = True
-        count = xmp.count_array_items(XMP_NS_CAMERA_RAW, curveName)
-        if count > 0:
-            found = True
-            points = []
-            for i in range(1, (count+1)):
-                item = xmp.get_array_item(XMP_NS_CAMERA_RAW, curveName, i)
-                point = map(float, item.split(","))
-                points.append(point)
-            print("\nInput Curve: "+str(points)+"\n")
-
-            # if 2 or less points then ignore (linear anyway), otherwise interpolate
-            if (count <2):
-                print("ERROR: too few points(" + count + ")")
-            #elif (count <= 3):
-            else:
-                #print("Need to interpolate Tone Curve")
-                # split into 2 arrays, convert to 0..100 scale, create spline, interpolate and update the curve
-                x, y = zip(*points)
-                x2 = [100.0 * f / 255 for f in x]
-                y2 = [100.0 * f / 255 for f in y]
-                spline = UnivariateSpline(x2, y2, s=0, k=min(5,(count-1)))
-                xcurve = [ 0.0, 25.0, 50.0, 75.0, 100.0 ]
-                tmp1 = 0.0
-                tmp2 = 0.0
-                for i in range(0, len(xcurve)):
-                    tmp1 = clamp(spline(xcurve[i]), 0.0, 100.0)
-                    tmp2 = float(tmp1)
-                    if tmp2 < 0.001: # small numbers cause issues with JSON
-                        tmp2 = 0.0
-                    toneCurve[i] = [xcurve[i], tmp2]
-
-    if found:
-        toneCurveChanged = True
-        print ("Curve: " + str(toneCurve))
-        print ("...Tone Curve")
+    # ----------------------------
 
-# ----------------------------
 
+    def processAuto(self):
+        # if any "Auto" function is specified, then run the auto adjust filter (which adjusts everything)
+        auto = False
+        if self.settings.has("AutoBrightness"):
+            auto = True
+        elif self.settings.has("AutoContrast"):
+            auto = True
+        elif self.settings.has("AutoExposure"):
+            auto = True
+        elif self.settings.has("AutoShadows"):
+            auto = True
+        if auto:
+            self.filterMap["filters"].append( { 'key':"AutoAdjustFilter", "parameters":[] } )
+            self.info("...Auto Adjust")
 
-def addToneCurve():
-    
-    global toneCurve
-    global toneCurveChanged
-    
-    if toneCurveChanged:
-        filterMap["filters"].append( { 'key':"CIToneCurve",
-                                    "parameters":[{ 'key':"inputPoint0", 'val': [(toneCurve[0][0]/100.0), (toneCurve[0][1]/100.0)], 'type': "CIAttributeTypeOffset"},
-                                                  { 'key':"inputPoint1", 'val': [(toneCurve[1][0]/100.0), (toneCurve[1][1]/100.0)], 'type': "CIAttributeTypeOffset"},
-                                                  { 'key':"inputPoint2", 'val': [(toneCurve[2][0]/100.0), (toneCurve[2][1]/100.0)], 'type': "CIAttributeTypeOffset"},
-                                                  { 'key':"inputPoint3", 'val': [(toneCurve[3][0]/100.0), (toneCurve[3][1]/100.0)], 'type': "CIAttributeTypeOffset"},
-                                                  { 'key':"inputPoint4", 'val': [(toneCurve[4][0]/100.0), (toneCurve[4][1]/100.0)], 'type': "CIAttributeTypeOffset"} ]
-                                    } )
 
-        print ("Curve: " + str(toneCurve))
+    # ----------------------------
 
 
-# ----------------------------
+    def processWhiteBalance(self):
+        temp = 0.0
+        tint = 0.0
 
+        # keys: either WhiteBalance (preset) and/or Temperature and Tint
+        if self.settings.has("WhiteBalance"):
+            # preset is one of: As Shot, Auto, Daylight, Cloudy, Shade, Tungsten, Fluorescent, Flash, Custom
+            # Just ignore As Shot, Auto and Custom
+            wbPresets = { "Daylight":    { 'temp': 5500.0, 'tint': 10.0 },
+                          "Cloudy":      { 'temp': 6500.0, 'tint': 10.0 },
+                          "Shade":       { 'temp': 7500.0, 'tint': 10.0 },
+                          "Tungsten":    { 'temp': 2850.0, 'tint': 0.0 },
+                          "Fluorescent": { 'temp': 3800.0, 'tint': 21.0 },
+                          "Flash":       { 'temp': 5500.0, 'tint': 0.0 } }
 
-def processRGBToneCurves():
+            preset = self.settings.getText("WhiteBalance")
+            if preset in wbPresets:
+                temp = min(wbPresets[preset]['temp'], 10000.0)
+                tint = max(min(wbPresets[preset]['tint'], 100.0), -100.0)
+                self.filterMap["filters"].append( { 'key':"WhiteBalanceFilter", "parameters":[ { 'key':"inputTemperature", 'val':temp, 'type':"CIAttributeTypeScalar"},
+                                                                                          {'key':"inputTint", 'val': tint, 'type': "CIAttributeTypeScalar"} ]
+                                                                     } )
+                self.info("...Preset White Balance")
+            elif preset == "Auto": # for Auto, just run auto correct
+                self.filterMap["filters"].append( { 'key':"AutoAdjustFilter", "parameters":[] } )
 
-    # handles individual RGB Tone Curves
+            elif preset == "Custom":
+                temp = 5500.0
+                tint = 0.0
+                if self.settings.has("Temperature"):
+                    # raw presets give the temperature in Kelvin, JPEG/TIFF presets give a relative value (-100..+100)
+                    temp = self.settings.getFloat("Temperature")
+                    if abs(temp) <= 100.0:
+                        temp = relativeTemperature(temp)
+                    temp = clamp(temp, 2000.0, 10000.0)
 
-    # Note: do *not* use global tone curve array
+                if self.settings.has("Tint"):
+                    tint = clamp(self.settings.getFloat("Tint"), -100.0, 100.0)
 
-    # default tone curves, split into X and Y vectors. Note the 0..1.0 scale
-    redX = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
-    redY = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
-    greenX = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
-    greenY = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
-    blueX = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
-    blueY = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
+                self.filterMap["filters"].append( { 'key':"WhiteBalanceFilter", "parameters":[ { 'key':"inputTemperature", 'val':temp, 'type':"CIAttributeTypeScalar"},
+                                                                                     {'key':"inputTint", 'val': tint, 'type': "CIAttributeTypeScalar"} ]
+                                        } )
+                self.debug("Temp: %s Tint: %s", temp, tint)
+                self.info("...Custom White Balance")
 
-    found = False
-    linearCount = 0
-    
-    # RED
-    curveName = ""
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurvePVRed"):
-        curveName = "ToneCurvePVRed"
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurvePV2012Red"):
-        curveName = "ToneCurvePV2012Red"
-    
-    if len(curveName) > 0:
-        #found = True
-        count = xmp.count_array_items(XMP_NS_CAMERA_RAW, curveName)
-        if count > 0:
-            found = True
-            points = []
-            for i in range(1, (count+1)):
-                item = xmp.get_array_item(XMP_NS_CAMERA_RAW, curveName, i)
-                point = map(float, item.split(","))
-                points.append(point)
-            print("\nInput Red Curve: "+str(points)+"\n")
-            
-            # if we have exactly 5 points then we can use them directly, otherwise we need to interpolate to get those 5 points
-            if (count == 5):
-                x, y = zip(*points)
-                redY = [f / 255 for f in y]
 
-            elif (count <= 2):
-                print("WARN: too few points(" + str(count) + "). Using Linear Curve")
-                linearCount += 1
-            #elif (count <= 3):
-            else:
-                #print("Need to interpolate Tone Curve")
-                # split into 2 arrays, convert to 0..1.0 scale, create spline, interpolate and update the curve
-                x, y = zip(*points)
-                x2 = [f / 255 for f in x]
-                y2 = [f / 255 for f in y]
-                spline = UnivariateSpline(x2, y2, s=0, k=min(5,(count-1)))
-                tmp = 0.0
-                for i in range(0, len(redX)):
-                    tmp = clamp(spline(redX[i]), 0.0, 1.0)
-                    redY[i] = float(tmp)
-                    if redY[i] < 0.001: # small numbers case issues with JSON
-                        redY[i] = 0.0
-
-    # GREEN
-    curveName = ""
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurvePVGreen"):
-        curveName = "ToneCurvePVGreen"
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurvePV2012Green"):
-        curveName = "ToneCurvePV2012Green"
-    
-    if len(curveName) > 0:
-        #found = True
-        count = xmp.count_array_items(XMP_NS_CAMERA_RAW, curveName)
-        if count > 0:
-            found = True
-            points = []
-            for i in range(1, (count+1)):
-                item = xmp.get_array_item(XMP_NS_CAMERA_RAW, curveName, i)
-                point = map(float, item.split(","))
-                points.append(point)
-            print("\nInput Green Curve: "+str(points)+"\n")
-            
-            # if we have exactly 5 points then we can use them directly, otherwise we need to interpolate to get those 5 points
-            if (count == 5):
-                x, y = zip(*points)
-                greenY = [f / 255 for f in y]
+    # ----------------------------
 
-            elif (count <= 2):
-                print("WARN: too few points(" + str(count) + "). Using Linear Curve")
-                linearCount += 1
-            #elif (count <= 3):
-            else:
-                #print("Need to interpolate Tone Curve")
-                # split into 2 arrays, convert to 0..1.0 scale, create spline, interpolate and update the curve
-                x, y = zip(*points)
-                x2 = [f / 255 for f in x]
-                y2 = [f / 255 for f in y]
-                spline = UnivariateSpline(x2, y2, s=0, k=min(5,(count-1)))
-                tmp = 0.0
-                for i in range(0, len(greenX)):
-                    tmp = clamp(spline(greenX[i]), 0.0, 1.0)
-                    greenY[i] = float(tmp)
-                    if greenY[i] < 0.001: # small numbers case issues with JSON
-                        greenY[i] = 0.0
-
-    # BLUE
-    curveName = ""
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurvePVBlue"):
-        curveName = "ToneCurvePVBlue"
-    elif xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ToneCurvePV2012Blue"):
-        curveName = "ToneCurvePV2012Blue"
-    
-    if len(curveName) > 0:
-        #found = True
-        count = xmp.count_array_items(XMP_NS_CAMERA_RAW, curveName)
-        if count > 0:
+
+    def processExposure(self):
+        value = 0.0
+        # keys: Exposure or Exposure2012. Range -5.0 .. +5.0 -> -10.0 ... +10.0 (but same scale)
+        key = self.settings.resolve("Exposure")
+        if key is not None:
+            value = self.settings.getFloat(key)
+            if abs(value)>0.01:
+                self.filterMap["filters"].append( { 'key':"CIExposureAdjust", "parameters":[{ 'key':"inputEV", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+                self.debug("Exposure: %s", value)
+                self.info("...%s", key)
+
+
+    # ----------------------------
+
+
+    def processContrast(self):
+        minContrast = 1.0
+        found = False
+        value = 0.0
+
+        # keys: Contrast or Contrast2012. Range -50..+100 -> 0.25..4.0 (1.0 is neutral)
+        key = self.settings.resolve("Contrast")
+        if key is not None:
             found = True
-            points = []
-            for i in range(1, (count+1)):
-                item = xmp.get_array_item(XMP_NS_CAMERA_RAW, curveName, i)
-                point = map(float, item.split(","))
-                points.append(point)
-            print("\nInput Blue Curve: "+str(points)+"\n")
-            
-            # if we have exactly 5 points then we can use them directly, otherwise we need to interpolate to get those 5 points
-            if (count == 5):
-                x, y = zip(*points)
-                blueY = [f / 255 for f in y]
+            value = self.settings.getFloat(key)
 
-            elif (count <= 2):
-                print("WARN: too few points(" + str(count) + "). Using Linear Curve")
-                linearCount += 1
-            # elif (count <= 3):
+        value = value / 2.0 # built in filter is much stronger than Photoshop/Lightroom
+
+        if found and abs(value)>0.001:
+            # if the value is +ve we can use the built in Contrast Filter
+            if value>=0.0:
+                #value = 1.0 + value * 3.0 / 100.0 # 0..100 -> 1..4
+                value = 1.0 + value / 100.0 # 0..100 -> 1..2
+
+                value = clamp(value, minContrast, 4.0)
+                self.filterMap["filters"].append( { 'key':"ContrastFilter", "parameters":[{ 'key':"inputContrast", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+                self.debug("Contrast: %s", value)
             else:
-                # print("Need to interpolate Tone Curve")
-                # split into 2 arrays, convert to 0..1.0 scale, create spline, interpolate and update the curve
-                x, y = zip(*points)
-                x2 = [f / 255 for f in x]
-                y2 = [f / 255 for f in y]
-                spline = UnivariateSpline(x2, y2, s=0, k=min(5,(count-1)))
-                tmp = 0.0
-                for i in range(0, len(blueX)):
-                    tmp = clamp(spline(blueX[i]), 0.0, 1.0)
-                    blueY[i] = float(tmp)
-                    if blueY[i] < 0.001: # small numbers case issues with JSON
-                        blueY[i] = 0.0
-
-
-    if linearCount == 3:
+                self.warning("Negative Contrast not really supported")
+                # -ve contrast, the built in filter sucks with this, so adjust the tone curve instead
+                b = calculateCurveChangeConstrained(self.toneCurve[1][1], -value, self.toneCurve[2][1]-10.0, self.toneCurve[0][1]+10.0)
+                self.toneCurve[1][1] = b
+                self.toneCurveChanged = True
+                self.debug("Updated Curve: %s", self.toneCurve)
+                '''
+                value = 1.0 + value / 100.0 # 0..100 -> 1..2
+                value = clamp(value, 0.25, 1.0)
+                self.filterMap["filters"].append( { 'key':"ContrastFilter", "parameters":[{ 'key':"inputContrast", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+                self.debug("Contrast: %s", value)
+                '''
+
+            self.info("...Contrast")
+
+    # ----------------------------
+
+
+    def processShadowsHighlights(self):
+        # Highlights, Shadows, Whites, Blacks or: Highlights2012, Shadows2012, Whites2012, Blacks2012
+        # maybe not the right way to do it, but we will just modify the input values of the tone curve
+        # [0]=Blacks [1]=Shadows [2]=??? [3]=Highlights [4]=Whites
+
+
         found = False
-        print("WARNING: ignoring RGB Tone Curve")
-
-    if found:
-        print("\nOutput Red Curve:\n    X:"+str(redX)+"\n    Y:"+str(redY))
-        print("\nOutput Green Curve:\n    X:"+str(greenX)+"\n    Y:"+str(greenY))
-        print("\nOutput Blue Curve:\n    X:"+str(blueX)+"\n    Y:"+str(blueY)+"\n")
-        filterMap["filters"].append( { 'key':"RGBChannelToneCurve",
-                                    "parameters":[{ 'key':"inputRedXvalues",   'val': redX, 'type': "CIAttributeTypeVector"},
-                                                  { 'key':"inputRedYvalues",   'val': redY, 'type': "CIAttributeTypeVector"},
-                                                  { 'key':"inputGreenXvalues", 'val': greenX, 'type': "CIAttributeTypeVector"},
-                                                  { 'key':"inputGreenYvalues", 'val': greenY, 'type': "CIAttributeTypeVector"},
-                                                  { 'key':"inputBlueXvalues",  'val': blueX, 'type': "CIAttributeTypeVector"},
-                                                  { 'key':"inputBlueYvalues",  'val': blueY, 'type': "CIAttributeTypeVector"} ]
-                                    } )
-        print ("...RGB Tone Curves")
 
-# ----------------------------
+        # look for specific settings of each point and apply them on top of the current curve
+        # if the value is (approx) 0 then just ignore it
 
+        # not quite sure how this works, e.g what does +100 mean?
+
+        b = 0.0
+        w = 0.0
+        s = 0.0
+        h = 0.0
+        value = 0.0
+
+        key = self.settings.resolve("Blacks")
+        if key is not None:
+            value = self.settings.getFloat(key)
+            if abs(value)>0.01:
+                found = True
+                b = calculateCurveChangeConstrained(self.toneCurve[0][0], -value, self.toneCurve[1][0]-10.0, 0.0)
+                self.toneCurve[0][0] = b
+
+
+        key = self.settings.resolve("Whites")
+        if key is not None:
+            value = self.settings.getFloat(key)
+            if abs(value)>0.01:
+                found = True
+                w = calculateCurveChangeConstrained(self.toneCurve[4][0], -value, 100.0, self.toneCurve[3][0]+10.0)
+                self.toneCurve[4][0] = w
 
-def processHSV():
-    
-    global colourVectors
-    global coloursChanged
-    
-    '''
-        vector is [hue, saturation, brightness]
-        range of input is -100..+100
-        range of output is 0.0..+1.0
-        attribute type CIAttributeTypePosition3 (CIVector)
         '''
-    
-    # update colour vectors
-    found = False
-    sum = 0.0 # check to see if anything changed
-    for key in colourVectors.keys():
+
+        if self.settings.has("Shadows"):
+            value = self.settings.getFloat("Shadows")
+            if abs(value)>0.01:
+                found = True
+                s = calculateCurveChange(self.toneCurve[1][1], value, 100.0)
+                self.toneCurve[1][1] = s
+        elif self.settings.has("Shadows2012"):
+            value = self.settings.getFloat("Shadows2012")
+            if abs(value)>0.01:
+                found = True
+                s = calculateCurveChange(self.toneCurve[1][1], value, 100.0)
+                self.toneCurve[1][1] = s
+
+        if self.settings.has("Highlights"):
+            value = self.settings.getFloat("Highlights")
+            if abs(value)>0.01:
+                found = True
+                h = calculateCurveChange(self.toneCurve[3][1], value, 100.0)
+                self.toneCurve[3][1] = h
+        elif self.settings.has("Highlights2012"):
+            value = self.settings.getFloat("Highlights2012")
+            if abs(value)>0.01:
+                found = True
+                h = calculateCurveChange(self.toneCurve[3][1], value, 100.0)
+                self.toneCurve[3][1] = h
+        '''
+
+        if found:
+            self.toneCurveChanged = True
+            #addToneCurve()
+            self.debug("Blacks: %s Whites:%s", b, w)
+            self.info("...Blacks/Whites")
+
+
+        # try the HighlightShadows filter instead of adjusting the tone curve
+        found2 = False
         h = 0.0
         s = 0.0
-        v = 0.0
-        tag = key.capitalize()
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "HueAdjustment"+tag):
+        sum = 0.0
+
+        # Note: for the 2012 keys, the sum has always used the last Blacks/Whites value (not the shadow/highlight value).
+        # That is kept as-is so that the converted presets don't change
+        key = self.settings.resolve("Shadows")
+        if key is not None:
+            s = self.settings.getFloat(key)
+            if key == "Shadows":
+                sum = sum + abs(s)
+            else:
+                sum = sum + abs(value)
+            if abs(s)>0.01:
+                found2 = True
+                self.debug("Shadows: %s", s)
+
+        key = self.settings.resolve("Highlights")
+        if key is not None:
+            h = self.settings.getFloat(key)
+            if key == "Highlights":
+                sum = sum + abs(h)
+            else:
+                sum = sum + abs(value)
+            if abs(h)>0.01:
+                found2 = True
+                self.debug("Highlights: %s", h)
+
+        if found2 and abs(sum)>0.01:
+            self.updateShadowsHighlights(s, h)
+            self.info("...Shadows/Highlights")
+
+    # ----------------------------
+
+
+    def processParametricCurve(self):
+        # this is the Lightroom version of a Tone Curve.
+        # keys: ParametricDarks, ParametricLights, ParametricShadows, ParametricHighlights, ParametricShadowSplit, ParametricMidtoneSplit, ParametricHighlightSplit
+        # the 'Split' keys affect the tone curve input values, others affect the output values
+        # values for output levels are are -100..+100 and represent the change relative to the current tone curve
+        # values for 'Split' variables represent the input value for that transition point (Shadows, Dark etc.). Range 0..100
+        # Note: each value is a percentage, i.e. 0..100 (-100..+100 for output adjustments), not an absolute value
+        # note that I constrained the changes so that they cannot go higher than the next point or lower than the previous point. This is
+        # artificial and precludes any 'inversion' type changes (via Parametric values)
+
+
+        found = False
+        sum = 0.0
+        value = 0.0
+
+
+        # look for specific settings of each point and apply them on top of the current curve
+        if self.settings.has("ParametricDarks"):
             found = True
-            h = xmp.get_property_float(XMP_NS_CAMERA_RAW, "HueAdjustment"+tag)
+            value = self.settings.getFloat("ParametricDarks")
+            #self.toneCurve[0][1] = clamp ((self.toneCurve[0][1] + value), 0.0, 100.0)
+            self.debug("Darks: %s", value)
+            self.toneCurve[0][1] = calculateCurveChangeConstrained(self.toneCurve[0][1], value, self.toneCurve[1][1]-10.0, 0.0)
 
-            sum = sum + abs(h)
-            if abs(h)>0.01:
-                value = (h / 100.0) / 8.0 # treat as a %age of the colour band
-                #value = (h / 100.0)
-                colourVectors[key][0] = colourVectors[key][0] + value
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "SaturationAdjustment"+tag):
+        if self.settings.has("ParametricShadowSplit"):
             found = True
-            s = xmp.get_property_float(XMP_NS_CAMERA_RAW, "SaturationAdjustment"+tag)
-            if abs(s)>0.01:
-                value = (s / 100.0) # treat as a %age change
-                colourVectors[key][1] = colourVectors[key][1] + value
-                #colourVectors[key][1] = calculateCurveChange(colourVectors[key][1], value, 1.0)
-            sum = sum + abs(s)
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "LuminanceAdjustment"+tag):
+            value = self.settings.getFloat("ParametricShadowSplit")
+            self.toneCurve[1][0] = value
+            sum = sum + abs(value)
+
+        '''
+        if self.settings.has("ParametricShadows"):
             found = True
-            v = xmp.get_property_float(XMP_NS_CAMERA_RAW, "LuminanceAdjustment"+tag)
-            if abs(v)>0.01:
-                value = (v / 100.0) # treat as a %age change
-                colourVectors[key][2] = colourVectors[key][2] + value
-            #colourVectors[key][2] = calculateCurveChange(colourVectors[key][2], value, 1.0)
-            sum = sum + abs(v)
-        
-        # if hue, saturation and value are all 0 then set to noop values [0, 1, 1]
-        if (abs(h) + abs(s) + abs(v)) < 0.01:
-            colourVectors[key] = [0.0, 1.0, 1.0]
-
-        print (str(tag) + ": h:" + str(h) + ": s:" + str(s) + ": v:" + str(v))
-
-    if found:
-        if (sum > 0.01): # check that something was specified, not all 0s
-            coloursChanged = True
-            print ("Updated Colours: " + str(colourVectors) + "\n")
-            print ("...HSV")
-        else:
-            print ("Ignoring HSV")
+            value = self.settings.getFloat("ParametricShadows")
+            self.debug("Shadows: %s", value)
+            #self.toneCurve[1][1] = calculateCurveChange(self.toneCurve[1][1], value, 100.0)
+            self.toneCurve[1][1] = calculateCurveChangeConstrained(self.toneCurve[1][1], value, self.toneCurve[2][1]-10.0, self.toneCurve[0][1]+10.0)
+            sum = sum + abs(value)
+        '''
 
+        if self.settings.has("ParametricMidtoneSplit"):
+            found = True
+            value = self.settings.getFloat("ParametricMidtoneSplit")
+            self.toneCurve[2][0] = value
+            sum = sum + abs(value)
 
-# ----------------------------
 
+        if self.settings.has("ParametricHighlightSplit"):
+            found = True
+            value = self.settings.getFloat("ParametricHighlightSplit")
+            self.toneCurve[3][0] = value
+            sum = sum + abs(value)
 
-def processCalibration():
-    # This is an 'older' way to change hue and saturation. Range is -100..+100 and represents % change
-    
-    
-    global colourVectors
-    global coloursChanged
-    
-    found = False
-    
-    # update colour vectors
-    found = False
-    sum = 0.0 # check to see if anything changed
-    h = 0.0
-    s = 1.0
-    v = 1.0
-
-    for key in ["red", "green", "blue"]:
-        tag = key.capitalize()
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, tag+"Hue"):
+        '''
+        if self.settings.has("ParametricHighlights"):
             found = True
-            h = xmp.get_property_float(XMP_NS_CAMERA_RAW, tag+"Hue")
-            sum = sum + abs(h)
-            if abs(h)>0.01:
-                print(tag+" Hue: "+str(h))
-                # if noop values in use([0, 1, 1]), then replace with reference colour
-                #if (approxEqual(colourVectors[key][0],0.0) and approxEqual(colourVectors[key][1],1.0) and approxEqual(colourVectors[key][2],1.0)):
-                #    colourVectors[key] = refColour[key]
-                #value = (h / 100.0) * hueWidth # treat as a %age of the hue band (not the entire hue range)
-                value = (h / 100.0)  / 8.0 # treat as a %age of the colour band
-                #value = colourVectors[key][0] + value
-                colourVectors[key][0] = colourVectors[key][0] + value
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, tag+"Saturation"):
+            value = self.settings.getFloat("ParametricHighlights")
+            self.debug("Highlights: %s", value)
+            #self.toneCurve[3][1] = calculateCurveChange(self.toneCurve[3][1], value, 100.0)
+            self.toneCurve[3][1] = calculateCurveChangeConstrained(self.toneCurve[3][1], value, self.toneCurve[4][1]-10.0, self.toneCurve[2][1]+10.0)
+            sum = sum + abs(value)
+        '''
+
+        if self.settings.has("ParametricLights"):
             found = True
-            s = xmp.get_property_float(XMP_NS_CAMERA_RAW, tag+"Saturation")
-            sum = sum + abs(s)
+            value = self.settings.getFloat("ParametricLights")
+            self.debug("Lights: %s", value)
+            #self.toneCurve[4][1] = calculateCurveChange(self.toneCurve[4][1], value, 100.0)
+            # (the lower bound can't be above the top of the curve, when the highlights point is already within 10 of it)
+            self.toneCurve[4][1] = calculateCurveChangeConstrained(self.toneCurve[4][1], value, 100.0, min(self.toneCurve[3][1]+10.0, 100.0))
+            sum = sum + abs(value)
+
+
+        if found and abs(sum)>0.01:
+            self.toneCurveChanged = True
+            #addToneCurve()
+            self.debug("Updated Curve: %s", self.toneCurve)
+            self.info("...Parametric Curve")
+
+        # process Shadows and Highlights using built in filter rather than adjusting Tone Curve
+        found2 = False
+        s = 0.0
+        h = 0.0
+        if self.settings.has("ParametricShadows"):
+            s = self.settings.getFloat("ParametricShadows")
             if abs(s)>0.01:
-                print(tag+" Sat: "+str(s))
-                # if noop values in use([0, 1, 1]), then replace with reference colour
-                #if (approxEqual(colourVectors[key][0],0.0) and approxEqual(colourVectors[key][1],1.0) and approxEqual(colourVectors[key][2],1.0)):
-                #    colourVectors[key] = refColour[key]
-                value = s / 100.0
-                colourVectors[key][1] = colourVectors[key][1] + value
-                #colourVectors[key][1] = calculateCurveChange(colourVectors[key][1], value, 1.0)
+                found2 = True
+                self.debug("Shadows: %s", s)
 
-    if found and (sum > 0.01):
-        coloursChanged = True
-        print ("Updated Colours: " + str(colourVectors) + "\n")
-        print ("...Calibration")
+        if self.settings.has("ParametricHighlights"):
+            h = self.settings.getFloat("ParametricHighlights")
+            if abs(h)>0.01:
+                found2 = True
+                self.debug("Highlights: %s", h)
 
+        if found2:
+                self.updateShadowsHighlights(s, h)
 
-# ----------------------------
 
+    # ----------------------------
 
-def processGrayMixer():
-    global colourVectors
-    global coloursChanged
-    global convertToMono
-    
-    # update colour vectors
-    found = False
-    for key in colourVectors.keys():
-        s = 0.0
-        tag = key.capitalize()
+    # takes XMP-based shadow/highlight values and creates filter definition for those (used in multiple places)
 
-        if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "GrayMixer"+tag):
-            found = True
-            s = xmp.get_property_float(XMP_NS_CAMERA_RAW, "GrayMixer"+tag)
-            if abs(s)>0.01:
-                value = (s / 100.0) # treat as a %age change
-                colourVectors[key][1] = colourVectors[key][1] + value
-                coloursChanged = True
-                print ("GrayMixer"+tag + ": " + str(s))
 
-    if found:
-        print ("Updated Colours: " + str(colourVectors) + "\n")
-        print ("...GrayMixer")
-        # if GrayMix is specified then assume conversion to greyscale
-        convertToMono = True
+    def updateShadowsHighlights(self, s, h):
+        if abs(s)>0.01 or abs(h)>0.01:
+            s2 = clamp (s/100.0, -1.0, 1.0)
+            # highlights are strange. -100..+100 -> [], 1.0..0.3, there is no support for +ve values (i.e. increase highlights)
+            if h<0.0:
+                h2 = 1.0 + h/100.0
+            else:
+                h2 = 1.0
+            h2 = clamp (h2, 0.3, 1.0)
 
+            self.debug("Shadows: %s -> %s Highlights: %s -> %s", s, s2, h, h2)
+            self.filterMap["filters"].append( { 'key':"CIHighlightShadowAdjust", "parameters":[{ 'key':"inputShadowAmount", 'val': s2, 'type': "CIAttributeTypeScalar"},
+                                                                                          { 'key':"inputHighlightAmount", 'val': h2, 'type': "CIAttributeTypeScalar"}
+                                                                                          ] } )
+        else:
+            self.warning("WARNING - Ignoring Shadows/Highlights. s:%s h:%s", s, h)
 
-# ----------------------------
+    # ----------------------------
 
 
-def addHSV():
-    if coloursChanged:
-        filterMap["filters"].append( { 'key':"MultiBandHSV", "parameters":[{ 'key':"inputRedShift", 'val': colourVectors["red"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputOrangeShift", 'val': colourVectors["orange"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputYellowShift", 'val': colourVectors["yellow"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputGreenShift", 'val': colourVectors["green"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputAquaShift", 'val': colourVectors["aqua"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputBlueShift", 'val': colourVectors["blue"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputPurpleShift", 'val': colourVectors["purple"], 'type': "CIAttributeTypePosition3"},
-                                                                           { 'key':"inputMagentaShift", 'val': colourVectors["magenta"], 'type': "CIAttributeTypePosition3"} ]
-                                    } )
-        print ("Final Colours: " + str(colourVectors) + "\n")
+    def processClarity(self):
+        value = 0.0
+        # keys: Clarity or Clarity2012. Range -100.0 .. +100.0 -> 0.0 ... +1.0 Negative values not supported
+        key = self.settings.resolve("Clarity")
+        if key is not None:
+            value = self.settings.getFloat(key) / 100.0
+            if abs(value)>0.0:
+                self.filterMap["filters"].append( { 'key':"ClarityFilter", "parameters":[{ 'key':"inputClarity", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+                self.info("...%s", key)
 
-# ----------------------------
+        if abs(value)>0.0:
+            self.debug("Clarity: %s", value)
 
 
-def processSplitToning():
-
-    found = False
-    highlightHue = 0.0
-    highlightSaturation = 0.5
-    shadowHue = 0.1
-    shadowSaturation = 0.5
-    sum = 0.0
-
-    # straightforward conversion here, just convert range Hue: -360..+360 -> -1.0..+1.0, Saturation: 0..100 to 0.0..1.0
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "SplitToningHighlightHue"):
-        found = True
-        highlightHue = xmp.get_property_float(XMP_NS_CAMERA_RAW, "SplitToningHighlightHue") / 360.0
-        sum = sum + abs(highlightHue)
-
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "SplitToningHighlightSaturation"):
-        found = True
-        highlightSaturation = xmp.get_property_float(XMP_NS_CAMERA_RAW, "SplitToningHighlightSaturation") / 100.0
-        sum = sum + abs(highlightSaturation)
-
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "SplitToningShadowHue"):
-        found = True
-        shadowHue = xmp.get_property_float(XMP_NS_CAMERA_RAW, "SplitToningShadowHue") / 360.0
-        sum = sum + abs(shadowHue)
-
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "SplitToningShadowSaturation"):
-        found = True
-        shadowSaturation = xmp.get_property_float(XMP_NS_CAMERA_RAW, "SplitToningShadowSaturation") / 100.0
-        sum = sum + abs(shadowSaturation)
-
-    if found and abs(sum)>0.01:
-        filterMap["filters"].append( { 'key':"SplitToningFilter", "parameters":[{ 'key':"inputHighlightHue", 'val': highlightHue, 'type': "CIAttributeTypeScalar"},
-                                                                                { 'key':"inputHighlightSaturation", 'val': highlightSaturation, 'type': "CIAttributeTypeScalar"},
-                                                                                { 'key':"inputShadowHue", 'val': shadowHue, 'type': "CIAttributeTypeScalar"},
-                                                                                { 'key':"inputShadowSaturation", 'val': shadowSaturation, 'type': "CIAttributeTypeScalar"} ]
-                                    } )
-        print ("...Split Toning")
+    # ----------------------------
+
+
+    def processVibrance(self):
+        value = 0.0
+        # key: Vibrance. Range -100..+100 -> -1.0..+1.0
+        if self.settings.has("Vibrance"):
+            value = self.settings.getFloat("Vibrance") / 100.0
+            if abs(value)>0.01:
+                self.filterMap["filters"].append( { 'key':"CIVibrance", "parameters":[{ 'key':"inputAmount", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+                self.info("...Vibrance")
+
+        if abs(value)>0.01:
+            self.debug("Vibrance: %s", value)
 
-# ----------------------------
 
+    # ----------------------------
 
-def processSharpening():
-    # there are 2 kinds of sharpening: 'general' sharpening by an amount, and unsharp mask
 
-    # general sharpening, use Luminosity Sharpening
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Sharpness"):
-        value = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Sharpness") / 50.0
-        value = clamp(value, 0.0, 2.0)
+    def processSaturation(self):
+        value = 0.0
+        # key: Saturation. Range -100..+100 -> 0.0..+2.0 (1.0 is neutral)
+        if self.settings.has("Saturation"):
+            value = self.settings.getFloat("Saturation")
+            if abs(value)>0.01:
+                value = (value / 100.0) + 1.0
+                value = clamp(value, 0.0, 2.0)
+                self.filterMap["filters"].append( { 'key':"SaturationFilter", "parameters":[{ 'key':"inputSaturation", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+                self.info("...Saturation")
+
         if abs(value)>0.01:
-            filterMap["filters"].append( { 'key':"CISharpenLuminance", "parameters":[{ 'key':"inputSharpness", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
-            print ("Luminance Sharpen: " + str(value))
-            print ("...Sharpening")
-
-    # unsharp mask
-    found = False
-    amount = 0.85
-    radius = 1.0
-    threshold = 0.4
-
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "SharpenDetail"):
-        found = True
-        amount = xmp.get_property_float(XMP_NS_CAMERA_RAW, "SharpenDetail") / 100.0
-
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "SharpenRadius"):
-        found = True
-        radius = xmp.get_property_float(XMP_NS_CAMERA_RAW, "SharpenRadius")
-
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "SharpenThreshold"):
-        found = True
-        threshold = xmp.get_property_float(XMP_NS_CAMERA_RAW, "SharpenThreshold")
-
-    if found and approxEqual(amount, 0.0):
-        filterMap["filters"].append( { 'key':"UnsharpMaskFilter", "parameters":[{ 'key':"inputAmount", 'val': amount, 'type': "CIAttributeTypeScalar"},
-                                                                                { 'key':"inputRadius", 'val': radius, 'type': "CIAttributeTypeScalar"},
-                                                                                { 'key':"inputThreshold", 'val': threshold, 'type': "CIAttributeTypeScalar"} ]
-                                    } )
-        print ("Unsharp Mask: amount: " + str(amount) + " radius: "  + str(radius) + " threshold: "  + str(threshold))
-        print ("...Unsharp Mask")
+            self.debug("Saturation: %s", value)
 
-# ----------------------------
 
+    # ----------------------------
 
-def processVignette():
-    # old: Midpoint, Radius, VignetteAmount, VignetteMidpoint
-    # new: PostCropVignetteAmount, PostCropVignetteFeather, PostCropVignetteMidpoint, PostCropVignetteRoundness, PostCropVignetteStyle
-
-    # default values
-    radius = 0.5
-    intensity = 0.5
-    #center = [0.0, 0.0]
-    falloff = 0.5
-    found1 = False
-    found2 = False
-
-    # Newest form. Amount must be non-zero to proceed
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "PostCropVignetteAmount"):
-        found1 = True
-        intensity = -xmp.get_property_float(XMP_NS_CAMERA_RAW, "PostCropVignetteAmount") / 100.0  # flip polarity
-        if abs(intensity) < 0.01:
-            found1 = False
-        else:
-            if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "PostCropVignetteMidpoint"):
-                radius = xmp.get_property_float(XMP_NS_CAMERA_RAW, "PostCropVignetteMidpoint") / 100.0
-
-            if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "PostCropVignetteFeather"):
-                falloff = xmp.get_property_float(XMP_NS_CAMERA_RAW, "PostCropVignetteFeather") / 100.0
-
-    # older form:
-    if (not found1) and xmp.does_property_exist(XMP_NS_CAMERA_RAW, "VignetteAmount"):
-        found2 = True
-        intensity = -xmp.get_property_float(XMP_NS_CAMERA_RAW, "VignetteAmount") / 100.0  # flip polarity
-        if abs(intensity) < 0.01:
-            found2 = False
-        else:
-            if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "Radius"):
-                radius = xmp.get_property_float(XMP_NS_CAMERA_RAW, "Radius") / 100.0
 
+    def processNoiseReduction(self):
+        amount = 0.0
+        detail = 0.0
+        smoothness = 0.0
+        found = False
+        # key: Saturation. Range -100..+100 -> 0.0..+2.0 (1.0 is neutral)
+        if self.settings.has("ColorNoiseReduction"):
+            found = True
+            amount = self.settings.getFloat("ColorNoiseReduction")
 
-    if found1 or found2:
-        #filterMap["filters"].append({'key': "CIVignetteEffect", "parameters": [{'key': "inputCenter", "val": center, "type": "CIAttributeTypePosition"},
-        #                                                                       {'key': "inputRadius", "val": radius, "type": "CIAttributeTypeDistance"},
-        #                                                                      {'key': "inputIntensity", "val": intensity, "type": "CIAttributeTypeScalar"},
-        #                                                                       {'key': "inputFalloff", "val": falloff, "type": "CIAttributeTypeScalar"}]
-        filterMap["filters"].append({'key': "CenteredVignetteFilter", "parameters": [{'key': "inputRadius", "val": radius, "type": "CIAttributeTypeScalar"},
-                                                                                     {'key': "inputIntensity", "val": intensity, "type": "CIAttributeTypeScalar"},
-                                                                                     {'key': "inputFalloff", "val": falloff, "type": "CIAttributeTypeScalar"}]
-                                                                  } )
-        print ("Vignette: intensity:" + str(intensity) + " radius: "  + str(radius) + " falloff: "  + str(falloff))
-        print ("...Vignette")
+            if self.settings.has("ColorNoiseReductionDetail"):
+                detail = self.settings.getFloat("ColorNoiseReductionDetail")
 
+            #if self.settings.has("ColorNoiseReductionSmoothness"):
+            #    smoothness = self.settings.getFloat("ColorNoiseReductionSmoothness")
 
-# ----------------------------
+        if found and abs(amount)>0.01:
+            amount = (amount / 1000.0) # 0..100 -> 0.0..0.1
+            amount = clamp(amount, 0.0, 0.1)
+            detail = detail / 500.0 # 0..100 -> 0.0..2.0
+            detail = clamp(detail, 0.0, 0.2)
+            self.filterMap["filters"].append( { 'key':"CINoiseReduction", "parameters":[{ 'key':"inputNoiseLevel", 'val': amount, 'type': "CIAttributeTypeScalar"},
+                                                                                   { 'key':"inputSharpness", 'val': detail, 'type': "CIAttributeTypeScalar"},
+                                                                                ] })
+            self.debug("Noise Reduction: amount: %s detail: %s", amount, detail)
+            self.info("...Noise Reduction")
 
+    # ----------------------------
 
-def processGrayscale():
 
-    global coloursChanged
-    global convertToMono
+    def processToneCurve(self):
+        # this is the Photoshop version of a Tone Curve. Note, will overwrite any previous Tone Curve or Parametric curve
 
-    flag = False
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "ConvertToGrayscale"):
-        flag = xmp.get_property_bool(XMP_NS_CAMERA_RAW, "ConvertToGrayscale")
+        found = False
 
-    # apply if flagged here or elsewhere, unless Split Toning is applied (this is used for Sepia toning etc.)
-    if (flag or convertToMono):
-        # filterMap["filters"].append( { 'key':"CIPhotoEffectMono", "parameters":[] } )
-        value = 0.0
-        if coloursChanged:
-            value = 0.001  # if we messed with the colours, then leave a little in there
-        filterMap["filters"].append({'key': "SaturationFilter", "parameters": [ {'key': "inputSaturation", 'val': value, 'type': "CIAttributeTypeScalar"}]})
-        print ("...ConvertToGrayscale")
+        # first, look for a named preset
+        name = ""
+        key = self.settings.resolve("ToneCurveName")
+        if key is not None:
+            name = self.settings.getText(key)
 
+        if len(name) > 0:
+            found = True
+            if name == "Medium Contrast":
+                self.toneCurve = [ [0.0, 0.0], [25.0, 20.0], [50.0, 50.0], [75.0, 80.0], [100.0, 100.0]]
+            elif name == "Strong Contrast":
+                self.toneCurve = [ [0.0, 0.0], [25.0, 15.0], [50.0, 50.0], [75.0, 85.0], [100.0, 100.0]]
 
-# ----------------------------
+        # look for tone curve values
+        curveName = self.settings.resolve("ToneCurve")
 
+        if len(name) > 0 and (curveName is not None):
+            found = True
+            points = self.settings.getPoints(curveName)
+            count = len(points)
+            if count > 0:
+                found = True
+                self.debug("\nInput Curve: %s\n", points)
+
+                # if 2 or less points then ignore (linear anyway), otherwise interpolate
+                if (count <2):
+                    self.error("ERROR: too few points(%s)", count)
+                #elif (count <= 3):
+                else:
+                    #self.debug("Need to interpolate Tone Curve")
+                    # the curve was interpolated (on a 0..100 scale) by sampleToneCurves, just update the tone curve
+                    x2, y2 = self.pointCurves["master"]
+                    xcurve = [ 0.0, 25.0, 50.0, 75.0, 100.0 ]
+                    ycurve = self.curveSamples["master"].clip(0.0, 100.0)
+                    tmp2 = 0.0
+                    for i in range(0, len(xcurve)):
+                        tmp2 = float(ycurve[i])
+                        if tmp2 < 0.001: # small numbers cause issues with JSON
+                            tmp2 = 0.0
+                        self.toneCurve[i] = [xcurve[i], tmp2]
+                    self.pointCurve = (x2, y2, [ list(p) for p in self.toneCurve ]) # (for the full resolution table)
+
+        if found:
+            self.toneCurveChanged = True
+            self.debug("Curve: %s", self.toneCurve)
+            self.info("...Tone Curve")
+
+    # ----------------------------
+
+
+    def addToneCurve(self):
+        if self.toneCurveChanged:
+            self.filterMap["filters"].append( { 'key':"CIToneCurve",
+                                        "parameters":[{ 'key':"inputPoint0", 'val': [(self.toneCurve[0][0]/100.0), (self.toneCurve[0][1]/100.0)], 'type': "CIAttributeTypeOffset"},
+                                                      { 'key':"inputPoint1", 'val': [(self.toneCurve[1][0]/100.0), (self.toneCurve[1][1]/100.0)], 'type': "CIAttributeTypeOffset"},
+                                                      { 'key':"inputPoint2", 'val': [(self.toneCurve[2][0]/100.0), (self.toneCurve[2][1]/100.0)], 'type': "CIAttributeTypeOffset"},
+                                                      { 'key':"inputPoint3", 'val': [(self.toneCurve[3][0]/100.0), (self.toneCurve[3][1]/100.0)], 'type': "CIAttributeTypeOffset"},
+                                                      { 'key':"inputPoint4", 'val': [(self.toneCurve[4][0]/100.0), (self.toneCurve[4][1]/100.0)], 'type': "CIAttributeTypeOffset"} ]
+                                        } )
+            self.curveFilters["master"] = self.filterMap["filters"][-1]
+
+            self.debug("Curve: %s", self.toneCurve)
+
+
+    # ----------------------------
+
+
+    def addCurveTables(self):
+
+        # With --curve-table, the tables for both curve filters (added by processRGBToneCurves and addToneCurve) are built
+        # here, in one call, once the master curve has had all of its changes. See curveTables.py
+
+        if (self.curveTable is None) or (len(self.curveFilters) == 0):
+            return
+
+        import curveTables
+        master = None
+        if "master" in self.curveFilters:
+            master = (self.toneCurve, self.pointCurve)
+        channels = None
+        if "channels" in self.curveFilters:
+            channels = self.curveFilters["channels"][1:]
+
+        masterTable, channelTables = curveTables.presetTables(master, channels, self.curveTable)
+        if masterTable is not None:
+            self.curveFilters["master"]["tables"] = { "master": masterTable }
+        if channelTables is not None:
+            self.curveFilters["channels"][0]["tables"] = channelTables
+
+
+    # ----------------------------
+
+
+    def sampleToneCurves(self):
+
+        # The point curves that have to be interpolated to get the 5 points of the filters (the master curve, used by
+        # processToneCurve, and the R/G/B curves, used by processRGBToneCurves) are all resampled here, in one call, and the
+        # samples left in self.curveSamples. The master curve is on a 0..100 scale, the R/G/B curves on 0..1
+
+        pending = [] # (name, x, y, sample points)
+
+        key = self.settings.resolve("ToneCurveName")
+        curveName = self.settings.resolve("ToneCurve")
+        if (key is not None) and (len(self.settings.getText(key)) > 0) and (curveName is not None):
+            points = self.settings.getPoints(curveName)
+            if len(points) >= 2:
+                x, y = zip(*points)
+                pending.append(("master", [100.0 * f / 255 for f in x], [100.0 * f / 255 for f in y], [ 0.0, 25.0, 50.0, 75.0, 100.0 ]))
+
+        # (curves with exactly 5 points are used as they are, and curves with 2 or less are ignored)
+        for colour in [ "Red", "Green", "Blue" ]:
+            curveName = self.settings.resolve("ToneCurve" + colour)
+            if curveName is not None:
+                points = self.settings.getPoints(curveName)
+                if (len(points) > 2) and (len(points) != 5):
+                    x, y = zip(*points)
+                    pending.append((colour.lower(), [f / 255 for f in x], [f / 255 for f in y], [ 0.0, 0.25, 0.50, 0.75, 1.00 ]))
+
+        if len(pending) > 0:
+            import curves # loaded here (rather than at startup), since most presets don't need it (or numpy)
+            samples = curves.sampleCurves([ (x, y) for name, x, y, grid in pending ], [ grid for name, x, y, grid in pending ])
+            for (name, x, y, grid), values in zip(pending, samples):
+                self.pointCurves[name] = (x, y)
+                self.curveSamples[name] = values
+
+
+    # ----------------------------
+
+
+    def processRGBToneCurves(self):
+
+        # handles individual RGB Tone Curves
+
+        # Note: do *not* use global tone curve array
+
+        # default tone curves, split into X and Y vectors. Note the 0..1.0 scale
+        redX = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
+        redY = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
+        greenX = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
+        greenY = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
+        blueX = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
+        blueY = [ 0.0, 0.25, 0.50, 0.75, 1.00 ]
+
+        found = False
+        linearCount = 0
+
+        # curves that were interpolated by sampleToneCurves
+        pending = []
+
+        # RED
+        curveName = self.settings.resolve("ToneCurveRed")
+
+        if curveName is not None:
+            #found = True
+            points = self.settings.getPoints(curveName)
+            count = len(points)
+            if count > 0:
+                found = True
+                self.debug("\nInput Red Curve: %s\n", points)
+
+                # if we have exactly 5 points then we can use them directly, otherwise we need to interpolate to get those 5 points
+                if (count == 5):
+                    x, y = zip(*points)
+                    redY = [f / 255 for f in y]
+
+                elif (count <= 2):
+                    self.warning("WARN: too few points(%s). Using Linear Curve", count)
+                    linearCount += 1
+                #elif (count <= 3):
+                else:
+                    #self.debug("Need to interpolate Tone Curve")
+                    # split into 2 arrays, convert to 0..1.0 scale, create spline, interpolate and update the curve
+                    pending.append("red")
+
+        # GREEN
+        curveName = self.settings.resolve("ToneCurveGreen")
+
+        if curveName is not None:
+            #found = True
+            points = self.settings.getPoints(curveName)
+            count = len(points)
+            if count > 0:
+                found = True
+                self.debug("\nInput Green Curve: %s\n", points)
+
+                # if we have exactly 5 points then we can use them directly, otherwise we need to interpolate to get those 5 points
+                if (count == 5):
+                    x, y = zip(*points)
+                    greenY = [f / 255 for f in y]
+
+                elif (count <= 2):
+                    self.warning("WARN: too few points(%s). Using Linear Curve", count)
+                    linearCount += 1
+                #elif (count <= 3):
+                else:
+                    #self.debug("Need to interpolate Tone Curve")
+                    # split into 2 arrays, convert to 0..1.0 scale, create spline, interpolate and update the curve
+                    pending.append("green")
+
+        # BLUE
+        curveName = self.settings.resolve("ToneCurveBlue")
+
+        if curveName is not None:
+            #found = True
+            points = self.settings.getPoints(curveName)
+            count = len(points)
+            if count > 0:
+                found = True
+                self.debug("\nInput Blue Curve: %s\n", points)
+
+                # if we have exactly 5 points then we can use them directly, otherwise we need to interpolate to get those 5 points
+                if (count == 5):
+                    x, y = zip(*points)
+                    blueY = [f / 255 for f in y]
+
+                elif (count <= 2):
+                    self.warning("WARN: too few points(%s). Using Linear Curve", count)
+                    linearCount += 1
+                # elif (count <= 3):
+                else:
+                    # self.debug("Need to interpolate Tone Curve")
+                    # split into 2 arrays, convert to 0..1.0 scale, create spline, interpolate and update the curve
+                    pending.append("blue")
+
+        # pick up the interpolated curves
+        for colour in pending:
+            values = [ float(v) for v in self.curveSamples[colour].clip(0.0, 1.0) ]
+            values = [ (0.0 if v < 0.001 else v) for v in values ] # small numbers case issues with JSON
+            if colour == "red":
+                redY = values
+            elif colour == "green":
+                greenY = values
+            else:
+                blueY = values
 
-def processGrain():
-    '''
-        GrainAmount 0..100 -> 0.0..1.0
-        GrainSize 0..100 -> 0.0..1.0
-        GrainFrequency 0..100 (not used)
-    '''
-    found = False
-    size = 0.0
-    amount = 0.0
-    
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "GrainAmount"):
-        found = True
-        amount = xmp.get_property_float(XMP_NS_CAMERA_RAW, "GrainAmount") / 100.0
-    
-    if xmp.does_property_exist(XMP_NS_CAMERA_RAW, "GrainSize"):
-        found = True
-        size = xmp.get_property_float(XMP_NS_CAMERA_RAW, "GrainSize") / 100.0
-    
 
-    if found and not approxEqual(amount, 0.0):
-        filterMap["filters"].append( { 'key':"FilmGrainFilter", "parameters":[{ 'key':"inputAmount", 'val': amount, 'type': "CIAttributeTypeScalar"},
-                                                                          { 'key':"inputSize", 'val': size, 'type': "CIAttributeTypeScalar"} ]
-                                    } )
-        print ("Film Grain: amount: " + str(amount) + " size: "  + str(size))
-        print ("...Film Grain")
+        if linearCount == 3:
+            found = False
+            self.warning("WARNING: ignoring RGB Tone Curve")
+
+        if found:
+            self.debug("\nOutput Red Curve:\n    X:%s\n    Y:%s", redX, redY)
+            self.debug("\nOutput Green Curve:\n    X:%s\n    Y:%s", greenX, greenY)
+            self.debug("\nOutput Blue Curve:\n    X:%s\n    Y:%s\n", blueX, blueY)
+            self.filterMap["filters"].append( { 'key':"RGBChannelToneCurve",
+                                        "parameters":[{ 'key':"inputRedXvalues",   'val': redX, 'type': "CIAttributeTypeVector"},
+                                                      { 'key':"inputRedYvalues",   'val': redY, 'type': "CIAttributeTypeVector"},
+                                                      { 'key':"inputGreenXvalues", 'val': greenX, 'type': "CIAttributeTypeVector"},
+                                                      { 'key':"inputGreenYvalues", 'val': greenY, 'type': "CIAttributeTypeVector"},
+                                                      { 'key':"inputBlueXvalues",  'val': blueX, 'type': "CIAttributeTypeVector"},
+                                                      { 'key':"inputBlueYvalues",  'val': blueY, 'type': "CIAttributeTypeVector"} ]
+                                        } )
+            full = dict([ (colour, self.pointCurves[colour]) for colour in pending ])
+            self.curveFilters["channels"] = (self.filterMap["filters"][-1], [ (redX, redY), (greenX, greenY), (blueX, blueY) ], full)
+            self.info("...RGB Tone Curves")
+
+    # ----------------------------
+
+
+    def processHSV(self):
+        '''
+            vector is [hue, saturation, brightness]
+            range of input is -100..+100
+            range of output is 0.0..+1.0
+            attribute type CIAttributeTypePosition3 (CIVector)
+            '''
+
+        # update colour vectors
+        found = False
+        sum = 0.0 # check to see if anything changed
+        for key in self.colourVectors.keys():
+            h = 0.0
+            s = 0.0
+            v = 0.0
+            tag = key.capitalize()
+            if self.settings.has("HueAdjustment"+tag):
+                found = True
+                h = self.settings.getFloat("HueAdjustment"+tag)
+
+                sum = sum + abs(h)
+                if abs(h)>0.01:
+                    value = (h / 100.0) / 8.0 # treat as a %age of the colour band
+                    #value = (h / 100.0)
+                    self.colourVectors[key][0] = self.colourVectors[key][0] + value
+            if self.settings.has("SaturationAdjustment"+tag):
+                found = True
+                s = self.settings.getFloat("SaturationAdjustment"+tag)
+                if abs(s)>0.01:
+                    value = (s / 100.0) # treat as a %age change
+                    self.colourVectors[key][1] = self.colourVectors[key][1] + value
+                    #self.colourVectors[key][1] = calculateCurveChange(self.colourVectors[key][1], value, 1.0)
+                sum = sum + abs(s)
+            if self.settings.has("LuminanceAdjustment"+tag):
+                found = True
+                v = self.settings.getFloat("LuminanceAdjustment"+tag)
+                if abs(v)>0.01:
+                    value = (v / 100.0) # treat as a %age change
+                    self.colourVectors[key][2] = self.colourVectors[key][2] + value
+                #self.colourVectors[key][2] = calculateCurveChange(self.colourVectors[key][2], value, 1.0)
+                sum = sum + abs(v)
+
+            # if hue, saturation and value are all 0 then set to noop values [0, 1, 1]
+            if (abs(h) + abs(s) + abs(v)) < 0.01:
+                self.colourVectors[key] = [0.0, 1.0, 1.0]
+
+            self.debug("%s: h:%s: s:%s: v:%s", tag, h, s, v)
+
+        if found:
+            if (sum > 0.01): # check that something was specified, not all 0s
+                self.coloursChanged = True
+                self.debug("Updated Colours: %s\n", self.colourVectors)
+                self.info("...HSV")
+            else:
+                self.warning("Ignoring HSV")
+
+
+    # ----------------------------
+
+
+    def processCalibration(self):
+        # This is an 'older' way to change hue and saturation. Range is -100..+100 and represents % change
+
+        found = False
+
+        # update colour vectors
+        found = False
+        sum = 0.0 # check to see if anything changed
+        h = 0.0
+        s = 1.0
+        v = 1.0
+
+        for key in ["red", "green", "blue"]:
+            tag = key.capitalize()
+            if self.settings.has(tag+"Hue"):
+                found = True
+                h = self.settings.getFloat(tag+"Hue")
+                sum = sum + abs(h)
+                if abs(h)>0.01:
+                    self.debug("%s Hue: %s", tag, h)
+                    # if noop values in use([0, 1, 1]), then replace with reference colour
+                    #if (approxEqual(self.colourVectors[key][0],0.0) and approxEqual(self.colourVectors[key][1],1.0) and approxEqual(self.colourVectors[key][2],1.0)):
+                    #    self.colourVectors[key] = refColour[key]
+                    #value = (h / 100.0) * hueWidth # treat as a %age of the hue band (not the entire hue range)
+                    value = (h / 100.0)  / 8.0 # treat as a %age of the colour band
+                    #value = self.colourVectors[key][0] + value
+                    self.colourVectors[key][0] = self.colourVectors[key][0] + value
+            if self.settings.has(tag+"Saturation"):
+                found = True
+                s = self.settings.getFloat(tag+"Saturation")
+                sum = sum + abs(s)
+                if abs(s)>0.01:
+                    self.debug("%s Sat: %s", tag, s)
+                    # if noop values in use([0, 1, 1]), then replace with reference colour
+                    #if (approxEqual(self.colourVectors[key][0],0.0) and approxEqual(self.colourVectors[key][1],1.0) and approxEqual(self.colourVectors[key][2],1.0)):
+                    #    self.colourVectors[key] = refColour[key]
+                    value = s / 100.0
+                    self.colourVectors[key][1] = self.colourVectors[key][1] + value
+                    #self.colourVectors[key][1] = calculateCurveChange(self.colourVectors[key][1], value, 1.0)
+
+        if found and (sum > 0.01):
+            self.coloursChanged = True
+            self.debug("Updated Colours: %s\n", self.colourVectors)
+            self.info("...Calibration")
+
+
+    # ----------------------------
+
+
+    def processGrayMixer(self):
+
+        # update colour vectors
+        found = False
+        for key in self.colourVectors.keys():
+            s = 0.0
+            tag = key.capitalize()
+
+            if self.settings.has("GrayMixer"+tag):
+                found = True
+                s = self.settings.getFloat("GrayMixer"+tag)
+                if abs(s)>0.01:
+                    value = (s / 100.0) # treat as a %age change
+                    self.colourVectors[key][1] = self.colourVectors[key][1] + value
+                    self.coloursChanged = True
+                    self.debug("GrayMixer%s: %s", tag, s)
+
+        if found:
+            self.debug("Updated Colours: %s\n", self.colourVectors)
+            self.info("...GrayMixer")
+            # if GrayMix is specified then assume conversion to greyscale
+            self.convertToMono = True
+
+
+    # ----------------------------
+
+
+    def addHSV(self):
+        if self.coloursChanged:
+            # HSL, calibration and the gray mixer all add to the saturation, so it can end up anywhere in -2..4, outside the
+            # range of the filter (a negative saturation inverts the colours). The hue (+/-0.25) and value (0..2) can't
+            for key in self.colourVectors.keys():
+                self.colourVectors[key][1] = clamp(self.colourVectors[key][1], 0.0, 3.0)
+            self.filterMap["filters"].append( { 'key':"MultiBandHSV", "parameters":[{ 'key':"inputRedShift", 'val': self.colourVectors["red"], 'type': "CIAttributeTypePosition3"},
+                                                                               { 'key':"inputOrangeShift", 'val': self.colourVectors["orange"], 'type': "CIAttributeTypePosition3"},
+                                                                               { 'key':"inputYellowShift", 'val': self.colourVectors["yellow"], 'type': "CIAttributeTypePosition3"},
+                                                                               { 'key':"inputGreenShift", 'val': self.colourVectors["green"], 'type': "CIAttributeTypePosition3"},
+                                                                               { 'key':"inputAquaShift", 'val': self.colourVectors["aqua"], 'type': "CIAttributeTypePosition3"},
+                                                                               { 'key':"inputBlueShift", 'val': self.colourVectors["blue"], 'type': "CIAttributeTypePosition3"},
+                                                                               { 'key':"inputPurpleShift", 'val': self.colourVectors["purple"], 'type': "CIAttributeTypePosition3"},
+                                                                               { 'key':"inputMagentaShift", 'val': self.colourVectors["magenta"], 'type': "CIAttributeTypePosition3"} ]
+                                        } )
+            self.debug("Final Colours: %s\n", self.colourVectors)
+
+    # ----------------------------
+
+
+    def processSplitToning(self):
+
+        found = False
+        highlightHue = 0.0
+        highlightSaturation = 0.5
+        shadowHue = 0.1
+        shadowSaturation = 0.5
+        sum = 0.0
+
+        # straightforward conversion here, just convert range Hue: -360..+360 -> -1.0..+1.0, Saturation: 0..100 to 0.0..1.0
+        if self.settings.has("SplitToningHighlightHue"):
+            found = True
+            highlightHue = self.settings.getFloat("SplitToningHighlightHue") / 360.0
+            sum = sum + abs(highlightHue)
+
+        if self.settings.has("SplitToningHighlightSaturation"):
+            found = True
+            highlightSaturation = self.settings.getFloat("SplitToningHighlightSaturation") / 100.0
+            sum = sum + abs(highlightSaturation)
+
+        if self.settings.has("SplitToningShadowHue"):
+            found = True
+            shadowHue = self.settings.getFloat("SplitToningShadowHue") / 360.0
+            sum = sum + abs(shadowHue)
+
+        if self.settings.has("SplitToningShadowSaturation"):
+            found = True
+            shadowSaturation = self.settings.getFloat("SplitToningShadowSaturation") / 100.0
+            sum = sum + abs(shadowSaturation)
+
+        if found and abs(sum)>0.01:
+            self.filterMap["filters"].append( { 'key':"SplitToningFilter", "parameters":[{ 'key':"inputHighlightHue", 'val': highlightHue, 'type': "CIAttributeTypeScalar"},
+                                                                                    { 'key':"inputHighlightSaturation", 'val': highlightSaturation, 'type': "CIAttributeTypeScalar"},
+                                                                                    { 'key':"inputShadowHue", 'val': shadowHue, 'type': "CIAttributeTypeScalar"},
+                                                                                    { 'key':"inputShadowSaturation", 'val': shadowSaturation, 'type': "CIAttributeTypeScalar"} ]
+                                        } )
+            self.info("...Split Toning")
+
+    # ----------------------------
+
+
+    def processSharpening(self):
+        # there are 2 kinds of sharpening: 'general' sharpening by an amount, and unsharp mask
+
+        # general sharpening, use Luminosity Sharpening
+        if self.settings.has("Sharpness"):
+            value = self.settings.getFloat("Sharpness") / 50.0
+            value = clamp(value, 0.0, 2.0)
+            if abs(value)>0.01:
+                self.filterMap["filters"].append( { 'key':"CISharpenLuminance", "parameters":[{ 'key':"inputSharpness", 'val': value, 'type': "CIAttributeTypeScalar"} ] } )
+                self.debug("Luminance Sharpen: %s", value)
+                self.info("...Sharpening")
+
+        # unsharp mask
+        found = False
+        amount = 0.85
+        radius = 1.0
+        threshold = 0.4
+
+        if self.settings.has("SharpenDetail"):
+            found = True
+            amount = self.settings.getFloat("SharpenDetail") / 100.0
+
+        if self.settings.has("SharpenRadius"):
+            found = True
+            radius = self.settings.getFloat("SharpenRadius")
+
+        if self.settings.has("SharpenThreshold"):
+            found = True
+            threshold = self.settings.getFloat("SharpenThreshold")
+
+        if found and approxEqual(amount, 0.0):
+            self.filterMap["filters"].append( { 'key':"UnsharpMaskFilter", "parameters":[{ 'key':"inputAmount", 'val': amount, 'type': "CIAttributeTypeScalar"},
+                                                                                    { 'key':"inputRadius", 'val': radius, 'type': "CIAttributeTypeScalar"},
+                                                                                    { 'key':"inputThreshold", 'val': threshold, 'type': "CIAttributeTypeScalar"} ]
+                                        } )
+            self.debug("Unsharp Mask: amount: %s radius: %s threshold: %s", amount, radius, threshold)
+            self.info("...Unsharp Mask")
+
+    # ----------------------------
+
+
+    def processVignette(self):
+        # old: Midpoint, Radius, VignetteAmount, VignetteMidpoint
+        # new: PostCropVignetteAmount, PostCropVignetteFeather, PostCropVignetteMidpoint, PostCropVignetteRoundness, PostCropVignetteStyle
+
+        # default values
+        radius = 0.5
+        intensity = 0.5
+        #center = [0.0, 0.0]
+        falloff = 0.5
+        found1 = False
+        found2 = False
+
+        # Newest form. Amount must be non-zero to proceed
+        if self.settings.has("PostCropVignetteAmount"):
+            found1 = True
+            intensity = -self.settings.getFloat("PostCropVignetteAmount") / 100.0  # flip polarity
+            if abs(intensity) < 0.01:
+                found1 = False
+            else:
+                if self.settings.has("PostCropVignetteMidpoint"):
+                    radius = self.settings.getFloat("PostCropVignetteMidpoint") / 100.0
+
+                if self.settings.has("PostCropVignetteFeather"):
+                    falloff = self.settings.getFloat("PostCropVignetteFeather") / 100.0
+
+        # older form:
+        if (not found1) and self.settings.has("VignetteAmount"):
+            found2 = True
+            intensity = -self.settings.getFloat("VignetteAmount") / 100.0  # flip polarity
+            if abs(intensity) < 0.01:
+                found2 = False
+            else:
+                if self.settings.has("Radius"):
+                    radius = self.settings.getFloat("Radius") / 100.0
+
+
+        if found1 or found2:
+            #self.filterMap["filters"].append({'key': "CIVignetteEffect", "parameters": [{'key': "inputCenter", "val": center, "type": "CIAttributeTypePosition"},
+            #                                                                       {'key': "inputRadius", "val": radius, "type": "CIAttributeTypeDistance"},
+            #                                                                      {'key': "inputIntensity", "val": intensity, "type": "CIAttributeTypeScalar"},
+            #                                                                       {'key': "inputFalloff", "val": falloff, "type": "CIAttributeTypeScalar"}]
+            self.filterMap["filters"].append({'key': "CenteredVignetteFilter", "parameters": [{'key': "inputRadius", "val": radius, "type": "CIAttributeTypeScalar"},
+                                                                                         {'key': "inputIntensity", "val": intensity, "type": "CIAttributeTypeScalar"},
+                                                                                         {'key': "inputFalloff", "val": falloff, "type": "CIAttributeTypeScalar"}]
+                                                                      } )
+            self.debug("Vignette: intensity:%s radius: %s falloff: %s", intensity, radius, falloff)
+            self.info("...Vignette")
+
+
+    # ----------------------------
+
+
+    def processGrayscale(self):
+        flag = False
+        if self.settings.has("ConvertToGrayscale"):
+            flag = self.settings.getBool("ConvertToGrayscale")
+
+        # apply if flagged here or elsewhere, unless Split Toning is applied (this is used for Sepia toning etc.)
+        if (flag or self.convertToMono):
+            # self.filterMap["filters"].append( { 'key':"CIPhotoEffectMono", "parameters":[] } )
+            value = 0.0
+            if self.coloursChanged:
+                value = 0.001  # if we messed with the colours, then leave a little in there
+            self.filterMap["filters"].append({'key': "SaturationFilter", "parameters": [ {'key': "inputSaturation", 'val': value, 'type': "CIAttributeTypeScalar"}]})
+            self.info("...ConvertToGrayscale")
+
+
+    # ----------------------------
+
+
+    def processGrain(self):
+        '''
+            GrainAmount 0..100 -> 0.0..1.0
+            GrainSize 0..100 -> 0.0..1.0
+            GrainFrequency 0..100 (not used)
+        '''
+        found = False
+        size = 0.0
+        amount = 0.0
+
+        if self.settings.has("GrainAmount"):
+            found = True
+            amount = self.settings.getFloat("GrainAmount") / 100.0
+
+        if self.settings.has("GrainSize"):
+            found = True
+            size = self.settings.getFloat("GrainSize") / 100.0
+
+
+        if found and not approxEqual(amount, 0.0):
+            self.filterMap["filters"].append( { 'key':"FilmGrainFilter", "parameters":[{ 'key':"inputAmount", 'val': amount, 'type': "CIAttributeTypeScalar"},
+                                                                              { 'key':"inputSize", 'val': size, 'type': "CIAttributeTypeScalar"} ]
+                                        } )
+            self.debug("Film Grain: amount: %s size: %s", amount, size)
+            self.info("...Film Grain")
 
 # ----------------------------
 
@@ -1330,6 +2233,15 @@ def calculateCurveChangeConstrained(currval, change, upper, lower):
 # ----------------------------
 
 
+# maps a relative white balance temperature (-100..+100, 0 is no change) onto the range of WhiteBalanceFilter. The filter
+# corrects towards a 6500K neutral, so 0 maps to 6500K and -100/+100 to the ends of its 2000..10000K range (used as Kelvin,
+# a relative value would be an extreme correction whatever its sign, e.g. +12 would be 12K)
+def relativeTemperature(value):
+    if value > 0.0:
+        return 6500.0 + value * 35.0
+    return 6500.0 + value * 45.0
+
+
 # utility function to clamp a value between the suppied min and max values
 def clamp(value, minv, maxv):
     return max(min(value, maxv), minv)
@@ -1347,5 +2259,6 @@ def approxEqual(var, value):
 # ----------------------------
 
 
-# execute main function
-main()
+# execute main function (but not when imported, e.g. by the worker processes in batch mode)
+if __name__ == "__main__":
+    main()
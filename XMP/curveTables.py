@@ -0,0 +1,202 @@
+#! /usr/bin/python
+
+# Full resolution tone curve tables (see convertXMP.py --curve-table). The tone curves in a preset are sent to the app as 5
+# points (CIToneCurve) or 5 points per channel (RGBChannelToneCurve), which the app then has to interpolate again each time
+# it renders, and any detail of the original point curve between those 5 points is lost. With --curve-table, each curve
+# filter also gets the curve evaluated at 256 or 1024 evenly spaced inputs (0..1), so that the app can use a table lookup:
+#
+#   { "key": "CIToneCurve", "parameters": [ ... the 5 points, as before ... ], "tables": { "master": [ ... ] } }
+#   { "key": "RGBChannelToneCurve", "parameters": [ ... ], "tables": { "red": [ ... ], "green": [ ... ], "blue": [ ... ] } }
+#
+# The master curve is built from several adjustments (negative contrast, blacks/whites, the point curve and the parametric
+# curve, see the Converter stages), which all move the 5 points. With no point curve, the table is the curve through the final
+# 5 points (a natural cubic spline, the same model as optimizeChain.py), which is exactly what the adjustments define. With a
+# point curve, the full point curve is used in place of the 5 points sampled from it, and the parametric changes made after
+# it (the only adjustments that are applied on top of a point curve) are added as the difference between the natural splines
+# through the final and the sampled 5 points:
+#
+#     table(u) = pointCurve(u) + (spline(final 5 points)(u) - spline(sampled 5 points)(u))
+#
+# This is an approximation: the adjustments are only defined as moves of the 5 points, not as a function of the input, so
+# there is nothing exact to compose with the full curve. With no later changes the table is exactly the point curve, and the
+# further the parametric changes move the 5 points, the more the table can differ from any "true" composition of the two.
+# RGB curves that were resampled from more points use the full curve, the others are the curve through their 5 points.
+
+# All of the curves of a preset (the master curve and the R/G/B curves) are fitted and evaluated together: the 5 point curves
+# in one naturalSplines call, and the full point curves in one curves.sampleCurves call (with the master curve on its 0..100
+# scale). Values are clamped to 0..1, and rounded to 6 decimal places to keep the JSON a reasonable size.
+
+# Usage: python curveTables.py <preset JSON file> [--size N]     (prints the tables of the curve filters in a preset)
+
+import json
+import argparse
+
+import numpy as np
+
+import curves
+
+
+tableSizes = [ 256, 1024 ]
+
+# decimal places kept in the tables
+tablePrecision = 6
+
+curveX = [ 0.0, 0.25, 0.5, 0.75, 1.0 ]
+channelNames = [ "red", "green", "blue" ]
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("preset", help="JSON preset file")
+    parser.add_argument("--size", type=int, choices=tableSizes, default=tableSizes[0], help="number of entries in each table")
+    args = parser.parse_args()
+
+    with open(args.preset, 'r') as f:
+        preset = json.load(f)
+
+    import optimizeChain
+    found = False
+    for f in preset.get("filters", []):
+        if f.get("key") not in optimizeChain.curveFilters:
+            continue
+        found = True
+        tables = f.get("tables")
+        if tables is None:
+            # no tables in the preset, so show the curve through the points
+            points = optimizeChain.curvePoints(f)
+            if f["key"] == "CIToneCurve":
+                points = points[:1]
+            values = pointTables(points, args.size)
+            names = [ "master" ] if f["key"] == "CIToneCurve" else channelNames
+            tables = dict(zip(names, values))
+        for name in sorted(tables.keys()):
+            print("%s %s: %s" % (f["key"], name, " ".join("%.4f" % v for v in tables[name])))
+    if not found:
+        print("No tone curves in " + args.preset)
+
+
+# ----------------------------
+
+
+# the input values for a table
+def tableGrid(size):
+    return np.linspace(0.0, 1.0, size)
+
+
+# converts the values of a table to the (JSON) list
+def tableValues(values):
+    return [ round(float(v), tablePrecision) + 0.0 for v in np.clip(values, 0.0, 1.0) ] # (+ 0.0 turns -0.0 into 0.0)
+
+
+# the tables for the curve filters of a preset, all fitted and evaluated together.
+# master is None for no master curve, or (toneCurve, pointCurve): the final list of 5 [x, y] points (0..100 scale, see
+# Converter.toneCurve), and None or (x, y, samples) if the 5 points came from a point curve: the points of the curve (0..100)
+# and the 5 points sampled from it (before any later changes).
+# channels is None for no RGB curves, or (points, full): the list of (x, y) for each channel (the 5 points, 0..1 scale), and a
+# map of channel name -> (x, y) of the original curve (0..1) for those that were resampled.
+# Returns (master, channels): the master table (None if there is no master curve), and a map of channel name -> table (None
+# if there are no RGB curves)
+def presetTables(master, channels, size):
+    u = tableGrid(size)
+
+    # the 5 point curves, and the full curves with the points to evaluate each at
+    fivePoints = []
+    full = []
+    if master is not None:
+        toneCurve, pointCurve = master
+        fivePoints.append(scalePoints(toneCurve))
+        if pointCurve is not None:
+            x, y, samples = pointCurve
+            fivePoints.append(scalePoints(samples))
+            full.append(((x, y), 100.0 * u))
+    if channels is not None:
+        points, resampledCurves = channels
+        resampled = [ name for name in channelNames if name in resampledCurves ]
+        fivePoints.extend(points)
+        full.extend((resampledCurves[name], u) for name in resampled)
+
+    splines = list(naturalSplines(fivePoints, u)) if len(fivePoints) > 0 else []
+    sampled = list(curves.sampleCurves([ c for c, grid in full ], [ grid for c, grid in full ])) if len(full) > 0 else []
+
+    masterTable = None
+    if master is not None:
+        final = splines.pop(0)
+        if pointCurve is None:
+            masterTable = tableValues(final)
+        else:
+            base = splines.pop(0)
+            masterTable = tableValues(np.clip(sampled.pop(0) / 100.0, 0.0, 1.0) + (final - base))
+
+    channelTables = None
+    if channels is not None:
+        tables = dict(zip(channelNames, splines))
+        for name, v in zip(resampled, sampled):
+            tables[name] = v
+        channelTables = dict([ (name, tableValues(v)) for name, v in tables.items() ])
+
+    return masterTable, channelTables
+
+
+# the tables for curves given as (x, y) points (0..1 scale)
+def pointTables(points, size):
+    return naturalSplines(points, tableGrid(size))
+
+
+def scalePoints(points):
+    return ([ p[0] / 100.0 for p in points ], [ p[1] / 100.0 for p in points ])
+
+
+# ----------------------------
+
+
+# evaluates natural cubic splines through a list of curves (x, y), which must all have the same number of points, at u.
+# This is the same model as optimizeChain.evaluateCurve (flat outside the range of the points, and linear if the x values
+# aren't increasing), for a stack of curves at once. Returns an array of shape (curves, len(u))
+def naturalSplines(points, u):
+    x = np.array([ p[0] for p in points ], dtype=float)
+    y = np.array([ p[1] for p in points ], dtype=float)
+    u = np.asarray(u, dtype=float)
+    count, n = x.shape
+    h = np.diff(x, axis=1)
+    valid = np.all(h > 0.0, axis=1)
+    h = np.where(valid[:, np.newaxis], h, 1.0)
+
+    # second derivatives (zero at the ends), solved for all of the curves together
+    a = np.zeros((count, n, n))
+    r = np.zeros((count, n))
+    a[:, 0, 0] = 1.0
+    a[:, n-1, n-1] = 1.0
+    for i in range(1, n-1):
+        a[:, i, i-1] = h[:, i-1]
+        a[:, i, i] = 2.0 * (h[:, i-1] + h[:, i])
+        a[:, i, i+1] = h[:, i]
+        r[:, i] = 6.0 * (((y[:, i+1] - y[:, i]) / h[:, i]) - ((y[:, i] - y[:, i-1]) / h[:, i-1]))
+    m = np.linalg.solve(a, r[..., np.newaxis])[..., 0]
+
+    uc = np.clip(u[np.newaxis, :], x[:, :1], x[:, -1:])
+    i = np.clip(np.sum(uc[:, :, np.newaxis] >= x[:, np.newaxis, 1:], axis=2), 0, n-2)
+    take = lambda v, j: np.take_along_axis(v, j, axis=1)
+    hi = take(h, i)
+    t0 = take(x, i+1) - uc
+    t1 = uc - take(x, i)
+    mi = take(m, i)
+    mj = take(m, i+1)
+    result = ((mi * t0**3 + mj * t1**3) / (6.0 * hi) +
+              (take(y, i) / hi - mi * hi / 6.0) * t0 + (take(y, i+1) / hi - mj * hi / 6.0) * t1)
+
+    # curves with points out of order are treated as piecewise linear
+    for c in np.flatnonzero(~valid):
+        result[c] = np.interp(u, x[c], y[c])
+    return result
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#! /usr/bin/python
+
+# NumPy-only curve interpolation, used to resample the tone curves in an XMP preset.
+
+# This replaces scipy's UnivariateSpline(x, y, s=0, k=min(5, n-1)), i.e. an interpolating B-spline of degree k through all
+# of the points, with the knots placed in the same way as FITPACK does for s=0:
+#   - k+1 knots at each end of the data
+#   - for odd k, the interior knots are the data points x[(k+1)/2 ... n-(k+1)/2-1]
+#   - for even k, the interior knots are the midpoints between those data points
+# Evaluation outside the data range extrapolates using the first/last polynomial piece (same as the scipy default)
+
+# All of the curves of a preset (master and R/G/B, each with its own sample points if need be) are fitted and evaluated in one
+# call, in at most two batches:
+#   - curves with up to maxDegree+1 points have no interior knots, so the spline is just the polynomial through the points.
+#     These (the usual case for presets) are evaluated directly in Lagrange form, with no basis functions or linear solve
+#   - longer curves all have degree maxDegree, and are fitted as B-splines (Cox-de Boor for the basis functions, then a solve)
+# Within a batch the curves are padded to the same number of points, with the padding masked out, so each batch is a fixed
+# number of array operations however many curves there are. Everything that doesn't depend on the curves (the Lagrange masks
+# for each size, the index tables for the recursion) is made once, at import. For arrays this small the cost is mostly the
+# call overhead, so operators and ufunc methods (np.add.reduce etc.) are used rather than np.sum, np.clip, take_along_axis.
+# The results differ from scipy by up to about 2e-7 (on a 0..1 scale), since FITPACK's solve is less accurate than the direct
+# forms used here. benchCurves.py reports the largest difference.
+
+import functools
+
+import numpy as np
+
+
+# highest spline degree (as for UnivariateSpline)
+maxDegree = 5
+
+
+# masks for the Lagrange form (see samplePolynomials): lagrangeMasks[size][n] is the (size, size) mask of the terms left out
+# of the products for a curve of n points padded to size points, i.e. m == j and any j or m in the padding
+def makeLagrangeMasks(size):
+    j = np.arange(size)
+    masks = np.empty((size+1, size, size), dtype=bool)
+    for n in range(size+1):
+        masks[n] = (j[:, np.newaxis] == j) | (j[:, np.newaxis] >= n) | (j >= n)
+    return masks
+
+lagrangeMasks = dict((size, makeLagrangeMasks(size)) for size in range(1, maxDegree+2))
+
+# (np.arange(size), np.eye(size)) for each size of spline fit, made when first needed
+@functools.lru_cache(maxsize=None)
+def identity(size):
+    return (np.arange(size), np.eye(size))
+
+
+# index tables for the Cox-de Boor recursion of degree maxDegree (see basisFunctions). Going from degree j-1 to j
+# (j = 1..k), for each row r = 0..k of the basis:
+#     temp[r] = basis[r] / (right[r] + left[j-1-r])       (r < j, basis[r] is zero for r >= j)
+#     basis[r] = right[r] * temp[r] + left[j-r] * temp[r-1]
+# Entries that aren't used take the row of zeros (k), and the unused denominators are made 1 so they can be inverted
+def makeRecursionTables(k):
+    tables = {}
+    tables["denominatorRight"] = np.array([ [ (r if r < j else k) for r in range(k+1) ] for j in range(1, k+1) ])
+    tables["denominatorLeft"] = np.array([ [ (j-1-r if r < j else k) for r in range(k+1) ] for j in range(1, k+1) ])
+    unused = np.array([ [ (0.0 if r < j else 1.0) for r in range(k+1) ] for j in range(1, k+1) ])
+    tables["unused"] = unused[:, :, np.newaxis, np.newaxis]
+    tables["left"] = np.array([ [ (j-r if 0 <= j-r < k else k) for r in range(k+1) ] for j in range(1, k+1) ])
+    return tables
+
+recursionTables = makeRecursionTables(maxDegree)
+
+
+# ----------------------------
+
+
+# returns the degree used for a curve with 'count' points
+def splineDegree(count):
+    return min(maxDegree, (count-1))
+
+
+# fits and samples a list of curves. curves is a list of (x, y) sequences, grid is the list of x values to evaluate at,
+# either one list for all of the curves or a list of them (one per curve, all the same length), so that curves sampled at
+# different points are still done in one call. Returns an array of shape (len(curves), number of grid points)
+def sampleCurves(curves, grid):
+
+    grid = np.array(grid, dtype=float, ndmin=2)
+    if len(grid) != len(curves):
+        grid = grid.repeat(len(curves), axis=0)
+
+    polynomials = [ i for i, (x, y) in enumerate(curves) if len(x) <= maxDegree + 1 ]
+    splines = [ i for i, (x, y) in enumerate(curves) if len(x) > maxDegree + 1 ]
+    if len(splines) == 0:
+        return samplePolynomials(curves, grid)
+    if len(polynomials) == 0:
+        return sampleSplines(curves, grid)
+
+    result = np.empty(grid.shape)
+    result[polynomials] = samplePolynomials([ curves[i] for i in polynomials ], grid[polynomials])
+    result[splines] = sampleSplines([ curves[i] for i in splines ], grid[splines])
+    return result
+
+
+# ----------------------------
+
+
+# evaluates the polynomials through each of a list of curves (each with at most maxDegree+1 points) at the points u (shape
+# (curves, n)). The Lagrange form: sum over j of y[j] * prod(u - x[m]) / prod(x[j] - x[m]), for m != j. Curves with fewer
+# points than the longest are padded with zeros, and the padding is left out of the products (factor 1), which also makes
+# its weight 0
+def samplePolynomials(curves, u):
+    size = max(len(x) for x, y in curves)
+    x = np.array([ list(cx) + [ 0.0 ] * (size - len(cx)) for cx, cy in curves ], dtype=float)
+    y = np.array([ list(cy) + [ 0.0 ] * (size - len(cy)) for cx, cy in curves ], dtype=float)
+    skip = lagrangeMasks[size][[ len(cx) for cx, cy in curves ]]
+
+    denominators = np.multiply.reduce(np.where(skip, 1.0, x[:, :, np.newaxis] - x[:, np.newaxis, :]), axis=2)
+    if (denominators == 0.0).any():
+        # (repeated x values, the same failure as the linear solve for a spline)
+        raise np.linalg.LinAlgError("Singular matrix")
+
+    # (curves, n, points, points) -> (curves, n, points). At a data point the numerator and denominator are the same product,
+    # so the data points are reproduced exactly
+    differences = (u[:, :, np.newaxis] - x[:, np.newaxis, :])[:, :, np.newaxis, :]
+    numerators = np.multiply.reduce(np.where(skip[:, np.newaxis], 1.0, differences), axis=3)
+    return ((numerators / denominators[:, np.newaxis, :]) @ y[:, :, np.newaxis])[:, :, 0]
+
+
+# fits interpolating splines of degree maxDegree to a list of curves (each with more than maxDegree+1 points) and evaluates
+# them at the points u (shape (curves, n)). Curves with fewer points than the longest are padded: the knots with the last
+# data point (so the spans stop at the end of each curve's own knots) and the fit with identity rows, giving 0 coefficients
+# that no data or sample point uses
+def sampleSplines(curves, u):
+    k = maxDegree
+    size = max(len(x) for x, y in curves)
+    counts = np.array([ len(cx) for cx, cy in curves ])
+    x = np.array([ list(cx) + [ cx[-1] ] * (size - len(cx)) for cx, cy in curves ], dtype=float)
+    y = np.array([ list(cy) + [ 0.0 ] * (size - len(cy)) for cx, cy in curves ], dtype=float)
+    knots = interpolationKnots(x, counts, k)
+
+    # the basis functions at the data points (for the fit) and the sample points are calculated together
+    index, basis = basisFunctions(knots, counts, np.concatenate([ x, u ], axis=1))
+
+    # dense (curves, points, coefficients) matrix, with the rows of the padding replaced by the identity
+    positions, eye = identity(size)
+    matrix = np.add.reduce((index[:, :size, :, np.newaxis] == positions) * basis[:, :size, :, np.newaxis], axis=2)
+    matrix = np.where((positions >= counts[:, np.newaxis])[:, :, np.newaxis], eye, matrix)
+    coeffs = np.linalg.solve(matrix, y[:, :, np.newaxis])[:, :, 0]
+
+    rows = np.arange(len(curves))[:, np.newaxis, np.newaxis]
+    return np.add.reduce(coeffs[rows, index[:, size:]] * basis[:, size:], axis=2)
+
+
+# ----------------------------
+
+
+# knot vectors for interpolating splines of degree k (see above), for the curves in x (shape (curves, points)), where each
+# curve has counts[i] points and is padded with its last point. The knots are padded in the same way
+def interpolationKnots(x, counts, k):
+    ncurves, size = x.shape
+    knots = np.repeat(x[:, -1:], size + k + 1, axis=1)
+    knots[:, :k+1] = x[:, :1]
+    first = k // 2 + 1
+    for i, count in enumerate(counts.tolist()):
+        interior = count - k - 1
+        if interior > 0:
+            if (k % 2) == 1:
+                knots[i, k+1:count] = x[i, first:first+interior]
+            else:
+                knots[i, k+1:count] = 0.5 * (x[i, first:first+interior] + x[i, first-1:first-1+interior])
+    return knots
+
+
+# Returns the indices of the k+1 coefficients that affect each point, and the values of the corresponding (non-zero) basis
+# functions, both with shape (curves, points, k+1), for splines of degree k = maxDegree. knots has shape (curves, n), u has
+# shape (curves, points), and curve i has counts[i] coefficients. This is the Cox-de Boor recursion, with each degree
+# calculated for all of the basis functions at once (see recursionTables)
+def basisFunctions(knots, counts, u):
+    k = maxDegree
+
+    # span i such that knots[i] <= u < knots[i+1], restricted to the valid range so that we extrapolate at the ends
+    span = np.add.reduce(knots[:, np.newaxis, :] <= u[:, :, np.newaxis], axis=2) - 1
+    span = np.maximum(np.minimum(span, (counts - 1)[:, np.newaxis]), k)
+    index = span[..., np.newaxis] + np.arange(-k, 1)
+
+    # knots[span-k+1 .. span+k], then the distances right[r] = knots[span+1+r] - u and left[r] = u - knots[span-r],
+    # r = 0..k-1, each with a row of zeros added (row k). The first axis is the row, so that the rows are cheap to take
+    rows = np.arange(len(knots))[:, np.newaxis, np.newaxis]
+    near = knots[rows, span[..., np.newaxis] + np.arange(1-k, k+1)].transpose(2, 0, 1)
+    right = np.zeros((k+1,) + u.shape)
+    right[:k] = near[k:] - u
+    left = np.zeros((k+1,) + u.shape)
+    left[:k] = u - near[k-1::-1]
+
+    # the reciprocals of the denominators, and the left distances, for every degree (all u dependent values are gathered here
+    # so that each step of the recursion is just three multiplies and an add)
+    inverse = 1.0 / (right[recursionTables["denominatorRight"]] + left[recursionTables["denominatorLeft"]] +
+                     recursionTables["unused"])
+    leftTerms = left[recursionTables["left"]]
+
+    # basis[r] is the function for coefficient span-k+r, zero for the rows above the current degree. temp has an extra zero
+    # row at the start, so temp[:-1] is temp shifted down by one
+    basis = np.zeros((k+1,) + u.shape)
+    basis[0] = 1.0
+    temp = np.zeros((k+2,) + u.shape)
+    for j in range(k):
+        np.multiply(basis, inverse[j], out=temp[1:])
+        basis = right * temp[1:] + leftTerms[j] * temp[:-1]
+
+    return index, basis.transpose(1, 2, 0)
@@ -0,0 +1,184 @@
+#! /usr/bin/python
+
+# Deduplication of filter stages across presets. Many presets in a vendor pack (e.g. the F-StopUrban Grunge variants) share
+# most of their filters exactly, so each filter (stage) and each complete filter list (chain) is given a content hash, and
+# the stages that are used by more than one preset are moved into a shared definitions table, which the presets refer to.
+# The app then only has to parse (and can cache) each distinct stage once.
+
+# Hashes are calculated on the canonical JSON of a filter (sorted map keys, no whitespace, parameter order kept), so they
+# depend only on the content, not on where the filter came from. A chain hash covers the stage hashes, in order.
+
+# A preset that uses the shared table looks like:
+#   { "key": ..., "info": {...}, "chain": "<chain hash>",
+#     "filters": [ { "ref": "<stage hash>" }, { "key": "CIVibrance", "parameters": [...] }, ... ] }
+# i.e. shared stages are replaced by a reference, and stages only used by this preset are left in place.
+# The table (sharedName, written to the top of the output tree by convertXMP.py --dedup) is:
+#   { "version": 1, "stages": { "<stage hash>": { "key": ..., "parameters": [...] }, ... }, "stats": {...} }
+
+# Usage: python dedupFilters.py <preset directory> [--top N]     (reports the duplication in a tree of JSON presets)
+
+import os, os.path
+import sys
+import json
+import hashlib
+import argparse
+
+import presetPack
+
+
+sharedName = "sharedFilters.json"
+sharedVersion = 1
+
+# number of (hex) digits kept from the SHA-1 hashes (64 bits is plenty for a few thousand presets)
+hashLength = 16
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="directory containing the JSON preset files")
+    parser.add_argument("--top", type=int, default=10, help="number of the most shared stages to list")
+    args = parser.parse_args()
+
+    presets = []
+    for root, dirs, files in os.walk(args.input):
+        for f in files:
+            if f.lower().endswith(".json") and (f != sharedName):
+                path = os.path.join(root, f)
+                with open(path, 'r') as inf:
+                    preset = json.load(inf)
+                if isinstance(preset, dict) and ("filters" in preset):
+                    presets.append((os.path.relpath(path, args.input), preset))
+    presets.sort(key=lambda p: p[0])
+
+    table, deduped, stats = dedupPresets(presets)
+    printStats(stats, table, args.top)
+
+
+# ----------------------------
+
+
+def canonicalJSON(value):
+    return json.dumps(value, sort_keys=True, separators=(",", ":"))
+
+
+def stageHash(stage):
+    return hashlib.sha1(canonicalJSON(stage).encode("utf-8")).hexdigest()[:hashLength]
+
+
+def chainHash(stageHashes):
+    return hashlib.sha1(",".join(stageHashes).encode("utf-8")).hexdigest()[:hashLength]
+
+
+# presets is a list of (name, preset map) pairs. Returns the shared table, a list of (name, deduplicated preset) in the same
+# order, and the stats for the report. The input presets are not modified
+def dedupPresets(presets):
+
+    # count the presets using each stage (a stage used twice in the same preset is only shared if another preset uses it)
+    hashes = []
+    users = {}
+    definitions = {}
+    for name, preset in presets:
+        stageHashes = [ stageHash(stage) for stage in preset["filters"] ]
+        hashes.append(stageHashes)
+        for h, stage in zip(stageHashes, preset["filters"]):
+            definitions[h] = stage
+        for h in set(stageHashes):
+            users[h] = users.get(h, 0) + 1
+
+    shared = dict([ (h, definitions[h]) for h, count in users.items() if count > 1 ])
+
+    deduped = []
+    chains = {}
+    for (name, preset), stageHashes in zip(presets, hashes):
+        result = dict(preset)
+        result["chain"] = chainHash(stageHashes)
+        result["filters"] = [ ({ "ref": h } if h in shared else stage) for h, stage in zip(stageHashes, preset["filters"]) ]
+        chains.setdefault(result["chain"], []).append(name)
+        deduped.append((name, result))
+
+    stats = { "stages": { "total": sum(len(h) for h in hashes), "unique": len(definitions), "shared": len(shared),
+                          "references": sum(1 for h in hashes for s in h if s in shared) },
+              "chains": { "total": len(presets), "unique": len(chains) } }
+    table = { "version": sharedVersion, "stages": shared, "stats": stats,
+              "users": dict([ (h, users[h]) for h in shared ]),
+              "duplicates": [ sorted(names) for names in chains.values() if len(names) > 1 ] }
+    return table, deduped, stats
+
+
+# loads the shared table for the presets in a directory, i.e. the nearest sharedName file in the directory or any of its
+# parents. Returns None if there isn't one
+def findTable(directory):
+    directory = os.path.abspath(directory)
+    while True:
+        path = os.path.join(directory, sharedName)
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+# resolves the references in a preset using the shared table, i.e. the reverse of dedupPresets (for tools that read presets).
+# Presets without references are returned as they are
+def resolvePreset(preset, table):
+    if not any("ref" in stage for stage in preset.get("filters", [])):
+        return preset
+    if table is None:
+        raise ValueError("Preset refers to shared filters, but there is no " + sharedName)
+    result = dict(preset)
+    result.pop("chain", None)
+    result["filters"] = [ (table["stages"][stage["ref"]] if "ref" in stage else stage) for stage in preset["filters"] ]
+    return result
+
+
+# generator for the presets under a list of directories (or JSON files): yields (key, preset), where the key is the path
+# relative to the directory without the extension (as in a pack, see presetPack.findJSON). Shared filter references are
+# resolved, and JSON files that aren't presets (e.g. the shared filter table) are skipped
+def readPresets(inputs):
+    for path in inputs:
+        if os.path.isdir(path):
+            fileList = presetPack.findJSON(path)
+        else:
+            fileList = [ (path, os.path.splitext(os.path.basename(path))[0]) ]
+        table = None
+        for f, key in fileList:
+            with open(f, 'r') as inf:
+                preset = json.load(inf)
+            if not isinstance(preset, dict) or ("filters" not in preset):
+                continue
+            if any("ref" in stage for stage in preset["filters"]):
+                if table is None:
+                    table = findTable(os.path.dirname(f))
+                preset = resolvePreset(preset, table)
+            yield (key, preset)
+
+
+# ----------------------------
+
+
+def printStats(stats, table, top=10, out=sys.stdout):
+    stages = stats["stages"]
+    chains = stats["chains"]
+    out.write("Stages: %d total, %d unique, %d shared by more than one preset (%d references)\n"
+              % (stages["total"], stages["unique"], stages["shared"], stages["references"]))
+    out.write("Chains: %d total, %d unique\n" % (chains["total"], chains["unique"]))
+    if top > 0 and len(table["users"]) > 0:
+        out.write("Most shared stages:\n")
+        for h in sorted(table["users"].keys(), key=lambda h: (-table["users"][h], h))[:top]:
+            out.write("    %4d x %s %s\n" % (table["users"][h], h, table["stages"][h].get("key", "")))
+        for names in sorted(table["duplicates"]):
+            out.write("Identical filters: " + ", ".join(names) + "\n")
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
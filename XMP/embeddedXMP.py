@@ -0,0 +1,306 @@
+#! /usr/bin/python
+
+# Finds the XMP packet embedded in an image file (JPEG, TIFF or DNG), so that edits saved inside photos can be converted
+# in the same way as .xmp sidecar files (see convertXMP.py, which uses this for image files).
+
+# The file is memory-mapped and only the structure of the file is read: the JPEG segment markers (up to the start of the
+# image data), or the TIFF directory entries. So only the pages holding the headers and the packet itself are actually
+# read from the disk, however large the image is, and only the packet is copied. Other formats (and files where the packet
+# isn't where it should be) fall back to searching the mapped file for the <x:xmpmeta> element.
+
+# JPEG: the packet is in an APP1 segment that starts with "http://ns.adobe.com/xap/1.0/\0". Packets too big for one segment
+#       (64KB) are split into a main packet plus "extended XMP" (APP1 segments starting "http://ns.adobe.com/xmp/extension/\0",
+#       followed by a 32 character GUID, the full length and the offset of the chunk), which is returned as a second packet.
+# TIFF/DNG: the packet is the value of tag 700 (XMLPacket), normally in the first directory (IFD). BigTIFF is supported too.
+
+# Usage:
+#   python embeddedXMP.py extract <image file> [<xmp file>]          print (or save) the packet
+#   python embeddedXMP.py bench <directory> [--repeat N]               time the scanner over the image files in a directory
+#   python embeddedXMP.py make <xmp file> <directory> [--count N] [--size MB]
+#                                                                      make test images (JPEG and TIFF) of the given size
+
+import os, os.path
+import sys
+import time
+import mmap
+import struct
+import random
+import argparse
+
+
+imageExtensions = [ ".jpg", ".jpeg", ".tif", ".tiff", ".dng" ]
+
+XMP_SIGNATURE = b"http://ns.adobe.com/xap/1.0/\x00"
+EXTENSION_SIGNATURE = b"http://ns.adobe.com/xmp/extension/\x00"
+
+TAG_XMP = 700
+
+# JPEG markers
+SOI = 0xD8
+EOI = 0xD9
+SOS = 0xDA
+APP1 = 0xE1
+
+# sizes of the TIFF field types (for working out whether a value fits in the entry itself)
+tiffTypeSizes = { 1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 16: 8, 17: 8, 18: 8 }
+
+# limit on the number of directories followed in a TIFF file (protects against loops in damaged files)
+maxDirectories = 64
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    extract = commands.add_parser("extract", help="print (or save) the XMP packet from an image")
+    extract.add_argument("image", help="image file")
+    extract.add_argument("output", nargs="?", help="file to save the packet to (default: print it)")
+
+    bench = commands.add_parser("bench", help="time the scanner over the image files in a directory")
+    bench.add_argument("input", help="directory containing the image files")
+    bench.add_argument("--repeat", type=int, default=5, help="number of passes over the files (the best is used)")
+
+    make = commands.add_parser("make", help="make test images containing an XMP file")
+    make.add_argument("xmp", help="XMP file to embed")
+    make.add_argument("output", help="directory for the images")
+    make.add_argument("--count", type=int, default=10, help="number of images of each type")
+    make.add_argument("--size", type=float, default=20.0, help="size of each image (MB)")
+
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        packets = extractPackets(args.image)
+        if len(packets) == 0:
+            print("ERROR: no XMP found in " + args.image)
+            sys.exit(1)
+        if args.output is not None:
+            with open(args.output, 'wb') as f:
+                f.write(packets[0])
+            print("Saved to: " + args.output)
+        else:
+            for packet in packets:
+                sys.stdout.write(packet.decode("utf-8", "replace") + "\n")
+
+    elif args.command == "bench":
+        benchmark(args.input, args.repeat)
+
+    elif args.command == "make":
+        with open(args.xmp, 'rb') as f:
+            packet = f.read()
+        makeImages(packet, args.output, args.count, int(args.size * 1024 * 1024))
+
+
+# ----------------------------
+
+
+def isImage(path):
+    return os.path.splitext(path)[1].lower() in imageExtensions
+
+
+# returns the XMP packets (as bytes) embedded in an image file: the main packet followed by any extended XMP.
+# The list is empty if the file doesn't contain any XMP
+def extractPackets(path):
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # (empty file)
+            return []
+    try:
+        return dataPackets(data)
+    finally:
+        data.close()
+
+
+# returns the XMP packets in the contents of an image file (an mmap, or bytes, e.g. for a file read from a zip archive)
+def dataPackets(data):
+    packets = []
+    if data[:2] == b"\xff\xd8":
+        packets = jpegPackets(data)
+    elif data[:4] in (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+"):
+        packets = tiffPackets(data)
+    if len(packets) == 0:
+        packets = findPacket(data)
+    return packets
+
+
+# walks the JPEG segments (up to the start of the image data)
+def jpegPackets(data):
+    packets = []
+    extended = {} # GUID -> (full length, [(offset, chunk)])
+    pos = 2
+    size = len(data)
+    while pos + 4 <= size:
+        if data[pos] != 0xFF:
+            break # not a marker, so the structure is damaged (findPacket will have a go)
+        marker = data[pos+1]
+        if marker == 0xFF: # fill byte
+            pos = pos + 1
+            continue
+        if (marker == SOI) or (0xD0 <= marker <= 0xD7) or (marker == 0x01):
+            pos = pos + 2 # markers without a length
+            continue
+        if (marker == SOS) or (marker == EOI):
+            break # the rest is image data
+        length = struct.unpack_from(">H", data, pos + 2)[0]
+        start = pos + 4
+        end = pos + 2 + length
+        if marker == APP1:
+            if data[start:start+len(XMP_SIGNATURE)] == XMP_SIGNATURE:
+                packets.append(data[start+len(XMP_SIGNATURE):end])
+            elif data[start:start+len(EXTENSION_SIGNATURE)] == EXTENSION_SIGNATURE:
+                header = start + len(EXTENSION_SIGNATURE)
+                guid = data[header:header+32]
+                fullLength, offset = struct.unpack_from(">II", data, header + 32)
+                entry = extended.setdefault(guid, (fullLength, []))
+                entry[1].append((offset, data[header+40:end]))
+        pos = end
+
+    # assemble the extended XMP (the main packet names the GUID of the extension it uses, if there is more than one)
+    if (len(packets) > 0) and (len(extended) > 0):
+        guids = [ guid for guid in extended.keys() if guid in packets[0] ] or list(extended.keys())
+        fullLength, chunks = extended[guids[0]]
+        packet = bytearray(fullLength)
+        for offset, chunk in chunks:
+            packet[offset:offset+len(chunk)] = chunk
+        packets.append(bytes(packet))
+    return packets
+
+
+# walks the TIFF directories (IFDs), looking for the XMP tag
+def tiffPackets(data):
+    order = "<" if data[:2] == b"II" else ">"
+    big = struct.unpack_from(order + "H", data, 2)[0] == 43
+    if big:
+        # BigTIFF: 8 byte offsets and counts, 20 byte entries
+        offset = struct.unpack_from(order + "Q", data, 8)[0]
+        countFormat, entryFormat, nextFormat = order + "Q", order + "HHQQ", order + "Q"
+    else:
+        offset = struct.unpack_from(order + "I", data, 4)[0]
+        countFormat, entryFormat, nextFormat = order + "H", order + "HHII", order + "I"
+    countSize = struct.calcsize(countFormat)
+    entrySize = struct.calcsize(entryFormat)
+    valueSize = struct.calcsize(nextFormat)
+
+    seen = set()
+    while (offset != 0) and (offset not in seen) and (len(seen) < maxDirectories) and (offset + countSize <= len(data)):
+        seen.add(offset)
+        count = struct.unpack_from(countFormat, data, offset)[0]
+        entries = offset + countSize
+        if entries + (count * entrySize) + valueSize > len(data):
+            break
+        for i in range(count):
+            tag, fieldType, length, value = struct.unpack_from(entryFormat, data, entries + (i * entrySize))
+            if tag == TAG_XMP:
+                length = length * tiffTypeSizes.get(fieldType, 1)
+                if length <= valueSize:
+                    start = entries + (i * entrySize) + (entrySize - valueSize) # (value is in the entry itself)
+                else:
+                    start = value
+                if start + length <= len(data):
+                    return [ data[start:start+length] ]
+        offset = struct.unpack_from(nextFormat, data, entries + (count * entrySize))[0]
+    return []
+
+
+# searches for the <x:xmpmeta> element (for other formats, or if the structure couldn't be followed)
+def findPacket(data):
+    start = data.find(b"<x:xmpmeta")
+    if start < 0:
+        return []
+    end = data.find(b"</x:xmpmeta>", start)
+    if end < 0:
+        return []
+    return [ data[start:end+len(b"</x:xmpmeta>")] ]
+
+
+# ----------------------------
+
+
+def findImages(directory):
+    fileList = []
+    for root, dirs, files in os.walk(directory):
+        for f in files:
+            if isImage(f):
+                fileList.append(os.path.join(root, f))
+    fileList.sort()
+    return fileList
+
+
+# times the scanner against reading each file and searching the contents (the simple alternative)
+def benchmark(directory, repeat):
+    fileList = findImages(directory)
+    if len(fileList) == 0:
+        print("ERROR: no image files found in " + directory)
+        sys.exit(1)
+    total = sum(os.path.getsize(f) for f in fileList)
+    print("Files: %d (%.1f MB)" % (len(fileList), total / (1024.0 * 1024.0)))
+
+    missing = [ f for f in fileList if len(extractPackets(f)) == 0 ]
+    for f in missing:
+        print("No XMP: " + f)
+
+    for name, scan in [ ("mmap scan", extractPackets), ("read+find", readAndFind) ]:
+        best = None
+        for i in range(max(1, repeat)):
+            start = time.time()
+            for f in fileList:
+                scan(f)
+            elapsed = time.time() - start
+            if (best is None) or (elapsed < best):
+                best = elapsed
+        print("%-10s %10.3f ms/file  %10.1f MB/s" % (name, 1000.0 * best / len(fileList), total / (1024.0 * 1024.0) / best))
+
+    if len(missing) > 0:
+        sys.exit(1)
+
+
+def readAndFind(path):
+    with open(path, 'rb') as f:
+        return findPacket(f.read())
+
+
+# makes test images of (about) the given size: JPEG files with the packet in an APP1 segment before the (random) image data,
+# and TIFF files with the image data first and the packet at the end of the file (as DNG files often have it)
+def makeImages(packet, directory, count, size):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    rng = random.Random(1)
+    segment = XMP_SIGNATURE + packet
+    if len(segment) + 2 > 0xFFFF:
+        print("ERROR: XMP packet too big for a single JPEG segment")
+        sys.exit(1)
+    for i in range(count):
+        # (0xFF bytes are followed by a 0 in entropy coded data, so remove them from the random data)
+        image = bytes(rng.getrandbits(8) for j in range(4096)).replace(b"\xff", b"\x00") * max(1, size // 4096)
+
+        path = os.path.join(directory, "test%03d.jpg" % i)
+        with open(path, 'wb') as f:
+            f.write(b"\xff\xd8")
+            f.write(b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00")
+            f.write(b"\xff\xe1" + struct.pack(">H", len(segment) + 2) + segment)
+            f.write(b"\xff\xda" + struct.pack(">H", 8) + b"\x01\x01\x00\x00\x3f\x00")
+            f.write(image)
+            f.write(b"\xff\xd9")
+
+        # little-endian TIFF: header, image data, then one IFD with (just) the XMP tag, then the packet
+        path = os.path.join(directory, "test%03d.tif" % i)
+        ifd = 8 + len(image)
+        with open(path, 'wb') as f:
+            f.write(b"II*\x00" + struct.pack("<I", ifd))
+            f.write(image)
+            f.write(struct.pack("<H", 1) + struct.pack("<HHII", TAG_XMP, 1, len(packet), ifd + 2 + 12 + 4) + struct.pack("<I", 0))
+            f.write(packet)
+    print("Saved %d images to: %s" % (2 * count, directory))
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
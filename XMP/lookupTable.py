@@ -0,0 +1,388 @@
+#! /usr/bin/python
+
+# Colour lookup tables: replaces a run of 'pointwise' colour filters in a preset (filters where each output pixel only depends
+# on the same input pixel, e.g. white balance, exposure, contrast, saturation, tone curves, HSV and split toning) with a single
+# lookup filter (YUCIColorLookup), so that the whole run is one texture lookup in the app instead of a separate pass per filter.
+
+# The lookup image uses the same layout as the app's lookup filters (see Images/Lookups/lookup.jpg and YUCIColorLookup.cikernel):
+# a 512x512 image made up of 8x8 tiles of 64x64 pixels. Tile number b (left to right, top to bottom) holds blue level b, and
+# within a tile x is the red level and y (downwards) the green level, i.e. a 64x64x64 table (the app interpolates between entries).
+# Images are written as PNG, since JPEG compression would change the table values.
+
+# Filters that aren't pointwise (sharpening, noise reduction, clarity, vignette etc.) are left in place, so a preset with spatial
+# filters becomes lookup(s) for the runs of pointwise filters, plus the remaining spatial filters in their original order.
+# Only runs of 2 or more filters are baked (a lookup is still one pass, so replacing a single filter gains nothing).
+
+# The filters are evaluated with NumPy using models of what they do in the app: the affine/curve models from optimizeChain.py,
+# plus ports of the MultiBandHSV and SplitToningFilter kernels and a white point adaptation for WhiteBalanceFilter (this one is
+# an approximation of CITemperatureAndTint). As in optimizeChain.py, values are not clamped between filters.
+
+# Usage:
+#   python lookupTable.py <preset JSON file> <output directory>    writes the baked preset and its lookup image(s)
+# (convertXMP.py can also bake the presets as they are converted, see --lut)
+
+import os, os.path
+import json
+import struct
+import zlib
+import colorsys
+import functools
+import argparse
+
+import numpy as np
+
+import optimizeChain
+
+
+# size of the lookup table (entries per channel), and the number of tiles per row in the image
+lutSize = 64
+lutTiles = 8
+lutImageSize = lutSize * lutTiles
+
+# number of samples used to tabulate tone curves (evaluating the splines directly for every table entry is much slower)
+curveSamples = 4096
+
+lookupFilterName = "YUCIColorLookup"
+lookupExtension = ".png"
+
+# filters that can be baked into a lookup table (other than the affine/curve filters handled by optimizeChain)
+pointwiseFilters = [ "WhiteBalanceFilter", "MultiBandHSV", "SplitToningFilter" ]
+
+# MultiBandHSV bands, in hue order, with the (RGB) reference colours used to define the band hues in the app
+hsvBands = [ ("Red", (0.901961, 0.270588, 0.270588)),
+             ("Orange", (0.901961, 0.584314, 0.270588)),
+             ("Yellow", (0.901961, 0.901961, 0.270588)),
+             ("Green", (0.270588, 0.901961, 0.270588)),
+             ("Aqua", (0.270588, 0.901961, 0.901961)),
+             ("Blue", (0.270588, 0.270588, 0.901961)),
+             ("Purple", (0.584314, 0.270588, 0.901961)),
+             ("Magenta", (0.901961, 0.270588, 0.901961)) ]
+
+# linear sRGB <-> XYZ, and the Bradford cone response matrix (for WhiteBalanceFilter)
+rgbToXYZ = np.array([ [ 0.4124564, 0.3575761, 0.1804375 ],
+                      [ 0.2126729, 0.7151522, 0.0721750 ],
+                      [ 0.0193339, 0.1191920, 0.9503041 ] ])
+xyzToRGB = np.linalg.inv(rgbToXYZ)
+bradford = np.array([ [ 0.8951, 0.2664, -0.1614 ],
+                      [ -0.7502, 1.7135, 0.0367 ],
+                      [ 0.0389, -0.0685, 1.0296 ] ])
+
+# neutral that WhiteBalanceFilter adapts to (temperature, tint)
+targetNeutral = (6500.0, 0.0)
+
+# range of colour temperatures covered by the white balance model
+minTemperature = 1667.0
+maxTemperature = 25000.0
+
+# tint scale, as in the DNG SDK: tint is the distance from the Planckian locus (in CIE 1960 uv) times this
+tintScale = -3000.0
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="JSON preset file")
+    parser.add_argument("output", help="directory for the baked preset and the lookup image(s)")
+    args = parser.parse_args()
+
+    with open(args.input, 'r') as f:
+        preset = json.load(f)
+
+    name = os.path.splitext(os.path.basename(args.input))[0]
+    filters, lookups, notes = bakeFilters(preset["filters"], name)
+    for note in notes:
+        print(note)
+    preset["filters"] = filters
+
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    for imageName, data in lookups:
+        with open(os.path.join(args.output, imageName), 'wb') as f:
+            f.write(data)
+        print("Saved to: " + os.path.join(args.output, imageName))
+    dst = os.path.join(args.output, os.path.basename(args.input))
+    with open(dst, 'w') as f:
+        f.write(json.dumps(preset, indent=2))
+    print("Saved to: " + dst)
+
+
+# ----------------------------
+
+
+# replaces the runs of pointwise filters with lookup filters. name is used to build the names of the lookup images
+# (<name>_lut.png, <name>_lut2.png...), which must be unique within the app.
+# Returns the new filter list, a list of (image name, PNG data) and a list of messages describing the changes
+def bakeFilters(filters, name):
+
+    result = []
+    lookups = []
+    notes = []
+    run = []
+    for f in filters + [ None ]:
+        if (f is not None) and isPointwise(f):
+            run.append(f)
+            continue
+        if len(run) > 1:
+            imageName = name + "_lut" + (str(len(lookups) + 1) if len(lookups) > 0 else "") + lookupExtension
+            pixels = lookupImage(run)
+            lookups.append((imageName, encodePNG(pixels)))
+            result.append(lookupFilter(imageName))
+            notes.append("baked " + " + ".join([ r["key"] for r in run ]) + " -> " + imageName +
+                         " (max error %.1f/255)" % (lookupError(pixels, run) * 255.0))
+        else:
+            result.extend(run)
+        run = []
+        if f is not None:
+            result.append(f)
+
+    return result, lookups, notes
+
+
+def isPointwise(f):
+    return optimizeChain.isModelled(f) or (f["key"] in pointwiseFilters)
+
+
+# the preset entry for a lookup filter. The image is loaded from the app bundle by name
+def lookupFilter(imageName):
+    return { 'key':lookupFilterName, "parameters":[ { 'key':"inputColorLookupTable", 'val': imageName, 'type': "CIAttributeTypeImage"},
+                                                    { 'key':"inputIntensity", 'val': 1.0, 'type': "CIAttributeTypeScalar"} ] }
+
+
+# ----------------------------
+
+
+# the colours of the lookup image pixels (shape (512*512, 3)), in row order. (Cached, so it must not be modified)
+@functools.lru_cache(maxsize=None)
+def lookupColours():
+    levels = np.arange(lutImageSize) % lutSize
+    tiles = np.arange(lutImageSize) // lutSize
+    y, x = np.meshgrid(np.arange(lutImageSize), np.arange(lutImageSize), indexing="ij")
+    r = levels[x]
+    g = levels[y]
+    b = (tiles[y] * lutTiles) + tiles[x]
+    return np.stack([ r.ravel(), g.ravel(), b.ravel() ], axis=1) / float(lutSize - 1)
+
+
+# evaluates a list of pointwise filters over the whole table, returns the lookup image (shape (512, 512, 3), uint8)
+def lookupImage(filters):
+    colours = applyFilters(filters, lookupColours())
+    pixels = np.round(np.clip(colours, 0.0, 1.0) * 255.0).astype(np.uint8)
+    return pixels.reshape((lutImageSize, lutImageSize, 3))
+
+
+# looks up colours (shape (n, 3), 0..1) in a lookup image in the same way as the app (YUCIColorLookup.cikernel), i.e. bilinear
+# within the red/green tile and linear between the two nearest blue tiles. Used to check a table against the filters it replaces
+def applyLookup(pixels, colours):
+    table = pixels.astype(float) / 255.0
+    colours = np.clip(np.asarray(colours, dtype=float), 0.0, 1.0)
+    scaled = colours * (lutSize - 1)
+    blue = scaled[:, 2]
+    low = np.floor(blue).astype(int)
+    high = np.ceil(blue).astype(int)
+
+    def sampleTile(tile):
+        x = ((tile % lutTiles) * lutSize) + scaled[:, 0]
+        y = ((tile // lutTiles) * lutSize) + scaled[:, 1]
+        x0 = np.floor(x).astype(int)
+        y0 = np.floor(y).astype(int)
+        x1 = np.minimum(x0 + 1, lutImageSize - 1)
+        y1 = np.minimum(y0 + 1, lutImageSize - 1)
+        fx = (x - x0)[:, np.newaxis]
+        fy = (y - y0)[:, np.newaxis]
+        top = (table[y0, x0] * (1.0 - fx)) + (table[y0, x1] * fx)
+        bottom = (table[y1, x0] * (1.0 - fx)) + (table[y1, x1] * fx)
+        return (top * (1.0 - fy)) + (bottom * fy)
+
+    f = (blue - low)[:, np.newaxis]
+    return (sampleTile(low) * (1.0 - f)) + (sampleTile(high) * f)
+
+
+# max difference (0..1) between a lookup image and the filters it was made from, over a fixed set of test colours.
+# Note that this can be large even for a good table: MultiBandHSV changes abruptly between bands for colours close to grey
+# (and so do steep curves), which no table can follow exactly
+def lookupError(pixels, filters):
+    colours = np.random.RandomState(0).random_sample((4096, 3))
+    return float(np.max(np.abs(applyLookup(pixels, colours) - np.clip(applyFilters(filters, colours), 0.0, 1.0))))
+
+
+# encodes an (h, w, 3) uint8 image as PNG (so that the standard library is all that is needed)
+def encodePNG(pixels):
+    height, width = pixels.shape[:2]
+    raw = b"".join([ b"\x00" + pixels[row].tobytes() for row in range(height) ]) # filter type 0 (none) for each row
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(raw, 9)) +
+            chunk(b"IEND", b""))
+
+
+# ----------------------------
+
+
+# applies a list of pointwise filters to an array of colours (shape (n, 3))
+def applyFilters(filters, colours):
+    colours = np.asarray(colours, dtype=float)
+    for f in filters:
+        if optimizeChain.isCurve(f):
+            colours = np.stack([ curveTable(x, y, colours[:, c]) for c, (x, y) in enumerate(optimizeChain.curvePoints(f)) ], axis=1)
+        elif optimizeChain.isModelled(f):
+            colours = optimizeChain.applyRun([ f ], colours)
+        elif f["key"] == "WhiteBalanceFilter":
+            m = whiteBalanceMatrix(optimizeChain.param(f, "inputTemperature", targetNeutral[0]),
+                                   optimizeChain.param(f, "inputTint", targetNeutral[1]))
+            colours = np.dot(colours, m.T)
+        elif f["key"] == "MultiBandHSV":
+            colours = multiBandHSV(f, colours)
+        elif f["key"] == "SplitToningFilter":
+            colours = splitToning(f, colours)
+        else:
+            raise ValueError("Not a pointwise filter: " + f["key"])
+    return colours
+
+
+# evaluates a tone curve at u, using linear interpolation between closely spaced samples of the curve
+# (outside the range of the points the curve is flat, as in optimizeChain.evaluateCurve)
+def curveTable(x, y, u):
+    samples = np.linspace(x[0], x[-1], curveSamples)
+    return np.interp(u, samples, optimizeChain.evaluateCurve(x, y, samples))
+
+
+# WhiteBalanceFilter: CITemperatureAndTint with the given neutral and a target of 6500K, no tint.
+# Modelled as a Bradford adaptation (in linear sRGB) from the white point of the neutral to that of the target
+def whiteBalanceMatrix(temperature, tint):
+    source = np.dot(bradford, neutralXYZ(temperature, tint))
+    target = np.dot(bradford, neutralXYZ(targetNeutral[0], targetNeutral[1]))
+    adapt = np.dot(np.linalg.inv(bradford), np.dot(np.diag(target / source), bradford))
+    return np.dot(xyzToRGB, np.dot(adapt, rgbToXYZ))
+
+
+# XYZ (Y = 1) of the white point for a colour temperature and tint
+def neutralXYZ(temperature, tint):
+    temperature = min(max(float(temperature), minTemperature), maxTemperature - 1.0)
+    u, v = planckianUV(temperature)
+
+    # tint moves the white point at right angles to the locus
+    u1, v1 = planckianUV(temperature + 1.0)
+    du = u1 - u
+    dv = v1 - v
+    length = np.hypot(du, dv)
+    offset = tint / tintScale
+    u = u - (dv / length) * offset
+    v = v + (du / length) * offset
+
+    x = (3.0 * u) / ((2.0 * u) - (8.0 * v) + 4.0)
+    y = (2.0 * v) / ((2.0 * u) - (8.0 * v) + 4.0)
+    return np.array([ x / y, 1.0, (1.0 - x - y) / y ])
+
+
+# CIE 1960 uv of the Planckian locus (Kim et al. cubic approximation, 1667K to 25000K)
+def planckianUV(temperature):
+    t = min(max(float(temperature), minTemperature), maxTemperature)
+    if t <= 4000.0:
+        x = (-0.2661239e9 / t**3) - (0.2343589e6 / t**2) + (0.8776956e3 / t) + 0.179910
+    else:
+        x = (-3.0258469e9 / t**3) + (2.1070379e6 / t**2) + (0.2226347e3 / t) + 0.240390
+    if t <= 2222.0:
+        y = (-1.1063814 * x**3) - (1.34811020 * x**2) + (2.18555832 * x) - 0.20219683
+    elif t <= 4000.0:
+        y = (-0.9549476 * x**3) - (1.37418593 * x**2) + (2.09137015 * x) - 0.16748867
+    else:
+        y = (3.0817580 * x**3) - (5.87338670 * x**2) + (3.75112997 * x) - 0.37001483
+    return (4.0 * x) / ((-2.0 * x) + (12.0 * y) + 3.0), (6.0 * y) / ((-2.0 * x) + (12.0 * y) + 3.0)
+
+
+# MultiBandHSV: port of the kernel in MultiBandHSV.swift. Each band has a (hue shift, saturation multiplier, value multiplier),
+# and the shift for a colour is interpolated (smoothstep) between the two bands either side of its hue
+def multiBandHSV(f, colours):
+    edges = [ colorsys.rgb_to_hsv(*rgb)[0] for name, rgb in hsvBands ] + [ 1.0 ]
+    edges[0] = 0.0 # (the first band starts at 0, whatever the hue of the reference colour)
+    shifts = [ np.asarray(optimizeChain.param(f, "input" + name + "Shift", [ 0.0, 1.0, 1.0 ]), dtype=float)
+               for name, rgb in hsvBands ]
+    shifts.append(shifts[0]) # (magenta blends back into red)
+
+    hsv = rgbToHSV(colours)
+    h = hsv[:, 0]
+    band = np.clip(np.searchsorted(np.array(edges[1:-1]), h, side="right"), 0, len(hsvBands) - 1)
+    edge0 = np.array(edges)[band]
+    edge1 = np.array(edges)[band + 1]
+    t = np.clip((h - edge0) / (edge1 - edge0), 0.0, 1.0)
+    smoothed = (t * t * (3.0 - (2.0 * t)))[:, np.newaxis]
+    shift0 = np.array(shifts)[band]
+    shift1 = np.array(shifts)[band + 1]
+    shift = shift0 + ((shift1 - shift0) * smoothed)
+    hsv = np.stack([ h + shift[:, 0], hsv[:, 1] * shift[:, 1], hsv[:, 2] * shift[:, 2] ], axis=1)
+    return hsvToRGB(hsv)
+
+
+# (same as rgb2hsv/hsv2rgb in the MultiBandHSV kernel)
+def rgbToHSV(c):
+    r, g, b = c[:, 0], c[:, 1], c[:, 2]
+
+    # p and q are the vectors of the same name in the kernel, one component at a time
+    gb = g >= b
+    px = np.where(gb, g, b)
+    py = np.where(gb, b, g)
+    pz = np.where(gb, 0.0, -1.0)
+    pw = np.where(gb, -1.0 / 3.0, 2.0 / 3.0)
+    rp = r >= px
+    qx = np.where(rp, r, px)
+    qz = np.where(rp, pz, pw)
+    qw = np.where(rp, px, r)
+    d = qx - np.minimum(qw, py)
+    e = 1.0e-10
+    return np.stack([ np.abs(qz + (qw - py) / ((6.0 * d) + e)), d / (qx + e), qx ], axis=1)
+
+
+def hsvToRGB(c):
+    k = np.array([ 1.0, 2.0 / 3.0, 1.0 / 3.0 ])
+    h = c[:, 0:1]
+    p = np.abs((((h + k) % 1.0) * 6.0) - 3.0)
+    return c[:, 2:3] * (1.0 + ((np.clip(p - 1.0, 0.0, 1.0) - 1.0) * c[:, 1:2]))
+
+
+# SplitToningFilter: CIFalseColor (a ramp from the shadow colour to the highlight colour, indexed by luminance),
+# screen blended over the input. Does nothing if all of the parameters are (close to) zero, as in the app
+def splitToning(f, colours):
+    highlightHue = optimizeChain.param(f, "inputHighlightHue", 0.0)
+    highlightSaturation = optimizeChain.param(f, "inputHighlightSaturation", 0.5)
+    highlightBrightness = optimizeChain.param(f, "inputHighlightBrightness", 0.901961)
+    shadowHue = optimizeChain.param(f, "inputShadowHue", 0.1)
+    shadowSaturation = optimizeChain.param(f, "inputShadowSaturation", 0.5)
+    shadowBrightness = optimizeChain.param(f, "inputShadowBrightness", 0.270588)
+    if (abs(shadowHue) + abs(shadowSaturation) + abs(highlightHue) + abs(highlightSaturation)) <= 0.001:
+        return colours
+
+    shadow = hsvColour(shadowHue, shadowSaturation, shadowBrightness)
+    highlight = hsvColour(highlightHue, highlightSaturation, highlightBrightness)
+    luma = np.clip(np.dot(colours, optimizeChain.lumaWeights), 0.0, 1.0)[:, np.newaxis]
+    false = shadow + ((highlight - shadow) * luma)
+    return 1.0 - ((1.0 - false) * (1.0 - colours))
+
+
+# (same as CIColor(h:s:v:) in CIColor+Extensions.swift, including the handling of negative hues)
+def hsvColour(h, s, v):
+    if s == 0:
+        return np.array([ v, v, v ])
+    angle = 0.0 if (h * 360.0) >= 360.0 else h * 360.0
+    sector = angle / 60.0
+    i = np.floor(sector)
+    f = sector - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - (s * f))
+    t = v * (1.0 - (s * (1.0 - f)))
+    colours = { 0: (v, t, p), 1: (q, v, p), 2: (p, v, t), 3: (p, q, v), 4: (t, p, v) }
+    return np.array(colours.get(int(i), (v, p, q)))
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
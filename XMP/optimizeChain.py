@@ -0,0 +1,350 @@
+#! /usr/bin/python
+
+# Filter chain optimiser: reduces the number of filters in a converted preset, since each filter in the app is a separate pass
+# over the image (and creating and running a filter takes a lot of memory).
+
+# The filters are split into:
+#   - affine colour filters (CIExposureAdjust, ContrastFilter, SaturationFilter, CIColorControls, CIColorMatrix). Any number of
+#     these in a row is the same as a single colour matrix, so they are combined exactly
+#   - tone curves (CIToneCurve, RGBChannelToneCurve). A curve next to another curve, or next to a per-channel affine filter
+#     (exposure, contrast), can be folded into a single curve, but only approximately because the result has to be expressed
+#     using the same 5 points
+#   - everything else (spatial filters, HSV etc.), which are left alone unless their parameters are exactly the 'no-op' values
+# Runs of adjacent affine/curve filters are simplified using simple models of what those filters do, and each change (merging
+# filters, or dropping a filter that has almost no effect) is only kept if the result of the whole run stays within the
+# tolerance of the original run (max difference of any colour channel, on a 0..1 scale, over a grid of test colours).
+
+# Note: the models assume that all of the filters work on the same (working space) values, with no clamping in between
+
+import numpy as np
+
+
+# default tolerance: half of an 8-bit level
+defaultTolerance = 0.5 / 255.0
+
+# Rec. 709 luma weights, as used by CIColorControls for saturation
+lumaWeights = np.array([0.2126, 0.7152, 0.0722])
+
+affineFilters = [ "CIExposureAdjust", "ContrastFilter", "SaturationFilter", "CIColorControls", "CIColorMatrix" ]
+curveFilters = [ "CIToneCurve", "RGBChannelToneCurve" ]
+
+# parameter values for which other filters have no effect
+identityParameters = {
+    "WhiteBalanceFilter":      { "inputTemperature": 6500.0, "inputTint": 0.0 },
+    "CIVibrance":              { "inputAmount": 0.0 },
+    "ClarityFilter":           { "inputClarity": 0.0 },
+    "CISharpenLuminance":      { "inputSharpness": 0.0 },
+    "CINoiseReduction":        { "inputNoiseLevel": 0.0, "inputSharpness": 0.0 },
+    "CIHighlightShadowAdjust": { "inputShadowAmount": 0.0, "inputHighlightAmount": 1.0 },
+    "FilmGrainFilter":         { "inputAmount": 0.0 },
+    "UnsharpMaskFilter":       { "inputAmount": 0.0 },
+    "CenteredVignetteFilter":  { "inputIntensity": 0.0 },
+    "CIVignetteEffect":        { "inputIntensity": 0.0 },
+}
+
+curveX = [ 0.0, 0.25, 0.5, 0.75, 1.0 ]
+channelNames = [ "Red", "Green", "Blue" ]
+
+
+# ----------------------------
+
+
+# optimises a list of filters (in the preset format). Returns the new list and a list of messages describing the changes
+def optimizeChain(filters, tolerance=defaultTolerance):
+
+    notes = []
+    result = []
+    run = []
+    for f in filters:
+        if isModelled(f):
+            run.append(f)
+            continue
+        result.extend(optimizeRun(run, tolerance, notes))
+        run = []
+        if isIdentity(f):
+            notes.append("dropped " + f["key"] + " (no effect)")
+        else:
+            result.append(f)
+    result.extend(optimizeRun(run, tolerance, notes))
+
+    return result, notes
+
+
+# ----------------------------
+
+
+# simplifies a run of adjacent affine/curve filters. Each candidate change is checked against the original run
+def optimizeRun(run, tolerance, notes):
+
+    if len(run) == 0:
+        return run
+
+    samples = testColours()
+    reference = applyRun(run, samples)
+
+    # affine filters next to each other can always be combined (exactly)
+    current = []
+    for f in run:
+        if (len(current) > 0) and isAffine(current[-1]) and isAffine(f):
+            merged = affineFilter(composeAffine(affineMatrix(f), affineMatrix(current[-1])), [ current[-1], f ])
+            notes.append("fused " + current[-1]["key"] + " + " + f["key"] + " -> " + merged["key"])
+            current[-1] = merged
+        else:
+            current.append(f)
+
+    # then try to drop or fold filters, as long as the result stays within the tolerance
+    changed = True
+    while changed:
+        changed = False
+        for candidate, note in candidates(current):
+            if maxError(applyRun(candidate, samples), reference) <= tolerance:
+                current = candidate
+                notes.append(note)
+                changed = True
+                break
+
+    return current
+
+
+# generator for the possible simplifications of a run: dropping one filter, or folding two adjacent filters into a curve
+def candidates(run):
+    for i, f in enumerate(run):
+        yield (run[:i] + run[i+1:], "dropped " + f["key"] + " (within tolerance)")
+    for i in range(len(run) - 1):
+        a, b = run[i], run[i+1]
+        if (isCurve(a) or isCurve(b)) and isSeparable(a) and isSeparable(b):
+            for points in [ curvePoints(f) for f in (a, b) if isCurve(f) ]:
+                folded = foldCurve([ a, b ], points)
+                yield (run[:i] + [ folded ] + run[i+2:], "fused " + a["key"] + " + " + b["key"] + " -> " + folded["key"])
+
+
+def maxError(a, b):
+    return float(np.max(np.abs(np.clip(a, 0.0, 1.0) - np.clip(b, 0.0, 1.0))))
+
+
+# grid of test colours (all combinations of 9 levels per channel), plus a fine grey ramp
+def testColours():
+    levels = np.linspace(0.0, 1.0, 9)
+    r, g, b = np.meshgrid(levels, levels, levels, indexing="ij")
+    grid = np.stack([ r.ravel(), g.ravel(), b.ravel() ], axis=1)
+    ramp = np.repeat(np.linspace(0.0, 1.0, 256)[:, np.newaxis], 3, axis=1)
+    return np.concatenate([ grid, ramp ])
+
+
+# ----------------------------
+
+
+def param(f, key, default=None):
+    for p in f["parameters"]:
+        if p["key"] == key:
+            return p["val"]
+    return default
+
+
+def isAffine(f):
+    return f["key"] in affineFilters
+
+
+def isCurve(f):
+    return f["key"] in curveFilters
+
+
+def isModelled(f):
+    return isAffine(f) or isCurve(f)
+
+
+# checks whether each output channel only depends on the same input channel (so that the filter can be part of a curve)
+def isSeparable(f):
+    if isCurve(f):
+        return True
+    m = affineMatrix(f)[:, :3]
+    return bool(np.all(np.abs(m - np.diag(np.diag(m))) < 1.0e-12))
+
+
+def isIdentity(f):
+    if f["key"] == "MultiBandHSV":
+        return all(np.allclose(p["val"], [ 0.0, 1.0, 1.0 ]) for p in f["parameters"])
+    if f["key"] == "SplitToningFilter":
+        # the filter itself is skipped if there is almost nothing to apply
+        return sum([ abs(param(f, k, 0.0)) for k in [ "inputHighlightHue", "inputHighlightSaturation", "inputShadowHue",
+                                                      "inputShadowSaturation" ] ]) <= 0.001
+    if f["key"] in identityParameters:
+        for key, value in identityParameters[f["key"]].items():
+            if abs(param(f, key, value) - value) > 1.0e-9:
+                return False
+        return True
+    return False
+
+
+# ----------------------------
+
+# Affine filters are represented as a 3x4 matrix: output = M[:, :3] . rgb + M[:, 3]
+
+
+def affineMatrix(f):
+    m = np.zeros((3, 4))
+    m[:, :3] = np.eye(3)
+
+    if f["key"] == "CIExposureAdjust":
+        m[:, :3] = np.eye(3) * (2.0 ** param(f, "inputEV", 0.0))
+
+    elif f["key"] == "ContrastFilter":
+        m = contrastMatrix(param(f, "inputContrast", 1.0))
+
+    elif f["key"] == "SaturationFilter":
+        m = saturationMatrix(param(f, "inputSaturation", 1.0))
+
+    elif f["key"] == "CIColorControls":
+        # saturation, then brightness, then contrast
+        m = saturationMatrix(param(f, "inputSaturation", 1.0))
+        m[:, 3] = m[:, 3] + param(f, "inputBrightness", 0.0)
+        m = np.dot(contrastMatrix(param(f, "inputContrast", 1.0)), np.vstack([ m, [ 0.0, 0.0, 0.0, 1.0 ] ]))
+
+    elif f["key"] == "CIColorMatrix":
+        for i, name in enumerate([ "inputRVector", "inputGVector", "inputBVector" ]):
+            m[i, :3] = param(f, name, list(np.eye(4)[i]))[:3]
+        m[:, 3] = param(f, "inputBiasVector", [ 0.0, 0.0, 0.0, 0.0 ])[:3]
+
+    return m
+
+
+def contrastMatrix(c):
+    m = np.zeros((3, 4))
+    m[:, :3] = np.eye(3) * c
+    m[:, 3] = 0.5 * (1.0 - c)
+    return m
+
+
+def saturationMatrix(s):
+    m = np.zeros((3, 4))
+    m[:, :3] = (s * np.eye(3)) + ((1.0 - s) * lumaWeights[np.newaxis, :])
+    return m
+
+
+# 4x4 product of two affine matrices, i.e. the effect of applying m1 and then m2 (returned as 3x4)
+def composeAffine(m2, m1):
+    return np.dot(np.vstack([ m2, [ 0.0, 0.0, 0.0, 1.0 ] ]), np.vstack([ m1, [ 0.0, 0.0, 0.0, 1.0 ] ]))[:3]
+
+
+# builds the simplest filter for an affine matrix. sources are the filters being replaced
+def affineFilter(m, sources):
+    m = np.asarray(m)[:3]
+    keys = set([ f["key"] for f in sources ])
+
+    # all exposure -> single exposure
+    if keys == set([ "CIExposureAdjust" ]):
+        ev = sum([ param(f, "inputEV", 0.0) for f in sources ])
+        return { 'key':"CIExposureAdjust", "parameters":[ { 'key':"inputEV", 'val': ev, 'type': "CIAttributeTypeScalar"} ] }
+
+    # contrast/saturation only (these commute, so the order doesn't matter)
+    if keys <= set([ "ContrastFilter", "SaturationFilter", "CIColorControls" ]):
+        if all([ abs(param(f, "inputBrightness", 0.0)) < 1.0e-12 for f in sources ]):
+            contrast = 1.0
+            saturation = 1.0
+            for f in sources:
+                if f["key"] == "ContrastFilter":
+                    contrast = contrast * param(f, "inputContrast", 1.0)
+                elif f["key"] == "SaturationFilter":
+                    saturation = saturation * param(f, "inputSaturation", 1.0)
+                else:
+                    contrast = contrast * param(f, "inputContrast", 1.0)
+                    saturation = saturation * param(f, "inputSaturation", 1.0)
+            if keys == set([ "ContrastFilter" ]):
+                return { 'key':"ContrastFilter", "parameters":[ { 'key':"inputContrast", 'val': contrast, 'type': "CIAttributeTypeScalar"} ] }
+            if keys == set([ "SaturationFilter" ]):
+                return { 'key':"SaturationFilter", "parameters":[ { 'key':"inputSaturation", 'val': saturation, 'type': "CIAttributeTypeScalar"} ] }
+            return { 'key':"CIColorControls", "parameters":[ { 'key':"inputSaturation", 'val': saturation, 'type': "CIAttributeTypeScalar"},
+                                                             { 'key':"inputBrightness", 'val': 0.0, 'type': "CIAttributeTypeScalar"},
+                                                             { 'key':"inputContrast", 'val': contrast, 'type': "CIAttributeTypeScalar"} ] }
+
+    # anything else: general colour matrix
+    return { 'key':"CIColorMatrix", "parameters":[ { 'key':"inputRVector", 'val': [ float(v) for v in m[0, :3] ] + [ 0.0 ], 'type': "CIAttributeTypeVector"},
+                                                   { 'key':"inputGVector", 'val': [ float(v) for v in m[1, :3] ] + [ 0.0 ], 'type': "CIAttributeTypeVector"},
+                                                   { 'key':"inputBVector", 'val': [ float(v) for v in m[2, :3] ] + [ 0.0 ], 'type': "CIAttributeTypeVector"},
+                                                   { 'key':"inputAVector", 'val': [ 0.0, 0.0, 0.0, 1.0 ], 'type': "CIAttributeTypeVector"},
+                                                   { 'key':"inputBiasVector", 'val': [ float(v) for v in m[:, 3] ] + [ 0.0 ], 'type': "CIAttributeTypeVector"} ] }
+
+
+# ----------------------------
+
+# Tone curves are represented as a list of (x values, y values) for each of the red, green and blue channels.
+# The curves are modelled as natural cubic splines through the points, with the input limited to the range of the points
+
+
+def curvePoints(f):
+    if f["key"] == "CIToneCurve":
+        points = [ param(f, "inputPoint" + str(i)) for i in range(5) ]
+        x = [ p[0] for p in points ]
+        y = [ p[1] for p in points ]
+        return [ (x, y), (x, y), (x, y) ]
+    return [ (param(f, "input" + c + "Xvalues", curveX), param(f, "input" + c + "Yvalues", curveX)) for c in channelNames ]
+
+
+# evaluates the natural cubic spline through the points (x, y) at u
+def evaluateCurve(x, y, u):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    h = np.diff(x)
+    if np.any(h <= 0.0):
+        # not a valid curve (points not in order), treat as piecewise linear
+        return np.interp(u, x, y)
+
+    # second derivatives (zero at the ends)
+    a = np.zeros((n, n))
+    r = np.zeros(n)
+    a[0, 0] = 1.0
+    a[n-1, n-1] = 1.0
+    for i in range(1, n-1):
+        a[i, i-1] = h[i-1]
+        a[i, i] = 2.0 * (h[i-1] + h[i])
+        a[i, i+1] = h[i]
+        r[i] = 6.0 * (((y[i+1] - y[i]) / h[i]) - ((y[i] - y[i-1]) / h[i-1]))
+    m = np.linalg.solve(a, r)
+
+    u = np.clip(u, x[0], x[-1])
+    i = np.clip(np.searchsorted(x, u, side="right") - 1, 0, n-2)
+    t0 = x[i+1] - u
+    t1 = u - x[i]
+    return ((m[i] * t0**3 + m[i+1] * t1**3) / (6.0 * h[i]) +
+            (y[i] / h[i] - m[i] * h[i] / 6.0) * t0 + (y[i+1] / h[i] - m[i+1] * h[i] / 6.0) * t1)
+
+
+# replaces a pair of (separable) filters with a single curve through the given points
+def foldCurve(pair, points):
+    # input colours are the curve x values for each channel, so output channel c gives the new y values for channel c
+    x = np.array([ p[0] for p in points ], dtype=float).T
+    out = applyRun(pair, x)
+    curves = []
+    for c in range(3):
+        values = [ float(v) for v in np.clip(out[:, c], 0.0, 1.0) ]
+        values = [ (0.0 if v < 0.001 else v) for v in values ] # small numbers cause issues with JSON
+        curves.append(([ float(v) for v in points[c][0] ], values))
+    return curveFilter(curves)
+
+
+def curveFilter(curves):
+    if (curves[0] == curves[1]) and (curves[0] == curves[2]):
+        x, y = curves[0]
+        return { 'key':"CIToneCurve", "parameters":[ { 'key':"inputPoint" + str(i), 'val': [ x[i], y[i] ], 'type': "CIAttributeTypeOffset"}
+                                                     for i in range(len(x)) ] }
+    parameters = []
+    for c, (x, y) in zip(channelNames, curves):
+        parameters.append({ 'key':"input" + c + "Xvalues", 'val': x, 'type': "CIAttributeTypeVector"})
+        parameters.append({ 'key':"input" + c + "Yvalues", 'val': y, 'type': "CIAttributeTypeVector"})
+    return { 'key':"RGBChannelToneCurve", "parameters":parameters }
+
+
+# ----------------------------
+
+
+# applies a run of affine/curve filters to an array of colours (shape (n, 3))
+def applyRun(run, colours):
+    colours = np.asarray(colours, dtype=float)
+    for f in run:
+        if isAffine(f):
+            m = affineMatrix(f)
+            colours = np.dot(colours, m[:, :3].T) + m[:, 3]
+        else:
+            colours = np.stack([ evaluateCurve(x, y, colours[:, c]) for c, (x, y) in enumerate(curvePoints(f)) ], axis=1)
+    return colours
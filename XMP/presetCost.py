@@ -0,0 +1,172 @@
+#! /usr/bin/python
+
+# Estimated GPU cost of a preset, so that expensive presets can be kept off the live preview path (the "slow" flag of the
+# preset entries in defaultConfig.json). The unit is one pointwise pass over the image, i.e. one colour kernel that reads
+# one pixel and writes one pixel. The cost of each filter is based on what it does in the app (phixer/Filters):
+#   - pointwise filters are one pass, or a few if the app chains several (e.g. RGBChannelToneCurve is three tone curves
+#     and a compositing pass, SplitToningFilter is a false colour and a blend)
+#   - spatial filters read a neighbourhood of each pixel, so they cost more, and blurs get more expensive with the radius.
+#     ClarityFilter is a vibrance pass, an unsharp mask with a radius of 50, an opacity pass and a blend
+#   - AutoAdjustFilter analyses the whole image (on every render) before applying the filters it picks
+#   - filters that the app skips for the given parameters (e.g. very light film grain) cost nothing
+# A preset's cost is the sum of the costs of its filters, and it is "spatial" if any of its filters are spatial (a pointwise
+# preset can be applied to a preview at any size, or tile by tile, with the same result), "pointwise" otherwise.
+#
+# In batch mode each converted preset gets { "cost": { "estimate": <cost>, "class": "pointwise" | "spatial" } }, and
+# convertXMP.py --config writes the preset entries for defaultConfig.json, with "slow": true for the presets that cost
+# more than slowThreshold.
+
+# Usage: python presetCost.py <preset directory> [...] [--threshold N] [--config file]
+#        (lists the cost of each preset, most expensive first, and optionally writes the config entries)
+
+import re
+import json
+import argparse
+
+import dedupFilters
+
+
+# presets with an estimated cost above this are marked as slow
+slowThreshold = 15.0
+
+# the classes of filter
+POINTWISE = "pointwise"
+SPATIAL = "spatial"
+
+
+# cost of a Gaussian blur (as used by the unsharp masks): two separable passes, with the number of samples growing with the radius
+def blurCost(radius):
+    return 2.0 + 0.1 * max(radius, 0.0)
+
+
+def grainCost(params):
+    # FilmGrainFilter returns the input unchanged unless both amount and size are above 0.01. Otherwise it is a noise
+    # generator, a colour matrix, a scatter (spatial), brightness, 2 opacity passes and the final blend
+    if (params.get("inputAmount", 0.5) <= 0.01) or (params.get("inputSize", 0.5) <= 0.01):
+        return 0.0
+    return 8.0
+
+
+# filter key -> (class, cost). The cost is either a number or a function of the parameters (a map of key -> value)
+filterCosts = {
+    "WhiteBalanceFilter":      (POINTWISE, 1.0),
+    "CIExposureAdjust":        (POINTWISE, 1.0),
+    "ContrastFilter":          (POINTWISE, 1.0),
+    "SaturationFilter":        (POINTWISE, 1.0),
+    "CIVibrance":              (POINTWISE, 1.0),
+    "CIColorControls":         (POINTWISE, 1.0),
+    "CIColorMatrix":           (POINTWISE, 1.0),
+    "CIToneCurve":             (POINTWISE, 1.0),
+    "RGBChannelToneCurve":     (POINTWISE, 4.0),
+    "MultiBandHSV":            (POINTWISE, 2.0),  # one kernel, but with 8 bands of HSV maths per pixel
+    "SplitToningFilter":       (POINTWISE, 2.0),
+    "CenteredVignetteFilter":  (POINTWISE, 1.0),  # depends on the position of the pixel, but not on its neighbours
+    "YUCIColorLookup":         (POINTWISE, 1.5),  # 3D lookup (two texture reads and a blend)
+    "CISharpenLuminance":      (SPATIAL, 2.0),
+    "CINoiseReduction":        (SPATIAL, 4.0),
+    "CIHighlightShadowAdjust": (SPATIAL, 4.0),
+    "UnsharpMaskFilter":       (SPATIAL, lambda params: 1.0 + blurCost(params.get("inputRadius", 4.0))),
+    "ClarityFilter":           (SPATIAL, 3.0 + 1.0 + blurCost(50.0)),
+    "FilmGrainFilter":         (SPATIAL, grainCost),
+    "AutoAdjustFilter":        (SPATIAL, 20.0),
+}
+
+# anything not in the table is assumed to be a single pointwise pass
+defaultCost = (POINTWISE, 1.0)
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="+", help="JSON preset files, or directories containing them")
+    parser.add_argument("--threshold", type=float, default=slowThreshold, help="cost above which a preset is slow")
+    parser.add_argument("--config", default=None, help="write the preset entries for defaultConfig.json to this file")
+    args = parser.parse_args()
+
+    presets = [ (key, presetCost(preset), preset) for key, preset in dedupFilters.readPresets(args.inputs) ]
+    presets.sort(key=lambda p: (-p[1]["estimate"], p[0]))
+    for key, cost, preset in presets:
+        costs = sorted((filterCost(f)[1], f.get("key")) for f in preset["filters"])
+        largest = ""
+        if len(costs) > 0:
+            largest = "%s %.1f" % (costs[-1][1], costs[-1][0])
+        print("%7.1f  %-9s %-4s %s  (largest: %s)" % (cost["estimate"], cost["class"], "slow" if isSlow(cost, args.threshold) else "",
+                                                       key, largest))
+    slow = sum(1 for key, cost, preset in presets if isSlow(cost, args.threshold))
+    print("%d presets, %d slow (cost above %g)" % (len(presets), slow, args.threshold))
+
+    if args.config is not None:
+        saveConfig(args.config, [ (key, preset) for key, cost, preset in sorted(presets, key=lambda p: p[0]) ], args.threshold)
+        print("Saved to: " + args.config)
+
+
+# ----------------------------
+
+
+# returns (class, cost) for a filter
+def filterCost(f):
+    cls, cost = filterCosts.get(f.get("key"), defaultCost)
+    if callable(cost):
+        cost = cost(dict((p["key"], p["val"]) for p in f.get("parameters", [])))
+    return (cls, cost)
+
+
+# returns the cost annotation for a preset: { "estimate": <total cost>, "class": "pointwise" or "spatial" }
+def presetCost(preset):
+    total = 0.0
+    cls = POINTWISE
+    for f in preset.get("filters", []):
+        filterClass, cost = filterCost(f)
+        total = total + cost
+        if (filterClass == SPATIAL) and (cost > 0.0):
+            cls = SPATIAL
+    return { "estimate": round(total, 2), "class": cls }
+
+
+def isSlow(cost, threshold=slowThreshold):
+    return cost["estimate"] > threshold
+
+
+# ----------------------------
+
+# Config entries, in the same form as the ones printed by genconvert.sh:
+#   { "key": "Amber", "title": "Amber", "slow": false, "show": true, "rating": 0 }
+# The key is the name of the JSON file (which is how the app finds the preset), and the title is the name of the preset, or
+# the key with spaces added before capital letters if the preset has no name
+
+
+# presets is a list of (key, preset), where key is the path of the preset relative to the output directory (without extension)
+def configEntries(presets, threshold=slowThreshold):
+    entries = []
+    for key, preset in presets:
+        cost = preset.get("cost")
+        if cost is None:
+            cost = presetCost(preset)
+        name = key.split("/")[-1]
+        title = preset.get("info", {}).get("name") or presetTitle(name)
+        entries.append({ "key": name, "title": title, "slow": isSlow(cost, threshold), "show": True, "rating": 0 })
+    return entries
+
+
+# the same as the title generated by genconvert.sh
+def presetTitle(key):
+    title = re.sub(r"(\S)([A-Z])", r"\1 \2", key)
+    return title.replace("- ", "-").replace("( ", "(").replace("& ", "&")
+
+
+# writes the entries as the "preset" section of a config file, one entry per line
+def saveConfig(path, presets, threshold=slowThreshold):
+    lines = [ "        " + json.dumps(entry) for entry in configEntries(presets, threshold) ]
+    with open(path, 'w') as f:
+        f.write('{\n    "preset": [\n' + ",\n".join(lines) + '\n    ]\n}\n')
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
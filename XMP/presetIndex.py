@@ -0,0 +1,273 @@
+#! /usr/bin/python
+
+# Similarity index over converted presets ("find presets like this one"). Each preset's filter chain is turned into a fixed
+# length feature vector (see featureNames): white balance, exposure, contrast and the other single value adjustments, the
+# tone curve and R/G/B curve points, the eight MultiBandHSV shifts, split toning, vignette, grain etc. Each feature is the
+# change from the 'no effect' value of its filter (so a preset without a filter has 0 for its features), divided by a
+# typical range so that the features are on roughly the same scale. If a filter appears more than once the changes add up.
+# Colour matrices (from --optimize) are included as the change from the identity matrix. Lookup tables (--lut) can't be
+# compared, so only the intensity of the lookup is a feature: convert without --lut to index the colour adjustments.
+
+# The vectors of all of the presets are kept in a single (NumPy) matrix, and a query is one matrix-vector product
+# (squared distance = |a|^2 - 2 a.b + |b|^2, with |a|^2 computed when the index is built) plus a partial sort, which takes
+# a few tens of microseconds for a few thousand presets.
+
+# The index is saved as a .npz file (keys, vectors and feature names). convertXMP.py --batch --index builds it from the
+# converted tree (indexName in the output directory).
+
+# Usage:
+#   python presetIndex.py build <preset directory> [...] [--output index.npz]    index the JSON presets in a tree
+#   python presetIndex.py query <index> <preset key or JSON file> [-k 10]         list the most similar presets
+#   python presetIndex.py bench <index> [--queries N]                             time queries for every preset in the index
+
+import os, os.path
+import sys
+import math
+import time
+import json
+import argparse
+
+import numpy as np
+
+import dedupFilters
+import optimizeChain
+
+
+indexName = "presetIndex.npz"
+indexVersion = 1
+
+defaultCount = 10
+
+bandNames = [ "Red", "Orange", "Yellow", "Green", "Aqua", "Blue", "Purple", "Magenta" ]
+curveX = optimizeChain.curveX
+
+# single value parameters: feature name -> (filter key, parameter, 'no effect' value, scale). The 'no effect' values come
+# from optimizeChain.identityParameters where they are defined there
+scalarFeatures = [
+    ("temperature",    "WhiteBalanceFilter",      "inputTemperature",     6500.0, 2000.0),
+    ("tint",           "WhiteBalanceFilter",      "inputTint",            0.0,    50.0),
+    ("exposure",       "CIExposureAdjust",        "inputEV",              0.0,    1.0),
+    ("contrast",       "ContrastFilter",          "inputContrast",        1.0,    0.5),
+    ("clarity",        "ClarityFilter",           "inputClarity",         0.0,    1.0),
+    ("vibrance",       "CIVibrance",              "inputAmount",          0.0,    1.0),
+    ("saturation",     "SaturationFilter",        "inputSaturation",      1.0,    1.0),
+    ("sharpness",      "CISharpenLuminance",      "inputSharpness",       0.0,    1.0),
+    ("unsharpAmount",  "UnsharpMaskFilter",       "inputAmount",          0.0,    1.0),
+    ("unsharpRadius",  "UnsharpMaskFilter",       "inputRadius",          0.0,    10.0),
+    ("noiseLevel",     "CINoiseReduction",        "inputNoiseLevel",      0.0,    0.05),
+    ("noiseSharpness", "CINoiseReduction",        "inputSharpness",       0.0,    1.0),
+    ("shadows",        "CIHighlightShadowAdjust", "inputShadowAmount",    0.0,    1.0),
+    ("highlights",     "CIHighlightShadowAdjust", "inputHighlightAmount", 1.0,    1.0),
+    ("grainAmount",    "FilmGrainFilter",         "inputAmount",          0.0,    0.5),
+    ("grainSize",      "FilmGrainFilter",         "inputSize",            0.0,    1.0),
+    ("vignette",       "CenteredVignetteFilter",  "inputIntensity",       0.0,    1.0),
+    ("vignetteRadius", "CenteredVignetteFilter",  "inputRadius",          0.0,    1.0),
+    ("vignetteFalloff","CenteredVignetteFilter",  "inputFalloff",         0.0,    1.0),
+    ("lookup",         "YUCIColorLookup",         "inputIntensity",       0.0,    1.0),
+]
+
+# scale of the MultiBandHSV shifts (hue is a fraction of the colour wheel), for hue, saturation and value
+hsvScale = [ 0.1, 1.0, 1.0 ]
+
+# split toning hues are angles, so each of highlights and shadows is two features: saturation * (cos, sin) of the hue
+splitToning = [ ("highlight", "inputHighlightHue", "inputHighlightSaturation"),
+                ("shadow", "inputShadowHue", "inputShadowSaturation") ]
+
+
+def buildFeatureNames():
+    names = [ name for name, key, param, identity, scale in scalarFeatures ]
+    names.append("auto")
+    names.extend("toneCurve" + str(i) for i in range(len(curveX)))
+    for c in optimizeChain.channelNames:
+        names.extend("curve" + c + str(i) for i in range(len(curveX)))
+    for band in bandNames:
+        names.extend([ "hue" + band, "saturation" + band, "luminance" + band ])
+    for name, hue, saturation in splitToning:
+        names.extend([ name + "ToneA", name + "ToneB" ])
+    names.extend("colorMatrix" + str(i) for i in range(12))
+    return names
+
+featureNames = buildFeatureNames()
+featureIndex = dict((name, i) for i, name in enumerate(featureNames))
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    build = commands.add_parser("build", help="index the JSON presets found under one or more directories")
+    build.add_argument("inputs", nargs="+", help="directories containing the JSON preset files")
+    build.add_argument("--output", default=indexName, help="index file to create (default: " + indexName + ")")
+
+    query = commands.add_parser("query", help="list the presets that are most similar to a preset")
+    query.add_argument("index", help="index file")
+    query.add_argument("preset", help="key of a preset in the index, or a JSON preset file")
+    query.add_argument("-k", type=int, default=defaultCount, help="number of presets to list")
+
+    bench = commands.add_parser("bench", help="time a query for each preset in the index")
+    bench.add_argument("index", help="index file")
+    bench.add_argument("-k", type=int, default=defaultCount, help="number of presets to find for each query")
+    bench.add_argument("--queries", type=int, default=None, help="number of queries (default: one per preset)")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.time()
+        index = buildIndex(args.inputs)
+        index.save(args.output)
+        print("Saved to: %s (%d presets, %d features) in %.1f ms"
+              % (args.output, len(index), len(featureNames), 1000.0 * (time.time() - start)))
+
+    elif args.command == "query":
+        index = PresetIndex.load(args.index)
+        start = time.time()
+        if args.preset in index:
+            results = index.queryKey(args.preset, args.k)
+        elif os.path.isfile(args.preset):
+            with open(args.preset, 'r') as f:
+                preset = dedupFilters.resolvePreset(json.load(f), dedupFilters.findTable(os.path.dirname(args.preset)))
+            results = index.query(presetFeatures(preset), args.k)
+        else:
+            print("ERROR: " + args.preset + " is not in the index, and is not a file")
+            sys.exit(1)
+        elapsed = time.time() - start
+        for key, distance in results:
+            print("%8.4f  %s" % (distance, key))
+        print("(%d presets searched in %.3f ms)" % (len(index), 1000.0 * elapsed))
+
+    elif args.command == "bench":
+        index = PresetIndex.load(args.index)
+        count = len(index) if args.queries is None else args.queries
+        if (len(index) == 0) or (count <= 0):
+            print("Nothing to query")
+            return
+        keys = [ index.keys[i % len(index)] for i in range(count) ]
+        start = time.time()
+        for key in keys:
+            index.queryKey(key, args.k)
+        elapsed = time.time() - start
+        print("%d queries (k=%d) over %d presets: %.1f us/query" % (count, args.k, len(index), 1000000.0 * elapsed / count))
+
+
+# ----------------------------
+
+
+# returns the feature vector (a NumPy array, in the order of featureNames) for a preset (its filter chain)
+def presetFeatures(preset):
+    v = np.zeros(len(featureNames))
+    for f in preset.get("filters", []):
+        key = f.get("key")
+        # (some presets have empty parameter entries, which are skipped)
+        params = dict((p["key"], p["val"]) for p in f.get("parameters", []) if ("key" in p) and ("val" in p))
+
+        for name, filterKey, param, identity, scale in scalarFeatures:
+            if (filterKey == key) and (param in params):
+                v[featureIndex[name]] += (params[param] - identity) / scale
+
+        if key == "AutoAdjustFilter":
+            v[featureIndex["auto"]] += 1.0
+
+        elif key == "CIToneCurve":
+            for i in range(len(curveX)):
+                point = params.get("inputPoint" + str(i))
+                if point is not None:
+                    v[featureIndex["toneCurve" + str(i)]] += point[1] - curveX[i]
+
+        elif key == "RGBChannelToneCurve":
+            for c in optimizeChain.channelNames:
+                y = params.get("input" + c + "Yvalues", curveX)
+                for i in range(min(len(y), len(curveX))):
+                    v[featureIndex["curve" + c + str(i)]] += y[i] - curveX[i]
+
+        elif key == "MultiBandHSV":
+            for band in bandNames:
+                shift = params.get("input" + band + "Shift")
+                if shift is not None:
+                    start = featureIndex["hue" + band]
+                    v[start:start+3] += (np.asarray(shift, dtype=float) - [ 0.0, 1.0, 1.0 ]) / hsvScale
+
+        elif key == "SplitToningFilter":
+            for name, hue, saturation in splitToning:
+                angle = 2.0 * math.pi * params.get(hue, 0.0)
+                amount = params.get(saturation, 0.0)
+                v[featureIndex[name + "ToneA"]] += amount * math.cos(angle)
+                v[featureIndex[name + "ToneB"]] += amount * math.sin(angle)
+
+        elif key in [ "CIColorControls", "CIColorMatrix" ]:
+            start = featureIndex["colorMatrix0"]
+            m = optimizeChain.affineMatrix(f)
+            m[:, :3] -= np.eye(3)
+            v[start:start+12] += m.ravel()
+    return v
+
+
+def buildIndex(inputs):
+    keys = []
+    vectors = []
+    for key, preset in dedupFilters.readPresets(inputs):
+        keys.append(key)
+        vectors.append(presetFeatures(preset))
+    return PresetIndex(keys, vectors)
+
+
+# ----------------------------
+
+
+# k nearest neighbour (Euclidean distance) search over the feature vectors of a set of presets
+class PresetIndex(object):
+
+    def __init__(self, keys, vectors):
+        self.keys = list(keys)
+        self.vectors = np.asarray(vectors, dtype=float).reshape((len(self.keys), len(featureNames)))
+        self.norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        self.positions = dict((key, i) for i, key in enumerate(self.keys))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    # returns the k presets nearest to the feature vector, as a list of (key, distance), nearest first.
+    # exclude is the position of a preset to leave out (e.g. the one being queried)
+    def query(self, vector, k=defaultCount, exclude=None):
+        vector = np.asarray(vector, dtype=float)
+        distances = self.norms - 2.0 * np.dot(self.vectors, vector) + np.dot(vector, vector)
+        if exclude is not None:
+            distances[exclude] = np.inf
+        count = min(k, len(self.keys) - (0 if exclude is None else 1))
+        if count <= 0:
+            return []
+        nearest = np.argpartition(distances, count - 1)[:count]
+        nearest = nearest[np.argsort(distances[nearest], kind="stable")]
+        return [ (self.keys[i], math.sqrt(max(float(distances[i]), 0.0))) for i in nearest ]
+
+    # the k presets nearest to one in the index (not including itself)
+    def queryKey(self, key, k=defaultCount):
+        i = self.positions[key]
+        return self.query(self.vectors[i], k, exclude=i)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, version=np.array(indexVersion), keys=np.array(self.keys, dtype=str),
+                     vectors=self.vectors, features=np.array(featureNames, dtype=str))
+
+    @staticmethod
+    def load(path):
+        with np.load(path) as data:
+            if (int(data["version"]) != indexVersion) or (list(data["features"]) != featureNames):
+                raise ValueError("Index was built with different features (rebuild it): " + path)
+            return PresetIndex([ str(k) for k in data["keys"] ], data["vectors"])
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+#! /usr/bin/python
+
+# Preset pack files: many presets in one file, with an index so that any one preset can be found and decoded without reading
+# (or parsing) any of the others. The reader memory-maps the file, so only the pages that are actually touched are loaded.
+
+# Layout (all integers little-endian):
+#   header   magic "PXPK", version, preset count, number of hash slots, and the offsets of the sections below
+#   slots    hash table (crc32 of the key, linear probing). Each slot is 0 (empty) or 1 + the number of an entry
+#   entries  one fixed size record per preset, in key order: key offset/length, payload offset/length, codec and uncompressed length
+#   keys     the (utf-8) preset keys
+#   data     the payloads, i.e. the preset JSON in compact form (no whitespace), zlib compressed if that makes it smaller
+# The hash table is kept at most half full, so finding a key takes the same (small) number of reads whatever the size of the pack
+
+# Usage:
+#   python presetPack.py build <preset directory> <pack file> [--compress]     pack all of the JSON presets in a directory tree
+#   python presetPack.py build <preset directory> <output directory> --group   one pack per group (top level directory)
+#   python presetPack.py list <pack file>
+#   python presetPack.py get <pack file> <key>
+# (convertXMP.py can also write packs directly, see --pack)
+
+import os, os.path
+import sys
+import json
+import mmap
+import struct
+import zlib
+import argparse
+
+
+PACK_MAGIC = b"PXPK"
+PACK_VERSION = 1
+
+# magic, version, (unused), count, slots, slots offset, entries offset, keys offset, data offset
+HEADER = struct.Struct("<4sHHIIQQQQ")
+
+# key offset, key length, codec, (unused), payload offset, payload length, uncompressed length
+ENTRY = struct.Struct("<IHBxQII")
+
+SLOT = struct.Struct("<I")
+
+# payload encodings
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+
+packExtension = ".pack"
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    build = commands.add_parser("build", help="pack the JSON presets found under a directory")
+    build.add_argument("input", help="directory containing the JSON preset files")
+    build.add_argument("output", help="pack file to create (or output directory if --group is used)")
+    build.add_argument("--group", action="store_true", help="create a separate pack for each top level directory (group)")
+    build.add_argument("--compress", action="store_true", help="zlib compress the presets")
+
+    listCmd = commands.add_parser("list", help="list the presets in a pack")
+    listCmd.add_argument("pack", help="pack file")
+
+    get = commands.add_parser("get", help="print a preset from a pack")
+    get.add_argument("pack", help="pack file")
+    get.add_argument("key", help="preset key")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        presets = []
+        for path, key in findJSON(args.input):
+            with open(path, 'r') as f:
+                presets.append((key, compactJSON(json.load(f))))
+        for packFile, entries in groupPresets(presets, args.output, args.group):
+            writePack(packFile, entries, args.compress)
+            print("Saved to: " + packFile + " (" + str(len(entries)) + " presets)")
+
+    elif args.command == "list":
+        with PresetPack(args.pack) as pack:
+            for key in pack.keys():
+                print(key)
+
+    elif args.command == "get":
+        with PresetPack(args.pack) as pack:
+            if args.key not in pack:
+                print("ERROR: " + args.key + " not found in " + args.pack)
+                sys.exit(1)
+            print(json.dumps(pack.get(args.key), indent=2))
+
+
+# ----------------------------
+
+
+# returns the compact (no whitespace) JSON encoding of a preset, as stored in a pack
+def compactJSON(preset):
+    return json.dumps(preset, separators=(",", ":")).encode("utf-8")
+
+
+# writes a pack file. presets is a list of (key, JSON bytes) pairs
+def writePack(path, presets, compress=False):
+
+    presets = sorted(presets)
+    count = len(presets)
+
+    # hash table size: a power of 2, at least twice the number of presets
+    slots = 1
+    while slots < (2 * count):
+        slots = slots * 2
+
+    table = [0] * slots
+    keys = bytearray()
+    data = bytearray()
+    entries = bytearray()
+    for i, (key, payload) in enumerate(presets):
+        keyBytes = key.encode("utf-8")
+
+        slot = zlib.crc32(keyBytes) & (slots - 1)
+        while table[slot] != 0:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = i + 1
+
+        codec = CODEC_NONE
+        stored = payload
+        if compress:
+            packed = zlib.compress(payload, 9)
+            if len(packed) < len(payload):
+                codec = CODEC_ZLIB
+                stored = packed
+
+        entries.extend(ENTRY.pack(len(keys), len(keyBytes), codec, len(data), len(stored), len(payload)))
+        keys.extend(keyBytes)
+        data.extend(stored)
+
+    slotsOffset = HEADER.size
+    entriesOffset = slotsOffset + (slots * SLOT.size)
+    keysOffset = entriesOffset + len(entries)
+    dataOffset = keysOffset + len(keys)
+
+    # write to a temp file and rename, so that a reader never sees a partly written pack
+    if len(os.path.dirname(path)) > 0 and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(PACK_MAGIC, PACK_VERSION, 0, count, slots, slotsOffset, entriesOffset, keysOffset, dataOffset))
+        f.write(struct.pack("<" + str(slots) + "I", *table))
+        f.write(entries)
+        f.write(keys)
+        f.write(data)
+    os.replace(tmp, path)
+
+
+# splits a list of (key, data) pairs, with keys of the form group/name, into packs.
+# Returns a list of (pack file, presets). If group is False then everything goes into a single pack (output)
+def groupPresets(presets, output, group=False):
+    if not group:
+        return [ (output, presets) ]
+    groups = {}
+    for key, data in presets:
+        parts = key.split("/", 1)
+        if len(parts) == 1:
+            parts = [ "presets" ] + parts # not in a group
+        groups.setdefault(parts[0], []).append((parts[1], data))
+    return [ (os.path.join(output, name + packExtension), groups[name]) for name in sorted(groups.keys()) ]
+
+
+# finds the JSON files under a directory, returns a sorted list of (path, key), where the key is the path relative to the
+# directory, without the extension (and with "/" separators)
+def findJSON(srcdir):
+    fileList = []
+    for root, dirs, files in os.walk(srcdir):
+        for f in files:
+            if f.lower().endswith(".json"):
+                path = os.path.join(root, f)
+                key = os.path.splitext(os.path.relpath(path, srcdir))[0].replace(os.sep, "/")
+                fileList.append((path, key))
+    fileList.sort()
+    return fileList
+
+
+# ----------------------------
+
+
+# Reader for a pack file. Opening a pack only reads the header; each lookup reads a few hash slots, one entry and the payload
+class PresetPack(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # (empty file)
+            self.file.close()
+            raise ValueError("Not a preset pack: " + path)
+
+        if len(self.map) < HEADER.size:
+            self.close()
+            raise ValueError("Not a preset pack: " + path)
+        (magic, version, unused, self.count, self.slots,
+         self.slotsOffset, self.entriesOffset, self.keysOffset, self.dataOffset) = HEADER.unpack_from(self.map, 0)
+        if (magic != PACK_MAGIC) or (version != PACK_VERSION):
+            self.close()
+            raise ValueError("Not a preset pack (or unsupported version): " + path)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def __iter__(self):
+        return self.keys()
+
+    # returns the number of the entry for a key, or -1 if it isn't in the pack
+    def find(self, key):
+        keyBytes = key.encode("utf-8")
+        mask = self.slots - 1
+        slot = zlib.crc32(keyBytes) & mask
+        while True:
+            index = SLOT.unpack_from(self.map, self.slotsOffset + (slot * SLOT.size))[0]
+            if index == 0:
+                return -1
+            if self.entryKey(index - 1) == keyBytes:
+                return index - 1
+            slot = (slot + 1) & mask
+
+    def entry(self, index):
+        return ENTRY.unpack_from(self.map, self.entriesOffset + (index * ENTRY.size))
+
+    def entryKey(self, index):
+        keyOffset, keyLength, codec, dataOffset, dataLength, rawLength = self.entry(index)
+        start = self.keysOffset + keyOffset
+        return self.map[start:start+keyLength]
+
+    # generator for the keys, in sorted order
+    def keys(self):
+        for i in range(self.count):
+            yield self.entryKey(i).decode("utf-8")
+
+    # returns the (compact) JSON for a preset, as bytes
+    def getBytes(self, key):
+        index = self.find(key)
+        if index < 0:
+            raise KeyError(key)
+        keyOffset, keyLength, codec, dataOffset, dataLength, rawLength = self.entry(index)
+        start = self.dataOffset + dataOffset
+        payload = self.map[start:start+dataLength]
+        if codec == CODEC_ZLIB:
+            payload = zlib.decompress(payload, bufsize=rawLength)
+        elif codec != CODEC_NONE:
+            raise ValueError("Unknown codec (" + str(codec) + ") for " + key)
+        return payload
+
+    # returns a preset (as a map, i.e. the same as loading the JSON file)
+    def get(self, key):
+        return json.loads(self.getBytes(key))
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
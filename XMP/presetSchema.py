@@ -0,0 +1,294 @@
+#! /usr/bin/python
+
+# Validation of converted presets against the filters and parameters that the app understands. The filter keys, parameter
+# names, types, number of values and ranges are all defined in presetSchema.json (the one place to change when the app gets
+# a new filter or parameter). The definition is compiled once into a map of filter key -> checks, so validating a preset
+# is just a few dictionary lookups and comparisons per parameter.
+#
+# In batch mode (convertXMP.py --batch) every preset is validated before it is written, and a preset that doesn't match
+# the schema is reported as an error rather than being saved. Presets that pass are stamped with the hash of the schema:
+#
+#     { "key": ..., "info": ..., "filters": [ ... ], "validated": "<schema hash>" }
+#
+# so the app can skip its own checks for presets that were validated against the schema it was built with.
+#
+# The "legacy" section of the schema lists wider ranges for some parameters, for presets made before the converter kept them
+# in the app's range (older converter versions, hand made presets). They are only used when checking existing presets with
+# --legacy; batch mode, and the stamp it writes, always use the app's ranges.
+#
+# Usage: python presetSchema.py <directory or JSON file> [...] [--legacy]     (validates existing presets, and prints the
+#        errors. Presets that use shared filters, see dedupFilters.py, are checked with the references resolved)
+
+import os, os.path
+import sys
+import copy
+import functools
+import math
+import time
+import json
+import hashlib
+import argparse
+
+import dedupFilters
+
+
+schemaFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "presetSchema.json")
+
+# the extra (non-parameter) fields a filter can have
+filterFields = set([ "key", "parameters", "tables" ])
+
+# the types accepted as numbers in tables (not bool)
+numberTypes = set([ int, float ])
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="JSON preset files, or directories containing them")
+    parser.add_argument("--schema", default=schemaFile, help="schema definition (default: presetSchema.json)")
+    parser.add_argument("--legacy", action="store_true",
+                        help="also accept the wider legacy ranges, for presets made by older versions of the converter")
+    args = parser.parse_args()
+
+    start = time.time()
+    validator = Validator(loadSchema(args.schema), legacy=args.legacy)
+    compiled = time.time()
+
+    count = 0
+    invalid = 0
+    try:
+        for key, preset in dedupFilters.readPresets(args.paths):
+            count = count + 1
+            errors = validator.validate(preset)
+            if len(errors) > 0:
+                invalid = invalid + 1
+                for error in errors:
+                    print(key + ": " + error)
+    except (IOError, OSError, ValueError, KeyError) as e:
+        print("ERROR: could not read the presets: " + str(e))
+        sys.exit(1)
+    end = time.time()
+
+    print("Validated %d presets, %d invalid. Schema %s compiled in %.2f ms, reading and validation took %.2f ms"
+          % (count, invalid, validator.stamp, 1000.0 * (compiled - start), 1000.0 * (end - compiled)))
+    if invalid > 0:
+        sys.exit(1)
+
+
+# ----------------------------
+
+
+def loadSchema(path=schemaFile):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+# the validator for the schema in presetSchema.json (compiled once per process, when first used)
+@functools.lru_cache(maxsize=None)
+def defaultValidator():
+    return Validator(loadSchema())
+
+
+# Checks presets against a schema (the contents of presetSchema.json). With legacy set, the legacy ranges replace the
+# ones in the filter definitions
+class Validator(object):
+
+    def __init__(self, schema, legacy=False):
+        if legacy:
+            schema = legacySchema(schema)
+        # the stamp identifies the schema (any change to the definition changes the stamp)
+        canonical = json.dumps(schema, sort_keys=True, separators=(",", ":"))
+        self.stamp = hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:16]
+        self.info = set(schema.get("info", []))
+        self.filters = {}
+        for key, definition in schema["filters"].items():
+            self.filters[key] = compileFilter(key, definition, schema["types"])
+
+    # returns a list of errors (empty if the preset is valid)
+    def validate(self, preset):
+        errors = []
+        if not isinstance(preset.get("key"), str):
+            errors.append("preset has no key")
+        info = preset.get("info")
+        if not isinstance(info, dict):
+            errors.append("preset has no info")
+        else:
+            for name, value in info.items():
+                if name not in self.info:
+                    errors.append("unknown info field: " + str(name))
+                elif not isinstance(value, str):
+                    errors.append("info " + name + " is not a string")
+        filters = preset.get("filters")
+        if not isinstance(filters, list):
+            errors.append("preset has no filter list")
+            return errors
+
+        for index, f in enumerate(filters):
+            check = self.filters.get(f.get("key")) if isinstance(f, dict) else None
+            if check is None:
+                errors.append("filter %d: unknown filter: %s" % (index, str(f.get("key") if isinstance(f, dict) else f)))
+                continue
+            for error in check(f):
+                errors.append("filter %d (%s): %s" % (index, f["key"], error))
+        return errors
+
+    # validates the preset and adds the stamp. Raises ValueError (with all of the errors) if the preset isn't valid
+    def stampPreset(self, preset):
+        errors = self.validate(preset)
+        if len(errors) > 0:
+            raise ValueError("invalid preset: " + "; ".join(errors))
+        preset["validated"] = self.stamp
+        return preset
+
+
+# returns a copy of the schema with the legacy ranges ("filter.parameter" -> min and/or max) in place of the normal ones
+def legacySchema(schema):
+    schema = copy.deepcopy(schema)
+    for name, bounds in schema.get("legacy", {}).get("ranges", {}).items():
+        key, parameter = name.split(".", 1)
+        spec = schema["filters"].get(key, {}).get("parameters", {}).get(parameter)
+        if spec is None:
+            raise ValueError("schema: legacy range for an unknown parameter: " + name)
+        spec.update(bounds)
+    return schema
+
+
+# ----------------------------
+
+# Compiling the schema: each filter becomes a function that returns the list of errors for a filter entry, and each
+# parameter becomes a function that returns an error message (or None) for a value
+
+
+def compileFilter(key, definition, types):
+    parameters = {}
+    for name, spec in definition.get("parameters", {}).items():
+        if spec["type"] not in types:
+            raise ValueError("schema: unknown type " + spec["type"] + " for " + key + "." + name)
+        parameters[name] = (spec["type"], compileValue(spec, types[spec["type"]]))
+    required = tuple(sorted(name for name, spec in definition.get("parameters", {}).items() if not spec.get("optional", False)))
+    tables = compileTables(definition.get("tables"))
+
+    def check(f):
+        errors = []
+        for field in f:
+            if field not in filterFields:
+                errors.append("unknown field: " + str(field))
+        params = f.get("parameters", [])
+        if not isinstance(params, list):
+            return errors + [ "parameters is not a list" ]
+        seen = set()
+        for p in params:
+            if isinstance(p, dict) and len(p) == 0:
+                continue # (some presets have empty parameter entries, which the app ignores)
+            name = p.get("key") if isinstance(p, dict) else None
+            spec = parameters.get(name)
+            if spec is None:
+                errors.append("unknown parameter: " + str(name))
+                continue
+            if name in seen:
+                errors.append("duplicate parameter: " + name)
+            seen.add(name)
+            if p.get("type") != spec[0]:
+                errors.append("%s: type is %s, expected %s" % (name, str(p.get("type")), spec[0]))
+                continue
+            error = spec[1](p.get("val"))
+            if error is not None:
+                errors.append(name + ": " + error)
+        if len(seen) < len(required):
+            for name in required:
+                if name not in seen:
+                    errors.append("missing parameter: " + name)
+        if "tables" in f:
+            if tables is None:
+                errors.append("tables are not allowed")
+            else:
+                errors.extend(tables(f["tables"]))
+        return errors
+
+    return check
+
+
+def isNumber(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v)
+
+
+# returns the check for a parameter value. Ranges (min, max) are either a single number or a list with one per component
+def compileValue(spec, typeSpec):
+    kind = typeSpec["value"]
+    if kind == "string":
+        return lambda v: None if (isinstance(v, str) and len(v) > 0) else "expected a file name"
+
+    low = spec.get("min", -math.inf)
+    high = spec.get("max", math.inf)
+    if kind == "number":
+        def checkNumber(v):
+            if not isNumber(v):
+                return "expected a number, got " + json.dumps(v)
+            if v < low or v > high:
+                return "%s is out of range (%s..%s)" % (repr(v), repr(low), repr(high))
+            return None
+        return checkNumber
+
+    count = spec.get("count", typeSpec.get("count"))
+    if count is None:
+        raise ValueError("schema: no count for a vector parameter")
+    lows = tuple(low) if isinstance(low, list) else (low,) * count
+    highs = tuple(high) if isinstance(high, list) else (high,) * count
+    if len(lows) != count or len(highs) != count:
+        raise ValueError("schema: the range doesn't match the count")
+    bounds = tuple(zip(lows, highs))
+
+    def checkVector(v):
+        if not isinstance(v, list) or len(v) != count:
+            return "expected %d values, got %s" % (count, json.dumps(v))
+        for i, (x, (a, b)) in enumerate(zip(v, bounds)):
+            if not isNumber(x):
+                return "value %d is not a number: %s" % (i, json.dumps(x))
+            if x < a or x > b:
+                return "value %d: %s is out of range (%s..%s)" % (i, repr(x), repr(a), repr(b))
+        return None
+    return checkVector
+
+
+# checks a whole list of values at once (tables have up to 1024 values, so this avoids a Python call per value).
+# Any inf or nan makes the sum non-finite
+def numbersInRange(values, low, high):
+    if not set(map(type, values)) <= numberTypes:
+        return False
+    return math.isfinite(sum(values)) and (min(values) >= low) and (max(values) <= high)
+
+
+# returns the check for the "tables" of a curve filter (see curveTables.py), or None if the filter can't have tables
+def compileTables(spec):
+    if spec is None:
+        return None
+    names = set(spec["names"])
+    sizes = set(spec["sizes"])
+    low = spec.get("min", -math.inf)
+    high = spec.get("max", math.inf)
+
+    def check(tables):
+        if not isinstance(tables, dict):
+            return [ "tables is not a map" ]
+        errors = []
+        for name, values in tables.items():
+            if name not in names:
+                errors.append("unknown table: " + str(name))
+            elif not isinstance(values, list) or len(values) not in sizes:
+                errors.append("table %s: expected %s values" % (name, " or ".join(str(s) for s in sorted(sizes))))
+            elif not numbersInRange(values, low, high):
+                errors.append("table %s: values must be numbers in the range %s..%s" % (name, repr(low), repr(high)))
+        return errors
+
+    return check
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
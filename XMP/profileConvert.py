@@ -0,0 +1,208 @@
+#! /usr/bin/python
+
+# Profiling for the converter (see convertXMP.py --profile). For each file, and each step of the conversion within it (parse,
+# each of the process*/add* stages, the optimiser etc.), this records:
+#   - the wall time
+#   - the number of calls into the XMP settings (has, getFloat etc., i.e. what the stage asks of the XMP backend)
+#   - the peak (Python) memory allocated, on top of what was already in use when the step started (from tracemalloc)
+# The results are written as a JSON report (totals per stage, plus one entry per file) and as a trace file in the Chrome
+# trace event format, which can be loaded into chrome://tracing or https://ui.perfetto.dev to see the timeline (files and
+# their stages, one lane per worker process).
+
+# Note that tracemalloc slows down the conversion quite a bit, so the times are only useful relative to each other.
+
+# Usage: python profileConvert.py <report file> [--top N]     (prints a summary of a saved report)
+
+import os
+import sys
+import time
+import json
+import argparse
+import tracemalloc
+
+
+traceSuffix = ".trace.json"
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("report", help="profile report (JSON) written by convertXMP.py --profile")
+    parser.add_argument("--top", type=int, default=10, help="number of (slowest) files to list")
+    args = parser.parse_args()
+
+    with open(args.report, 'r') as f:
+        report = json.load(f)
+    printReport(report, args.top)
+
+
+# ----------------------------
+
+
+# Records the profile events for the files converted in one process. Attach it to a Converter (converter.profiler), which
+# then calls beginFile()/endFile() around each file and run() for each step
+class Profiler(object):
+
+    def __init__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.pid = os.getpid()
+        self.events = []
+        self.file = None
+
+    # starts the profile of a file (name is what identifies it in the report)
+    def beginFile(self, name):
+        current, peak = tracemalloc.get_traced_memory()
+        self.file = { "name": name, "start": time.perf_counter(), "base": current, "peak": current, "calls": 0 }
+
+    def endFile(self):
+        if self.file is None:
+            return
+        f = self.file
+        self.file = None
+        self.addEvent(f["name"], "file", f["start"], time.perf_counter() - f["start"],
+                      { "calls": f["calls"], "peakBytes": f["peak"] - f["base"] })
+
+    # runs one step of the conversion of the current file. The converter's settings are swapped for a counting proxy while it runs
+    def run(self, name, converter, function, args):
+        settings = converter.settings
+        counter = CountingSettings(settings)
+        converter.settings = counter
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            if converter.settings is counter: # (parse replaces the settings)
+                converter.settings = settings
+            eventArgs = { "calls": counter.calls, "peakBytes": peak - base }
+            if self.file is not None:
+                self.file["calls"] = self.file["calls"] + counter.calls
+                self.file["peak"] = max(self.file["peak"], peak)
+                eventArgs["file"] = self.file["name"]
+            self.addEvent(name, "stage", start, elapsed, eventArgs)
+
+    # events are kept in the Chrome trace format (times in microseconds)
+    def addEvent(self, name, category, start, elapsed, args):
+        self.events.append({ "name": name, "cat": category, "ph": "X", "pid": self.pid, "tid": 0,
+                             "ts": int(start * 1000000.0), "dur": int(elapsed * 1000000.0), "args": args })
+
+
+# Wraps a PresetSettings object (see xmpParser.py), counting the calls made to it
+class CountingSettings(object):
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self.settings, name)
+        if not callable(attr):
+            return attr
+        def counted(*args):
+            self.calls = self.calls + 1
+            return attr(*args)
+        return counted
+
+
+# ----------------------------
+
+
+# builds the report from the events of one or more Profilers. elapsed is the wall time of the whole run
+def buildReport(events, elapsed=None):
+    stages = {}
+    files = []
+    for event in events:
+        seconds = event["dur"] / 1000000.0
+        if event["cat"] == "file":
+            files.append({ "file": event["name"], "seconds": seconds, "calls": event["args"]["calls"],
+                           "peakBytes": event["args"]["peakBytes"] })
+        else:
+            entry = stages.setdefault(event["name"], { "seconds": 0.0, "count": 0, "calls": 0, "peakBytes": 0 })
+            entry["seconds"] = entry["seconds"] + seconds
+            entry["count"] = entry["count"] + 1
+            entry["calls"] = entry["calls"] + event["args"]["calls"]
+            entry["peakBytes"] = max(entry["peakBytes"], event["args"]["peakBytes"])
+
+    report = { "files": files, "stages": stages,
+               "total": { "files": len(files), "seconds": sum(f["seconds"] for f in files),
+                          "calls": sum(f["calls"] for f in files),
+                          "peakBytes": max([ f["peakBytes"] for f in files ] + [ 0 ]) } }
+    if elapsed is not None:
+        report["total"]["elapsed"] = elapsed
+    maxRSS = maxResidentSize()
+    if maxRSS is not None:
+        report["total"]["maxRSSBytes"] = maxRSS
+    return report
+
+
+# peak resident set size of this process and its (finished) workers, in bytes (None if the platform can't tell us)
+def maxResidentSize():
+    try:
+        import resource
+    except ImportError:
+        return None
+    size = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == "darwin":
+        return size # (already in bytes)
+    return size * 1024
+
+
+# writes the report to path, and the trace to the same name with traceSuffix (e.g. profile.json -> profile.trace.json).
+# Returns the name of the trace file
+def writeProfile(path, events, elapsed=None):
+    with open(path, 'w') as f:
+        f.write(json.dumps(buildReport(events, elapsed), indent=2, sort_keys=True) + "\n")
+
+    # make the timestamps relative to the first event, which makes the timeline easier to read
+    first = 0
+    if len(events) > 0:
+        first = min(event["ts"] for event in events)
+    trace = []
+    for event in events:
+        event = dict(event)
+        event["ts"] = event["ts"] - first
+        trace.append(event)
+    tracePath = traceName(path)
+    with open(tracePath, 'w') as f:
+        json.dump({ "traceEvents": trace, "displayTimeUnit": "ms" }, f)
+    return tracePath
+
+
+def traceName(path):
+    if path.lower().endswith(".json"):
+        path = path[:-len(".json")]
+    return path + traceSuffix
+
+
+# ----------------------------
+
+
+def printReport(report, top=10, out=sys.stdout):
+    total = report["total"]
+    out.write("Profile: %d files, %.3f s converting, %d settings calls, peak %.1f KB per file\n"
+              % (total["files"], total["seconds"], total["calls"], total["peakBytes"] / 1024.0))
+    stages = report["stages"]
+    out.write("    %-26s %10s %8s %10s %10s\n" % ("stage", "ms", "count", "calls", "peak KB"))
+    for name in sorted(stages.keys(), key=lambda n: -stages[n]["seconds"]):
+        entry = stages[name]
+        out.write("    %-26s %10.3f %8d %10d %10.1f\n"
+                  % (name, 1000.0 * entry["seconds"], entry["count"], entry["calls"], entry["peakBytes"] / 1024.0))
+    if top > 0:
+        out.write("Slowest files:\n")
+        for f in sorted(report["files"], key=lambda f: -f["seconds"])[:top]:
+            out.write("    %10.3f ms  %s\n" % (1000.0 * f["seconds"], f["file"]))
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#! /usr/bin/python
+
+# Checks the golden presets (jsonPresets, see benchConvert.py) against the original converter: convertXMP.py as it was at the
+# baseline commit, before the converter was restructured (python-xmp-toolkit for the XMP, scipy for the curves). The goldens
+# are written by the current converter (benchConvert.py --update-goldens), so on their own they only show that the converter
+# still agrees with itself; this shows that they also agree with the original one, within the same tolerance. With
+# --update, the goldens are written from the original converter instead.
+
+# The original script is taken from git and run once per preset, the way it was used (convertXMP.py input output). It
+# needs libxmp and the exempi library. Where exempi can't be installed, --parser stdlib answers the XMPMeta calls the script
+# makes from the property map of xmpParser.py instead: that checks everything except the XMP parsing itself (which
+# benchParsers.py compares, where libxmp is available).
+
+# The presets in xmpPresets/EdgeCases are left out: they cover cases whose output was changed on purpose after the baseline.
+
+# Usage: python referenceGoldens.py [directory...] [--goldens jsonPresets] [--commit 3a831ea] [--parser libxmp|stdlib] [--update]
+
+import os, os.path
+import sys
+import io
+import json
+import types
+import shutil
+import tempfile
+import argparse
+import subprocess
+import contextlib
+import runpy
+
+import convertXMP
+import benchConvert
+import xmpParser
+
+
+# the last commit with the original converter
+referenceCommit = "3a831ea"
+
+# groups (subdirectories of the inputs) that are not checked against the original converter
+newCases = set([ "EdgeCases" ])
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("inputs", nargs="*", default=["xmpPresets"], help="directories to search for XMP files")
+    parser.add_argument("--goldens", default="jsonPresets", help="directory containing the golden JSON presets")
+    parser.add_argument("--commit", default=referenceCommit, help="git commit to take the original convertXMP.py from")
+    parser.add_argument("--parser", choices=["libxmp", "stdlib"], default="libxmp",
+                        help="XMP parser for the original converter (stdlib if exempi can't be installed)")
+    parser.add_argument("--update", action="store_true", help="rewrite the golden presets from the original converter")
+    args = parser.parse_args()
+
+    if (args.parser == "libxmp") and not convertXMP.libxmpAvailable():
+        print("ERROR: libxmp (or the exempi library) is not available. Use --parser stdlib to check everything but the parsing")
+        sys.exit(1)
+
+    fileList = [ (src, golden) for src, golden in benchConvert.goldenPresets(args.inputs, args.goldens)
+                 if len(newCases.intersection(os.path.normpath(src).split(os.sep))) == 0 ]
+    if len(fileList) == 0:
+        print("ERROR: no XMP files found")
+        sys.exit(1)
+
+    workdir = tempfile.mkdtemp()
+    try:
+        script = referenceScript(args.commit, workdir)
+        checked = 0
+        mismatches = 0
+        for src, golden in fileList:
+            try:
+                preset = referencePreset(script, src, os.path.join(workdir, "preset.json"), args.parser)
+            except Exception as e:
+                print("ERROR: the original converter failed on " + src + ": " + str(e))
+                sys.exit(1)
+            preset["key"] = golden
+            checked = checked + 1
+
+            if args.update:
+                convertXMP.writePreset(golden, convertXMP.presetText(preset).encode("utf-8"))
+                continue
+            if not os.path.isfile(golden):
+                mismatches = mismatches + 1
+                print("No golden preset for: " + src)
+                continue
+            with open(golden, 'r') as f:
+                diffs = benchConvert.comparePresets(json.load(f), preset)
+            if len(diffs) > 0:
+                mismatches = mismatches + 1
+                print("MISMATCH: " + src + " (" + golden + ")")
+                for d in diffs:
+                    print("    " + d)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.update:
+        print("Goldens: %d written by the converter at %s (parser: %s)" % (checked, args.commit, args.parser))
+    else:
+        print("Goldens: %d checked against the converter at %s (parser: %s), %d mismatches"
+              % (checked, args.commit, args.parser, mismatches))
+        if mismatches > 0:
+            sys.exit(1)
+
+
+# ----------------------------
+
+
+# writes convertXMP.py at the commit to the directory, and returns its path
+def referenceScript(commit, directory):
+    scriptDir = os.path.dirname(os.path.abspath(__file__))
+    try:
+        source = subprocess.check_output([ "git", "show", commit + ":./convertXMP.py" ], cwd=scriptDir)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print("ERROR: could not get convertXMP.py at " + commit + " from git: " + str(e))
+        sys.exit(1)
+    path = os.path.join(directory, "convertXMP.py")
+    with open(path, 'wb') as f:
+        f.write(source)
+    return path
+
+
+# runs the original script on one preset and returns the preset it wrote. The script keeps its state in module globals and
+# converts when it is loaded, so it is run afresh for each preset (with its output to the console discarded)
+def referencePreset(script, src, dst, parserName):
+    savedArgv = sys.argv
+    savedLibxmp = sys.modules.get("libxmp")
+    sys.argv = [ script, src, dst ]
+    if parserName == "stdlib":
+        sys.modules["libxmp"] = types.SimpleNamespace(XMPMeta=PropertyMeta, XMPIterator=None, utils=None)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            runpy.run_path(script, run_name="__main__")
+    finally:
+        sys.argv = savedArgv
+        if savedLibxmp is not None:
+            sys.modules["libxmp"] = savedLibxmp
+        else:
+            sys.modules.pop("libxmp", None)
+    with open(dst, 'r') as f:
+        return json.load(f)
+
+
+# ----------------------------
+
+
+# The XMPMeta calls made by the original converter (all in the camera raw namespace), answered from the xmpParser property
+# map. Used by --parser stdlib
+class PropertyMeta(object):
+
+    def __init__(self):
+        self.props = {}
+
+    def parse_from_str(self, text):
+        self.props = xmpParser.parseProperties(text)
+
+    def does_property_exist(self, schema, name):
+        return name in self.props
+
+    def get_property(self, schema, name):
+        return self.props[name]
+
+    def get_property_float(self, schema, name):
+        return float(self.props[name])
+
+    def get_property_bool(self, schema, name):
+        return self.props[name].strip().lower() in ("true", "t", "1")
+
+    def count_array_items(self, schema, name):
+        return len(self.props.get(name, []))
+
+    # (indices start at 1, as in XMP)
+    def get_array_item(self, schema, name, index):
+        return self.props[name][index-1]
+
+    def get_localized_text(self, schema, name, genericLang, specificLang):
+        return self.props[name]
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
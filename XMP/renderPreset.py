@@ -0,0 +1,516 @@
+#! /usr/bin/python
+
+# Reference renderer for converted presets: applies the filters in a preset to an image using NumPy (whole image arrays,
+# no per-pixel python code), so that the effect of a preset can be checked without building and running the app.
+
+# The colour filters use the same models as lookupTable.py (which are ports of the app code where the filter is one of ours).
+# The Core Image filters (CIHighlightShadowAdjust, CIVibrance, CINoiseReduction etc.) are not documented in enough detail to
+# reproduce exactly, so those are approximations that produce the same kind of effect. FilmGrainFilter uses a fixed random
+# seed, so the output is repeatable. The results are close enough to compare presets and spot problems, but they are not
+# pixel-exact matches of the app.
+
+# As in the app, radii are in pixels, so effects such as sharpening look stronger on a small preview than on a full size photo.
+
+# Usage:
+#   python renderPreset.py <preset directory, JSON file or pack> <output directory> [--image <png file>] [--size 256]
+# This renders a thumbnail (PNG) of every preset, named after the preset key, plus the unmodified image (_original.png),
+# and then prints the throughput (megapixels/s) of each filter. If no image is given then a built-in test chart is used.
+# PNG images are read using the standard library; other formats need PIL (Pillow)
+
+import os, os.path
+import time
+import json
+import struct
+import zlib
+import functools
+import argparse
+
+import numpy as np
+
+import dedupFilters
+import lookupTable
+import optimizeChain
+import presetPack
+
+
+# default thumbnail size (longest side, in pixels)
+defaultSize = 256
+
+# random seed for the grain filters
+grainSeed = 1234
+
+lumaWeights = optimizeChain.lumaWeights
+
+
+# ----------------------------
+
+
+def main():
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input", help="directory of JSON presets, a single JSON preset or a preset pack")
+    parser.add_argument("output", help="directory for the thumbnails")
+    parser.add_argument("--image", default=None, help="source image (default: built-in test chart)")
+    parser.add_argument("--size", type=int, default=defaultSize, help="thumbnail size (longest side, in pixels)")
+    args = parser.parse_args()
+
+    if args.image is not None:
+        image = resizeImage(readImage(args.image), args.size)
+    else:
+        image = testImage(args.size)
+    writeImage(os.path.join(args.output, "_original.png"), image)
+
+    stats = {}
+    count = 0
+    failed = 0
+    start = time.time()
+    for key, preset, imageDir in findPresets(args.input):
+        try:
+            result = renderFilters(preset.get("filters", []), image, stats, imageDir)
+            writeImage(os.path.join(args.output, key + ".png"), result)
+            count = count + 1
+        except Exception as e:
+            print("ERROR: could not render " + key + ": " + str(e))
+            failed = failed + 1
+    elapsed = time.time() - start
+
+    printStats(stats)
+    print("Rendered: " + str(count) + " presets, Failed: " + str(failed))
+    print("Total time: %.3f s (%.1f presets/s)" % (elapsed, (count / elapsed) if elapsed > 0.0 else 0.0))
+
+
+# generator for (key, preset, directory containing any images used by the preset) for each preset in a directory tree,
+# JSON file or pack file. References to shared filters (see dedupFilters.py) are resolved
+def findPresets(path):
+    if os.path.isdir(path):
+        table = dedupFilters.findTable(path)
+        for f, key in presetPack.findJSON(path):
+            if os.path.basename(f) == dedupFilters.sharedName:
+                continue
+            with open(f, 'r') as inf:
+                yield (key, dedupFilters.resolvePreset(json.load(inf), table), os.path.dirname(f))
+    elif path.endswith(presetPack.packExtension):
+        table = dedupFilters.findTable(os.path.dirname(path))
+        with presetPack.PresetPack(path) as pack:
+            for key in pack.keys():
+                yield (key, dedupFilters.resolvePreset(pack.get(key), table), os.path.dirname(path))
+    else:
+        table = dedupFilters.findTable(os.path.dirname(path))
+        with open(path, 'r') as inf:
+            yield (os.path.splitext(os.path.basename(path))[0], dedupFilters.resolvePreset(json.load(inf), table),
+                   os.path.dirname(path))
+
+
+def printStats(stats):
+    print("--------------------------------")
+    print("%-28s %8s %10s %10s" % ("Filter", "Count", "Time (s)", "MP/s"))
+    for key in sorted(stats.keys()):
+        seconds, pixels, count = stats[key]
+        rate = (pixels / 1.0e6 / seconds) if seconds > 0.0 else 0.0
+        print("%-28s %8d %10.3f %10.1f" % (key, count, seconds, rate))
+
+
+# ----------------------------
+
+
+# applies a list of filters (in the preset format) to an image (float array, shape (h, w, 3), values 0..1).
+# stats (optional) is a map of filter key -> [seconds, pixels, count], updated with the time taken by each filter.
+# imageDir is where any images used as parameters (e.g. lookup tables) are found. Filters that aren't supported are skipped
+# (and recorded in stats with a "(skipped)" suffix)
+def renderFilters(filters, image, stats=None, imageDir=None):
+    for f in filters:
+        key = f["key"]
+        renderer = renderers.get(key)
+        if renderer is None:
+            key = key + " (skipped)"
+            seconds = 0.0
+        else:
+            start = time.time()
+            image = renderer(f, image, imageDir)
+            seconds = time.time() - start
+        if stats is not None:
+            entry = stats.setdefault(key, [ 0.0, 0, 0 ])
+            entry[0] = entry[0] + seconds
+            entry[1] = entry[1] + (image.shape[0] * image.shape[1])
+            entry[2] = entry[2] + 1
+    return np.clip(image, 0.0, 1.0)
+
+
+def param(f, key, default=None):
+    return optimizeChain.param(f, key, default)
+
+
+# applies a pointwise function of an (n, 3) colour array to an image
+def pointwise(function, image):
+    return function(image.reshape((-1, 3))).reshape(image.shape)
+
+
+def luma(image):
+    return np.dot(image, lumaWeights)
+
+
+# (faster than np.max/np.min over the last axis, which is only 3 long)
+def maxChannel(image):
+    return np.maximum(np.maximum(image[..., 0], image[..., 1]), image[..., 2])
+
+
+def minChannel(image):
+    return np.minimum(np.minimum(image[..., 0], image[..., 1]), image[..., 2])
+
+
+# ----------------------------
+
+# Filters. Each takes the filter entry, the image and the image directory and returns the new image
+
+
+def renderColour(f, image, imageDir):
+    return pointwise(lambda c: lookupTable.applyFilters([ f ], c), image)
+
+
+def renderLookup(f, image, imageDir):
+    name = param(f, "inputColorLookupTable")
+    pixels = readLookup(os.path.join(imageDir or "", name))
+    intensity = param(f, "inputIntensity", 1.0)
+    result = pointwise(lambda c: lookupTable.applyLookup(pixels, c), image)
+    return image + ((result - image) * intensity)
+
+
+# CIVibrance: increases the saturation of the less saturated colours (approximation)
+def renderVibrance(f, image, imageDir):
+    return vibrance(image, param(f, "inputAmount", 0.0))
+
+
+def vibrance(image, amount):
+    y = luma(image)[..., np.newaxis]
+    saturation = (maxChannel(image) - minChannel(image))[..., np.newaxis]
+    return y + ((image - y) * (1.0 + (amount * (1.0 - saturation))))
+
+
+# CIPhotoEffectMono (approximation: luminance only)
+def renderMono(f, image, imageDir):
+    return np.repeat(luma(image)[..., np.newaxis], 3, axis=2)
+
+
+# CIHighlightShadowAdjust (approximation): shadowAmount (-1..1) lifts or darkens the dark tones and highlightAmount (0..1, 1 is
+# no change) darkens the light tones. The colours are scaled so that only the luminance changes
+def renderHighlightShadow(f, image, imageDir):
+    shadows = param(f, "inputShadowAmount", 0.0)
+    highlights = param(f, "inputHighlightAmount", 1.0)
+    y = np.clip(luma(image), 0.0, 1.0)
+    newY = y + (2.0 * shadows * y * (1.0 - y)**2) - (2.0 * (1.0 - highlights) * y**2 * (1.0 - y))
+    scale = np.where(y > 1.0e-6, newY / np.maximum(y, 1.0e-6), 1.0)
+    return image * scale[..., np.newaxis]
+
+
+# AutoAdjustFilter uses the adjustments suggested by Core Image for the image; approximated here by a levels stretch
+def renderAutoAdjust(f, image, imageDir):
+    low, high = np.percentile(luma(image), [ 0.5, 99.5 ])
+    if (high - low) < 1.0e-3:
+        return image
+    return (image - low) / (high - low)
+
+
+# UnsharpMaskFilter: same as the app (Gaussian blur, then the kernel in UnsharpMaskFilter.swift)
+def renderUnsharpMask(f, image, imageDir):
+    return unsharpMask(image, param(f, "inputAmount", 0.5), param(f, "inputRadius", 2.5), param(f, "inputThreshold", 0.0))
+
+
+def unsharpMask(image, amount, radius, threshold):
+    blurred = gaussianBlur(image, radius)
+    sharp = np.clip(image + ((image - blurred) * amount), 0.0, 1.0)
+    diff = image - blurred
+    mask = np.sqrt((diff[..., 0]**2) + (diff[..., 1]**2) + (diff[..., 2]**2)) > threshold
+    return np.where(mask[..., np.newaxis], sharp, image)
+
+
+# CISharpenLuminance (approximation): unsharp mask of the luminance, with Core Image's default radius
+def renderSharpenLuminance(f, image, imageDir):
+    y = luma(image)
+    detail = y - gaussianBlur(y, 1.69)
+    return image + (param(f, "inputSharpness", 0.4) * detail)[..., np.newaxis]
+
+
+# CINoiseReduction (approximation): smooths differences that are below the noise level, then sharpens the luminance
+def renderNoiseReduction(f, image, imageDir):
+    level = param(f, "inputNoiseLevel", 0.02)
+    blurred = gaussianBlur(image, 1.0)
+    weight = np.clip(1.0 - (np.abs(image - blurred) / max(level, 1.0e-6)), 0.0, 1.0)
+    smooth = image + ((blurred - image) * weight)
+    y = luma(smooth)
+    return smooth + (param(f, "inputSharpness", 0.4) * (y - gaussianBlur(y, 1.69)))[..., np.newaxis]
+
+
+# ClarityFilter: same steps as the app (vibrance, large radius unsharp mask, faded by the clarity and luminosity blended)
+def renderClarity(f, image, imageDir):
+    clarity = param(f, "inputClarity", 0.0)
+    opacity = min(max(clarity, 0.0), 1.0)
+    if opacity <= 0.0:
+        return image
+    contrasty = unsharpMask(vibrance(image, 0.2 * (1.0 + clarity)), 0.25, 50.0, 0.0)
+    return image + ((luminosityBlend(contrasty, image) - image) * opacity)
+
+
+# HighPassSharpeningFilter: same steps as the app (high pass, overlay blend, luminosity blend)
+def renderHighPassSharpening(f, image, imageDir):
+    y = luma(image - gaussianBlur(image, param(f, "inputRadius", 4.0)) + 0.5)
+    highpass = np.repeat(y[..., np.newaxis], 3, axis=2)
+    overlay = np.where(image < 0.5, 2.0 * image * highpass, 1.0 - (2.0 * (1.0 - image) * (1.0 - highpass)))
+    return luminosityBlend(overlay, image)
+
+
+# CenteredVignetteFilter: CIVignetteEffect centred on the image, with the radius as a fraction of the smaller side
+def renderCenteredVignette(f, image, imageDir):
+    radius = min(image.shape[0], image.shape[1]) * param(f, "inputRadius", 0.75)
+    return vignette(image, radius, param(f, "inputIntensity", 0.5), param(f, "inputFalloff", 0.25))
+
+
+# CIVignetteEffect. The app sets the centre and radius (position/distance parameters) from the image, so those are not used
+def renderVignetteEffect(f, image, imageDir):
+    radius = min(image.shape[0], image.shape[1]) / 2.0
+    return vignette(image, radius, param(f, "inputIntensity", 1.0), param(f, "inputFalloff", 0.5))
+
+
+# (approximation of CIVignetteEffect): darkens the image outside the radius, fading in over the falloff
+def vignette(image, radius, intensity, falloff):
+    h, w = image.shape[:2]
+    y, x = np.ogrid[0:h, 0:w]
+    d = np.sqrt(((x - (w / 2.0))**2) + ((y - (h / 2.0))**2)) / max(radius, 1.0)
+    edge0 = 1.0 - max(falloff, 1.0e-3)
+    t = np.clip((d - edge0) / (1.0 - edge0 + max(falloff, 1.0e-3)), 0.0, 1.0)
+    factor = 1.0 - (intensity * t * t * (3.0 - (2.0 * t)))
+    return image * factor[..., np.newaxis]
+
+
+# FilmGrainFilter (approximation): monochrome noise, blurred according to the grain size and added to the luminance.
+# Does nothing for small amounts or sizes, as in the app
+def renderFilmGrain(f, image, imageDir):
+    amount = param(f, "inputAmount", 0.5)
+    size = param(f, "inputSize", 0.5)
+    if (amount <= 0.01) or (size <= 0.01):
+        return image
+    noise = np.random.RandomState(grainSeed).standard_normal(image.shape[:2])
+    noise = gaussianBlur(noise, size)
+    noise = noise / max(float(np.std(noise)), 1.0e-6)
+    return image + (0.08 * amount * noise)[..., np.newaxis]
+
+
+renderers = { "CIExposureAdjust": renderColour,
+              "ContrastFilter": renderColour,
+              "SaturationFilter": renderColour,
+              "CIColorControls": renderColour,
+              "CIColorMatrix": renderColour,
+              "CIToneCurve": renderColour,
+              "RGBChannelToneCurve": renderColour,
+              "WhiteBalanceFilter": renderColour,
+              "MultiBandHSV": renderColour,
+              "SplitToningFilter": renderColour,
+              lookupTable.lookupFilterName: renderLookup,
+              "CIVibrance": renderVibrance,
+              "CIPhotoEffectMono": renderMono,
+              "CIHighlightShadowAdjust": renderHighlightShadow,
+              "AutoAdjustFilter": renderAutoAdjust,
+              "UnsharpMaskFilter": renderUnsharpMask,
+              "CISharpenLuminance": renderSharpenLuminance,
+              "CINoiseReduction": renderNoiseReduction,
+              "ClarityFilter": renderClarity,
+              "HighPassSharpeningFilter": renderHighPassSharpening,
+              "CenteredVignetteFilter": renderCenteredVignette,
+              "CIVignetteEffect": renderVignetteEffect,
+              "FilmGrainFilter": renderFilmGrain }
+
+
+# ----------------------------
+
+
+# CILuminosityBlendMode: the hue and saturation of the background with the luminance of the source
+# (SetLum/ClipColor from the W3C compositing spec)
+def luminosityBlend(source, background):
+    d = (luma(source) - luma(background))[..., np.newaxis]
+    c = background + d
+    y = luma(c)[..., np.newaxis]
+    n = minChannel(c)[..., np.newaxis]
+    x = maxChannel(c)[..., np.newaxis]
+    c = np.where(n < 0.0, y + ((c - y) * y / np.maximum(y - n, 1.0e-6)), c)
+    c = np.where(x > 1.0, y + ((c - y) * (1.0 - y) / np.maximum(x - y, 1.0e-6)), c)
+    return c
+
+
+# Gaussian blur, approximated by 3 box blurs in each direction (so the time doesn't depend on the radius).
+# The image is extended at the edges, as with clampedToExtent() in the app. Works on 2D or 3D (colour) arrays
+def gaussianBlur(image, sigma):
+    if sigma < 0.5:
+        return image
+    for axis in (0, 1):
+        for size in boxSizes(sigma, 3):
+            image = boxBlur(image, size // 2, axis)
+    return image
+
+
+# box widths (odd) for n box blurs that together approximate a Gaussian with the given sigma
+def boxSizes(sigma, n):
+    ideal = np.sqrt((12.0 * sigma * sigma / n) + 1.0)
+    lower = int(np.floor(ideal))
+    if (lower % 2) == 0:
+        lower = lower - 1
+    upper = lower + 2
+    m = int(round(((12.0 * sigma * sigma) - (n * lower * lower) - (4.0 * n * lower) - (3.0 * n)) / ((-4.0 * lower) - 4.0)))
+    return [ lower if i < m else upper for i in range(n) ]
+
+
+def boxBlur(image, r, axis):
+    if r < 1:
+        return image
+    pad = [ (0, 0) ] * image.ndim
+    pad[axis] = (r + 1, r)
+    c = np.cumsum(np.pad(image, pad, mode="edge"), axis=axis)
+    n = image.shape[axis]
+    upper = [ slice(None) ] * image.ndim
+    lower = [ slice(None) ] * image.ndim
+    upper[axis] = slice(2 * r + 1, 2 * r + 1 + n)
+    lower[axis] = slice(0, n)
+    return (c[tuple(upper)] - c[tuple(lower)]) / float(2 * r + 1)
+
+
+# ----------------------------
+
+# Images are float arrays of shape (h, w, 3), values 0..1
+
+
+# test chart: hue/brightness sweep, hue/saturation sweep, a grey ramp and some fine detail (for the sharpening filters)
+def testImage(size=defaultSize):
+    w = size
+    h = (size * 3) // 4
+    x = np.linspace(0.0, 1.0, w)[np.newaxis, :]
+    top = np.linspace(1.0, 0.2, h // 3)[:, np.newaxis]
+    hsv = np.stack(np.broadcast_arrays(x, 0.8, top), axis=2).reshape((-1, 3))
+    sweep1 = lookupTable.hsvToRGB(hsv).reshape((h // 3, w, 3))
+    sat = np.linspace(0.0, 1.0, h // 3)[:, np.newaxis]
+    hsv = np.stack(np.broadcast_arrays(x, sat, 0.9), axis=2).reshape((-1, 3))
+    sweep2 = lookupTable.hsvToRGB(hsv).reshape((h // 3, w, 3))
+    rows = h - (2 * (h // 3))
+    ramp = np.repeat(np.broadcast_to(x, (rows, w))[..., np.newaxis], 3, axis=2).copy()
+    yy, xx = np.mgrid[0:rows, 0:w]
+    checks = ((xx // 2) + (yy // 2)) % 2
+    detail = np.where(yy >= (rows // 2), 0.35 + (0.3 * checks), ramp[..., 0])
+    ramp[:, (w * 3) // 4:, :] = detail[:, (w * 3) // 4:, np.newaxis]
+    return np.concatenate([ sweep1, sweep2, ramp ], axis=0)
+
+
+# scales an image (down) so that the longest side is size, averaging the pixels that map onto each output pixel
+def resizeImage(image, size):
+    h, w = image.shape[:2]
+    scale = float(size) / max(h, w)
+    if scale >= 1.0:
+        return image
+    rows = np.floor(np.arange(max(1, int(round(h * scale)))) * (h / (h * scale))).astype(int)
+    cols = np.floor(np.arange(max(1, int(round(w * scale)))) * (w / (w * scale))).astype(int)
+    sums = np.add.reduceat(np.add.reduceat(image, rows, axis=0), cols, axis=1)
+    counts = np.outer(np.diff(np.append(rows, h)), np.diff(np.append(cols, w)))
+    return sums / counts[..., np.newaxis]
+
+
+def writeImage(path, image):
+    if len(os.path.dirname(path)) > 0 and not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    pixels = np.round(np.clip(image, 0.0, 1.0) * 255.0).astype(np.uint8)
+    with open(path, 'wb') as f:
+        f.write(lookupTable.encodePNG(pixels))
+
+
+# reads an image. PNG files are decoded here, anything else needs PIL
+def readImage(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        pixels = decodePNG(data)
+    else:
+        try:
+            from PIL import Image
+        except ImportError:
+            raise ValueError("Only PNG images can be read without PIL (Pillow): " + path)
+        pixels = np.asarray(Image.open(path).convert("RGB"))
+    return pixels.astype(float) / 255.0
+
+
+# (lookup tables are usually used by more than one render)
+@functools.lru_cache(maxsize=64)
+def readLookup(path):
+    with open(path, 'rb') as f:
+        return decodePNG(f.read())
+
+
+# decodes an 8-bit, non-interlaced PNG (grey, RGB, palette, or with alpha, which is ignored). Returns a (h, w, 3) uint8 array
+def decodePNG(data):
+    pos = 8
+    idat = []
+    palette = None
+    while pos < len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos+8])
+        body = data[pos+8:pos+8+length]
+        if kind == b"IHDR":
+            width, height, depth, colourType, compression, filterMethod, interlace = struct.unpack(">IIBBBBB", body)
+        elif kind == b"PLTE":
+            palette = np.frombuffer(body, dtype=np.uint8).reshape((-1, 3))
+        elif kind == b"IDAT":
+            idat.append(body)
+        elif kind == b"IEND":
+            break
+        pos = pos + length + 12
+    if (depth != 8) or (interlace != 0):
+        raise ValueError("Unsupported PNG (only 8 bits per channel, non-interlaced images are supported)")
+
+    channels = { 0: 1, 2: 3, 3: 1, 4: 2, 6: 4 }[colourType]
+    stride = width * channels
+    raw = np.frombuffer(zlib.decompress(b"".join(idat)), dtype=np.uint8).reshape((height, stride + 1))
+    rows = np.zeros((height, stride), dtype=np.uint8)
+    prior = np.zeros(stride, dtype=np.uint8)
+    for y in range(height):
+        rows[y] = unfilterRow(raw[y, 0], raw[y, 1:], prior, channels)
+        prior = rows[y]
+
+    pixels = rows.reshape((height, width, channels))
+    if colourType == 3:
+        return palette[pixels[..., 0]]
+    if channels <= 2:
+        return np.repeat(pixels[..., :1], 3, axis=2)
+    return pixels[..., :3]
+
+
+# reverses the PNG filter for one row. The sub and up filters are vectorised, average and paeth have to be done a pixel at a time
+def unfilterRow(kind, row, prior, bpp):
+    if kind == 0:
+        return row
+    if kind == 1:
+        return np.cumsum(row.reshape((-1, bpp)), axis=0, dtype=np.uint8).ravel()
+    if kind == 2:
+        return (row.astype(np.uint16) + prior).astype(np.uint8)
+    out = np.zeros(len(row), dtype=np.int32)
+    row = row.astype(np.int32)
+    prior = prior.astype(np.int32)
+    for i in range(len(row)):
+        a = out[i - bpp] if i >= bpp else 0
+        b = prior[i]
+        if kind == 3:
+            out[i] = (row[i] + ((a + b) // 2)) & 0xff
+        else:
+            c = prior[i - bpp] if i >= bpp else 0
+            p = a + b - c
+            pa = abs(p - a)
+            pb = abs(p - b)
+            pc = abs(p - c)
+            if (pa <= pb) and (pa <= pc):
+                predictor = a
+            elif pb <= pc:
+                predictor = b
+            else:
+                predictor = c
+            out[i] = (row[i] + predictor) & 0xff
+    return out.astype(np.uint8)
+
+
+# ----------------------------
+
+
+# execute main function
+if __name__ == "__main__":
+    main()
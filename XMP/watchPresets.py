@@ -0,0 +1,328 @@
+#! /usr/bin/python
+
+# Watch mode for the converter (convertXMP.py --batch --watch): keeps the converter loaded and reconverts XMP presets as they
+# change, so that an edit-and-check cycle doesn't pay for starting Python and loading numpy/libxmp each time.
+
+# Changes are picked up with inotify (Linux), or by polling the modification times of the files if inotify isn't available
+# (or --poll is used). Changes usually come in bursts (an editor saving, a copy of several files), so they are collected
+# until nothing has changed for --debounce seconds, and then only the affected presets are reconverted:
+#   - new or modified XMP files are converted to the destination tree (same names as --batch)
+#   - if an XMP file is deleted (or moved away), its JSON file is deleted too
+#   - if one of the converter's own source files changes (convertXMP.py, xmpParser.py etc., e.g. while tuning the constants
+#     used by the process*() stages), the converter is reloaded and every preset is reconverted
+# The time taken to reconvert each file, and the latency from the last change to the end of the reconversion, are printed.
+
+import os, os.path
+import sys
+import time
+import struct
+import select
+import importlib
+import traceback
+
+import convertXMP
+
+
+# converter modules, in the order in which they need to be reloaded (i.e. dependencies first)
+reloadModules = [ "xmpParser", "curves", "curveTables", "optimizeChain", "lookupTable", "dedupFilters", "presetSchema", "presetCost", "convertXMP" ]
+
+defaultDebounce = 0.25
+
+# how often the files are checked when polling (seconds)
+pollInterval = 0.5
+
+
+# ----------------------------
+
+
+# converts the tree (incrementally, using the manifest), then watches for changes until interrupted
+def watchTree(srcdir, dstdir, parser=convertXMP.defaultParser, optimize=None, lut=False, logLevel=convertXMP.defaultLogLevel,
+              manifestFile=None, debounce=defaultDebounce, poll=False, curveTable=None):
+
+    convertXMP.convertTree(srcdir, dstdir, 1, manifestFile, False, parser, None, False, optimize, lut, logLevel,
+                           curveTable=curveTable)
+
+    codeFiles = [ os.path.abspath(f) for f in convertXMP.versionFiles ]
+    watcher = None
+    if not poll:
+        try:
+            watcher = InotifyWatcher([ srcdir ], codeFiles)
+        except OSError as e:
+            print("inotify not available (" + str(e) + "), polling for changes instead")
+    if watcher is None:
+        watcher = PollingWatcher([ srcdir ], codeFiles)
+
+    session = WatchSession(srcdir, dstdir, parser, optimize, lut, logLevel, curveTable)
+    print("Watching: " + srcdir + " (" + watcher.name + ", debounce " + str(debounce) + " s). Press Ctrl-C to stop")
+
+    try:
+        while True:
+            changed = watcher.wait(None)
+            last = time.time()
+
+            # wait for the burst of changes to finish
+            while True:
+                more = watcher.wait(debounce)
+                if len(more) == 0:
+                    break
+                changed = changed | more
+                last = time.time()
+
+            session.update(changed, last)
+    except KeyboardInterrupt:
+        print("")
+    finally:
+        watcher.close()
+
+
+# ----------------------------
+
+
+# Holds the (warm) converter, and reconverts the files affected by a set of changes
+class WatchSession(object):
+
+    def __init__(self, srcdir, dstdir, parser, optimize, lut, logLevel, curveTable=None):
+        self.srcdir = srcdir
+        self.dstdir = dstdir
+        self.parser = parser
+        self.optimize = optimize
+        self.lut = lut
+        self.logLevel = logLevel
+        self.curveTable = curveTable
+        self.codeFiles = set(os.path.abspath(f) for f in convertXMP.versionFiles)
+        self.module = convertXMP
+        self.converter = self.newConverter()
+
+    def newConverter(self):
+        return self.module.Converter(self.parser, sys.stdout, self.optimize, self.lut, self.logLevel, self.curveTable)
+
+    # changed is a set of paths (files that were created, modified, moved or deleted). last is the time of the last change
+    def update(self, changed, last):
+        start = time.time()
+        codeChanged = sorted(f for f in changed if os.path.abspath(f) in self.codeFiles)
+        if len(codeChanged) > 0:
+            print("--------------------------------")
+            print("Changed: " + ", ".join(os.path.basename(f) for f in codeChanged))
+            if not self.reload():
+                return
+            fileList = self.module.findPresets(self.srcdir, self.dstdir)
+            removed = []
+        else:
+            fileList = []
+            removed = []
+            for path in sorted(changed):
+                if not path.lower().endswith(".xmp"):
+                    continue
+                dst = self.module.presetOutput(self.srcdir, self.dstdir, path)
+                if dst is None:
+                    continue
+                if os.path.isfile(path):
+                    fileList.append((path, dst))
+                else:
+                    removed.append((path, dst))
+
+        if (len(fileList) == 0) and (len(removed) == 0):
+            return
+
+        failed = 0
+        for src, dst in fileList:
+            if not self.convertFile(src, dst):
+                failed = failed + 1
+        for src, dst in removed:
+            self.removeFile(src, dst)
+
+        end = time.time()
+        print("--------------------------------")
+        print("Reconverted: %d files, Removed: %d, Failed: %d in %.1f ms (%.1f ms after the last change)"
+              % (len(fileList) - failed, len(removed), failed, 1000.0 * (end - start), 1000.0 * (end - last)))
+
+    # converts one file with the warm converter. Returns False if it couldn't be converted
+    def convertFile(self, src, dst):
+        start = time.time()
+        try:
+            with open(src, 'rb') as f:
+                data = f.read()
+            preset = self.module.annotatePreset(self.converter.convert(data, dst, src))
+            self.module.writePreset(dst, self.module.presetText(preset).encode("utf-8"))
+            for name, image in self.converter.lookups:
+                self.module.writePreset(os.path.join(os.path.dirname(dst), name), image)
+        except Exception as e:
+            print("ERROR: could not convert " + src + ": " + str(e))
+            return False
+        print("Converted: %s -> %s (%.1f ms)" % (src, dst, 1000.0 * (time.time() - start)))
+        return True
+
+    def removeFile(self, src, dst):
+        try:
+            os.remove(dst)
+            print("Removed: " + dst + " (" + src + " was deleted)")
+        except OSError:
+            pass
+
+    # reloads the converter modules (after one of them has been edited). Returns False (and keeps the old ones) if that fails,
+    # e.g. because of a syntax error in a file that is still being edited
+    def reload(self):
+        start = time.time()
+        try:
+            for name in reloadModules:
+                if name in sys.modules:
+                    importlib.reload(sys.modules[name])
+            self.module = sys.modules["convertXMP"]
+            self.converter = self.newConverter()
+        except Exception:
+            print("ERROR: could not reload the converter, keeping the previous version:")
+            traceback.print_exc(limit=1)
+            return False
+        print("Reloaded converter (%.1f ms)" % (1000.0 * (time.time() - start)))
+        return True
+
+
+# ----------------------------
+
+
+# Linux inotify (through ctypes), watching directory trees (new sub-directories are added as they appear) and individual files
+class InotifyWatcher(object):
+
+    name = "inotify"
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0x00000800 # (same as O_NONBLOCK)
+
+    EVENT = struct.Struct("iIII") # wd, mask, cookie, length of the name
+
+    def __init__(self, directories, files):
+        import ctypes, ctypes.util
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not supported on this platform")
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self.watches = {} # watch descriptor -> directory
+        self.roots = list(directories)
+        self.files = set(os.path.abspath(f) for f in files)
+        self.mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_FROM | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        for directory in directories:
+            self.addTree(directory)
+        # the converter files are watched through their directories (editors often replace a file rather than writing to it)
+        for directory in sorted(set(os.path.dirname(f) for f in self.files)):
+            self.addDirectory(directory)
+
+    def addDirectory(self, directory):
+        if directory in self.watches.values():
+            return
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.mask)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    def addTree(self, directory):
+        for root, dirs, files in os.walk(directory):
+            self.addDirectory(root)
+
+    # returns the set of paths that changed, waiting for up to timeout seconds (None to wait until there is a change)
+    def wait(self, timeout):
+        changed = set()
+        while len(changed) == 0:
+            ready, w, x = select.select([ self.fd ], [], [], timeout)
+            if len(ready) == 0:
+                return changed
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                continue
+            changed = self.parseEvents(data)
+        return changed
+
+    def parseEvents(self, data):
+        changed = set()
+        offset = 0
+        while offset + self.EVENT.size <= len(data):
+            wd, mask, cookie, length = self.EVENT.unpack_from(data, offset)
+            offset = offset + self.EVENT.size
+            name = os.fsdecode(data[offset:offset+length].rstrip(b"\0"))
+            offset = offset + length
+
+            if mask & self.IN_Q_OVERFLOW:
+                # events were lost, so treat everything as changed
+                for root in self.roots:
+                    changed.update(findXMP(root))
+                continue
+            directory = self.watches.get(wd)
+            if (directory is None) or (len(name) == 0):
+                continue
+            path = os.path.join(directory, name)
+            if mask & self.IN_ISDIR:
+                # a new (or moved in) directory: watch it, and convert anything already in it
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO) and self.inTree(path):
+                    self.addTree(path)
+                    changed.update(findXMP(path))
+                continue
+            if self.inTree(path) or (os.path.abspath(path) in self.files):
+                changed.add(path)
+        return changed
+
+    def inTree(self, path):
+        path = os.path.abspath(path)
+        return any(path.startswith(os.path.join(os.path.abspath(root), "")) for root in self.roots)
+
+    def close(self):
+        os.close(self.fd)
+
+
+# Fallback for platforms without inotify: compares the modification times and sizes of the files every pollInterval seconds
+class PollingWatcher(object):
+
+    name = "polling"
+
+    def __init__(self, directories, files):
+        self.directories = list(directories)
+        self.files = list(files)
+        self.snapshot = self.scan()
+
+    def scan(self):
+        paths = list(self.files)
+        for directory in self.directories:
+            paths.extend(findXMP(directory))
+        snapshot = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+                snapshot[path] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+        return snapshot
+
+    def wait(self, timeout):
+        start = time.time()
+        while True:
+            snapshot = self.scan()
+            changed = set(path for path in set(snapshot.keys()) | set(self.snapshot.keys())
+                          if snapshot.get(path) != self.snapshot.get(path))
+            self.snapshot = snapshot
+            if len(changed) > 0:
+                return changed
+            if (timeout is not None) and (time.time() - start >= timeout):
+                return changed
+            delay = pollInterval
+            if timeout is not None:
+                delay = max(0.0, min(delay, timeout - (time.time() - start)))
+            time.sleep(delay)
+
+    def close(self):
+        pass
+
+
+def findXMP(directory):
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        for f in files:
+            if f.lower().endswith(".xmp"):
+                paths.append(os.path.join(root, f))
+    return paths
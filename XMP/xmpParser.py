@@ -0,0 +1,349 @@
+#! /usr/bin/python
+
+# Pure python (standard library only) parser for the camera raw settings in an XMP file.
+# This is an alternative to python-xmp-toolkit, which needs the exempi C library and builds a full XMPMeta object for each file,
+# when all we want is a few hundred crs: properties.
+
+# The XMP is read incrementally (see PropertyTarget) and the crs: properties are put into a plain map of name -> value, where:
+#   - simple properties (attribute or element form) are strings, e.g. "Exposure2012": "+0.35"
+#   - ordered/unordered arrays (rdf:Seq, rdf:Bag) are lists, e.g. "ToneCurvePV2012": ["0, 0", "128, 140", "255, 255"]
+#   - localized text (rdf:Alt) is the x-default (or first) string, e.g. "Name": "Tijuana"
+#   - structs are maps of field name -> value
+# Property names do not include the namespace prefix.
+
+# PresetSettings is the (typed) snapshot of those properties that the conversion stages in convertXMP.py read from
+
+# splitDocuments() splits a stream containing several XMP documents (e.g. stdin when streaming presets) into the individual documents
+
+import re
+import xml.etree.ElementTree as ET
+
+
+XMP_NS_CAMERA_RAW = "http://ns.adobe.com/camera-raw-settings/1.0/"
+XMP_NS_RDF = "http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+XMP_NS_XML = "http://www.w3.org/XML/1998/namespace"
+
+# element tags and attribute names, in ElementTree {namespace}name format
+CRS = "{" + XMP_NS_CAMERA_RAW + "}"
+RDF_RDF = "{" + XMP_NS_RDF + "}RDF"
+RDF_DESCRIPTION = "{" + XMP_NS_RDF + "}Description"
+RDF_SEQ = "{" + XMP_NS_RDF + "}Seq"
+RDF_BAG = "{" + XMP_NS_RDF + "}Bag"
+RDF_ALT = "{" + XMP_NS_RDF + "}Alt"
+RDF_LI = "{" + XMP_NS_RDF + "}li"
+XML_LANG = "{" + XMP_NS_XML + "}lang"
+
+# crs: properties that none of the conversion stages read, and which can be very large (local correction masks and brush
+# strokes, spot removal, red eye). These are skipped by the parser, as is everything outside the crs: namespace
+skippedProperties = set([ "PaintBasedCorrections", "GradientBasedCorrections", "CircularGradientBasedCorrections",
+                          "MaskGroupBasedCorrections", "RetouchAreas", "RetouchInfo", "RedEyeInfo" ])
+
+# number of bytes (or characters) passed to the XML parser at a time
+FEED_SIZE = 65536
+
+
+# ----------------------------
+
+
+# parses the supplied XMP (a string, bytes or a binary file object) and returns the map of crs: properties
+def parseProperties(source):
+
+    target = PropertyTarget()
+    parser = ET.XMLParser(target=target)
+
+    # the input is fed to the parser a block at a time, so a file object is never read into memory as a whole
+    if hasattr(source, "read"):
+        while True:
+            block = source.read(FEED_SIZE)
+            if len(block) == 0:
+                break
+            parser.feed(block)
+    else:
+        for start in range(0, len(source), FEED_SIZE):
+            parser.feed(source[start:start+FEED_SIZE])
+
+    return parser.close()
+
+
+# Parser target (see ElementTree.XMLParser) that receives the parse events and only builds elements for the crs: properties.
+# Everything else that is a property of a top level description (thumbnails, history and other namespaces), and the crs:
+# properties in skippedProperties, is skipped as it is parsed: the elements are never created and their text is dropped, so
+# the memory used doesn't depend on how big those are (large attribute values still have to be read by expat as a whole)
+class PropertyTarget(object):
+
+    def __init__(self):
+        self.props = {}
+        self.path = []      # tags of the currently open elements (not including skipped ones)
+        self.skipping = 0   # depth within a skipped property (0 if not skipping)
+        self.builder = None # builds the elements of the property currently being read
+
+    def start(self, tag, attrib):
+        if self.skipping > 0:
+            self.skipping = self.skipping + 1
+            return
+
+        if self.builder is not None:
+            self.builder.start(tag, attrib)
+        elif self.inDescription():
+            # element form: a direct child of a top level description
+            if (not tag.startswith(CRS)) or (tag[len(CRS):] in skippedProperties):
+                self.skipping = 1
+                return
+            self.builder = ET.TreeBuilder()
+            self.builder.start(tag, attrib)
+        elif (tag == RDF_DESCRIPTION) and (len(self.path) > 0) and (self.path[-1] == RDF_RDF):
+            # attribute form. Only look at top level descriptions (i.e. not structs)
+            for key, value in attrib.items():
+                if key.startswith(CRS):
+                    self.props[key[len(CRS):]] = value
+        self.path.append(tag)
+
+    def end(self, tag):
+        if self.skipping > 0:
+            self.skipping = self.skipping - 1
+            return
+
+        self.path.pop()
+        if self.builder is not None:
+            self.builder.end(tag)
+            if self.inDescription():
+                # the property is complete
+                elem = self.builder.close()
+                self.props[elem.tag[len(CRS):]] = elementValue(elem)
+                self.builder = None
+
+    # True if the current element is a top level description (i.e. its children are properties)
+    def inDescription(self):
+        return (len(self.path) > 1) and (self.path[-1] == RDF_DESCRIPTION) and (self.path[-2] == RDF_RDF)
+
+    def data(self, text):
+        if self.builder is not None:
+            self.builder.data(text)
+
+    def close(self):
+        return self.props
+
+
+# returns the value of a property element (simple, array, localized text or struct)
+def elementValue(elem):
+
+    children = list(elem)
+
+    if len(children) == 0:
+        # simple value, or a struct expressed as attributes
+        fields = structAttributes(elem)
+        if len(fields) > 0:
+            return fields
+        return elem.text or ""
+
+    child = children[0]
+
+    if child.tag == RDF_ALT:
+        # localized text. Use x-default if present, otherwise the first entry
+        items = child.findall(RDF_LI)
+        for item in items:
+            if item.get(XML_LANG) == "x-default":
+                return item.text or ""
+        if len(items) > 0:
+            return items[0].text or ""
+        return ""
+
+    if (child.tag == RDF_SEQ) or (child.tag == RDF_BAG):
+        return [ elementValue(item) for item in child.findall(RDF_LI) ]
+
+    # struct, either as an rdf:Description or using rdf:parseType="Resource"
+    if child.tag == RDF_DESCRIPTION:
+        elem = child
+    fields = structAttributes(elem)
+    for field in elem:
+        fields[localName(field.tag)] = elementValue(field)
+    return fields
+
+
+# returns the non-rdf attributes of an element as struct fields
+def structAttributes(elem):
+    fields = {}
+    for key, value in elem.attrib.items():
+        if (not key.startswith("{" + XMP_NS_RDF)) and (key != XML_LANG):
+            fields[localName(key)] = value
+    return fields
+
+
+# strips the {namespace} from an ElementTree tag
+def localName(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+# ----------------------------
+
+# A stream of XMP documents can either be separated by NUL bytes, or just concatenated, in which case each document ends with
+# either the xpacket trailer (for documents that start with an xpacket header) or the closing x:xmpmeta tag.
+# Only the current document is held in memory, so any number of documents can be streamed through
+
+
+# end of a document that starts with an xpacket header, or a NUL separator
+PACKET_END = re.compile(rb"\x00|<\?xpacket\s+end\s*=\s*['\"][rw]['\"]\s*\?>")
+
+# end of a document without an xpacket header (x:xapmeta is the pre-2002 name), or a NUL separator
+XMPMETA_END = re.compile(rb"\x00|</x:x[ma]pmeta\s*>")
+
+# amount of the buffer that is searched again after reading more, in case an end marker is split across reads
+MARKER_OVERLAP = 64
+
+
+# generator that reads a binary stream and yields each XMP document (as bytes). Empty documents are skipped
+def splitDocuments(stream, chunkSize=65536):
+
+    # read1 returns whatever is available, so documents are passed on as soon as they arrive (e.g. from a pipe)
+    read = getattr(stream, "read1", stream.read)
+
+    buf = bytearray()
+    start = 0 # position in buf to search from
+    eof = False
+
+    while True:
+        # skip any whitespace between documents
+        if start == 0:
+            skip = len(buf) - len(buf.lstrip())
+            if skip > 0:
+                del buf[:skip]
+
+        match = None
+        if len(buf) >= 9:
+            if buf.startswith(b"<?xpacket"):
+                match = PACKET_END.search(buf, start)
+            else:
+                match = XMPMETA_END.search(buf, start)
+
+        if match is not None:
+            if match.group() == b"\x00":
+                doc = bytes(buf[:match.start()])
+            else:
+                doc = bytes(buf[:match.end()])
+            del buf[:match.end()]
+            start = 0
+            if len(doc.strip()) > 0:
+                yield doc
+            continue
+
+        if eof:
+            break
+        chunk = read(chunkSize)
+        if len(chunk) == 0:
+            eof = True
+            continue
+        if len(buf) >= 9:
+            start = max(0, len(buf) - MARKER_OVERLAP)
+        buf.extend(chunk)
+
+    # anything left over is the last document (e.g. if it has no end marker)
+    if len(buf.strip()) > 0:
+        yield bytes(buf)
+
+
+# ----------------------------
+
+
+# builds the same property map from a (parsed) libxmp XMPMeta object. Used for checking that the two parsers agree
+def libxmpProperties(xmp):
+
+    from libxmp import XMPIterator
+
+    props = {}
+    for schema, name, value, options in XMPIterator(xmp, XMP_NS_CAMERA_RAW, iter_justchildren=True):
+        if (len(name) == 0) or options['IS_SCHEMA']:
+            continue
+        key = name.split(":", 1)[-1]
+        if key in skippedProperties:
+            continue
+        if options['ARRAY_IS_ALTTEXT']:
+            props[key] = xmp.get_localized_text(XMP_NS_CAMERA_RAW, key, "", "x-default")
+        elif options['VALUE_IS_ARRAY']:
+            count = xmp.count_array_items(XMP_NS_CAMERA_RAW, key)
+            props[key] = [ xmp.get_array_item(XMP_NS_CAMERA_RAW, key, i) for i in range(1, (count+1)) ]
+        elif options['VALUE_IS_STRUCT']:
+            props[key] = {}
+            for _, fname, fvalue, foptions in XMPIterator(xmp, XMP_NS_CAMERA_RAW, key, iter_justchildren=True):
+                if fname != name:
+                    props[key][fname.rsplit(":", 1)[-1]] = fvalue
+        else:
+            props[key] = value
+    return props
+
+
+# ----------------------------
+
+
+# Snapshot of the camera raw settings of a preset, built once from the property map so that the conversion stages don't have to
+# go back to the parser for each key. Values are split by type up front (numbers are converted once), and the keys that changed
+# in 2012 (e.g. Exposure vs Exposure2012) are resolved so that each stage just asks for the 'logical' name.
+
+# logical name -> list of keys, in order of preference (the first one present in the preset is used)
+settingsAliases = {
+    "Exposure":      [ "Exposure", "Exposure2012" ],
+    "Contrast":      [ "Contrast", "Contrast2012" ],
+    "Highlights":    [ "Highlights", "Highlights2012" ],
+    "Shadows":       [ "Shadows", "Shadows2012" ],
+    "Whites":        [ "Whites", "Whites2012" ],
+    "Blacks":        [ "Blacks", "Blacks2012" ],
+    "Clarity":       [ "Clarity", "Clarity2012" ],
+    "ToneCurveName": [ "ToneCurveName", "ToneCurveName2012" ],
+    "ToneCurve":     [ "ToneCurve", "ToneCurvePV2012" ],
+    "ToneCurveRed":  [ "ToneCurvePVRed", "ToneCurvePV2012Red" ],
+    "ToneCurveGreen":[ "ToneCurvePVGreen", "ToneCurvePV2012Green" ],
+    "ToneCurveBlue": [ "ToneCurvePVBlue", "ToneCurvePV2012Blue" ],
+}
+
+
+class PresetSettings(object):
+
+    def __init__(self, props=None):
+        if props is None:
+            props = {}
+        self.props = props
+        self.text = {}    # simple (string) values
+        self.numbers = {} # simple values that are numbers, converted to float
+        self.arrays = {}  # arrays (lists of strings or structs)
+
+        for key, value in props.items():
+            if isinstance(value, str):
+                self.text[key] = value
+                try:
+                    self.numbers[key] = float(value)
+                except ValueError:
+                    pass
+            elif isinstance(value, list):
+                self.arrays[key] = value
+
+        # resolve the old/new key names
+        self.resolved = {}
+        for name, keys in settingsAliases.items():
+            for key in keys:
+                if key in props:
+                    self.resolved[name] = key
+                    break
+
+    # returns the key actually used in the preset for a logical name (see settingsAliases), or None if not present
+    def resolve(self, name):
+        return self.resolved.get(name)
+
+    def has(self, key):
+        return key in self.props
+
+    def getFloat(self, key):
+        if key not in self.numbers:
+            raise ValueError("Not a number: " + key)
+        return self.numbers[key]
+
+    def getText(self, key):
+        return self.text.get(key, "")
+
+    def getBool(self, key):
+        return self.getText(key).strip().lower() in ("true", "t", "1")
+
+    def getArray(self, key):
+        return self.arrays.get(key, [])
+
+    # returns a curve (an array of "x, y" strings) as a list of [x, y] float pairs
+    def getPoints(self, key):
+        return [ list(map(float, item.split(","))) for item in self.getArray(key) ]
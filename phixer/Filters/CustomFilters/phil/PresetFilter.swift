@@ -8,6 +8,7 @@
 
 import Foundation
 import CoreImage
+import UIKit
 import SwiftyJSON
 
 
@@ -32,6 +33,12 @@ class PresetFilter: CIFilter {
 
     private var opacityFilter:CIFilter? = CIFilter(name: "OpacityFilter")
 
+    // images used as filter parameters (e.g. lookup tables), so that they are only loaded once
+    private var imageCache:[String:CIImage] = [:]
+
+    // filter definitions shared by several presets (see XMP/dedupFilters.py), loaded once, when first needed
+    private static var sharedStages:[String:JSON]? = nil
+
     
     // default settings
     override func setDefaults() {
@@ -180,6 +187,11 @@ class PresetFilter: CIFilter {
                             case .string:
                                 //log.verbose("...arg: \(p["key"]) val:\(p["val"]) type:\(p["type"])")
                                 filter?.setValue(p["val"], forKey: pkey)
+                            case .image:
+                                // the name of an image in the bundle, e.g. a lookup table created by the preset converter
+                                if let image = loadImage(name: p["val"].stringValue) {
+                                    filter?.setValue(image, forKey: pkey)
+                                }
                             default:
                                 // just ignore
                                 log.warning("Ignoring parameter:\(pkey), type:\(ptype) for filter:\(fkey)")
@@ -240,6 +252,61 @@ class PresetFilter: CIFilter {
     }
 
     
+    // loads an image (parameter) from the bundle. name includes the extension
+    private func loadImage(name: String) -> CIImage? {
+        if let image = imageCache[name] {
+            return image
+        }
+        
+        let l = name.components(separatedBy: ".")
+        guard l.count == 2, let path = Bundle.main.path(forResource: l[0], ofType: l[1]) else {
+            log.error("ERROR: image file not found: \(name) (preset: \(presetFile))")
+            return nil
+        }
+        guard let uiimage = UIImage(contentsOfFile: path), let image = CIImage(image: uiimage) else {
+            log.error("ERROR: could not load image: \(name) (preset: \(presetFile))")
+            return nil
+        }
+        imageCache[name] = image
+        return image
+    }
+    
+    
+    // replaces any references to shared filter definitions ({ "ref": <hash> }) with the definitions themselves
+    private func resolveSharedFilters() {
+        var filters = parsedConfig["filters"].arrayValue
+        guard filters.contains(where: { $0["ref"].exists() }) else {
+            return
+        }
+        for i in 0..<filters.count {
+            let ref = filters[i]["ref"].stringValue
+            if !ref.isEmpty {
+                if let stage = PresetFilter.sharedStage(ref) {
+                    filters[i] = stage
+                } else {
+                    log.error("ERROR: shared filter not found: \(ref) (preset: \(presetFile))")
+                }
+            }
+        }
+        parsedConfig["filters"] = JSON(filters)
+    }
+    
+    
+    private static func sharedStage(_ ref: String) -> JSON? {
+        if sharedStages == nil {
+            sharedStages = [:]
+            if let path = Bundle.main.path(forResource: "sharedFilters", ofType: "json"),
+               let data = FileManager.default.contents(atPath: path),
+               let table = try? JSON(data: data) {
+                sharedStages = table["stages"].dictionaryValue
+            } else {
+                log.error("ERROR: could not load shared filter definitions (sharedFilters.json)")
+            }
+        }
+        return sharedStages?[ref]
+    }
+    
+    
     private func loadPresetFile(name: String) {
         
         if !fileLoaded {
@@ -258,6 +325,7 @@ class PresetFilter: CIFilter {
                 if let data = fileContents.data(using: String.Encoding.utf8) {
                     //log.verbose("parsing data from: \(path!)")
                     parsedConfig = try JSON(data: data)
+                    resolveSharedFilters()
                     if (parsedConfig != JSON.null){
                         //log.verbose("parsing data")
                         //log.verbose ("\(parsedConfig)")